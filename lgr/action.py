@@ -4,11 +4,11 @@ action.py - Definition of action structures.
 """
 import logging
 
+from lgr.trace import RuleTrace
 from lgr.utils import format_cp
 from lgr.exceptions import LGRFormatException
 
 logger = logging.getLogger(__name__)
-rule_logger = logging.getLogger('lgr-rule-logger')
 
 
 class Action(object):
@@ -55,7 +55,7 @@ class Action(object):
 
     def apply(self, label, disp_set, only_variants,
               rules_lookup, classes_lookup,
-              unicode_database):
+              unicode_database, trace=None, revision=None):
         """
         Apply an action to a label.
 
@@ -66,6 +66,8 @@ class Action(object):
         :param rules_lookup: Dictionary of defined rules in the LGR.
         :param classes_lookup: Dictionary of defined classes in the LGR.
         :param unicode_database: The Unicode Database used to process rules.
+        :param trace: The RuleTrace collecting the rule processing log.
+        :param revision: The revision of the LGR, see `Rule.get_pattern`.
         :return: The final label disposition,
                  None is no action applies to the label.
         :raises RuleError: If rule is invalid.
@@ -73,9 +75,12 @@ class Action(object):
 
         # RFC7940, section 8.3.  Determining a Disposition for a Label or Variant Label
         # Step 2
-        rule_logger.debug("Applying action %s on label '%s' "
-                          "with disposition set '%s'",
-                          self, format_cp(label), disp_set)
+        if trace is None:
+            trace = RuleTrace()
+        if trace.debug_enabled:
+            trace.debug("Applying action %s on label '%s' "
+                        "with disposition set '%s'",
+                        self, format_cp(label), disp_set)
 
         # First bullet
         rule_matched = True
@@ -83,17 +88,19 @@ class Action(object):
             rule = rules_lookup[self.match]
             rule_matched = rule.matches(label,
                                         rules_lookup, classes_lookup,
-                                        unicode_database)
-            rule_logger.info('Action %s: when rule matched: %s',
-                             self, rule_matched)
+                                        unicode_database, trace=trace,
+                                        revision=revision)
+            trace.info('Action %s: when rule matched: %s',
+                       self, rule_matched)
         # Second bullet
         elif self.not_match is not None:
             rule = rules_lookup[self.not_match]
             rule_matched = not rule.matches(label,
                                             rules_lookup, classes_lookup,
-                                            unicode_database)
-            rule_logger.info('Action %s: not-when rule matched: %s',
-                             self, rule_matched)
+                                            unicode_database, trace=trace,
+                                            revision=revision)
+            trace.info('Action %s: not-when rule matched: %s',
+                       self, rule_matched)
 
         # Third bullet
         variant_matched = True
@@ -101,8 +108,8 @@ class Action(object):
             # Any single match may trigger an action that contains
             # an "any-variant" attribute
             variant_matched = len(self.any_variant & disp_set) > 0
-            rule_logger.info('Action %s: any-variant matched: %s',
-                             self, variant_matched)
+            trace.info('Action %s: any-variant matched: %s',
+                       self, variant_matched)
         # Fourth bullet
         elif self.all_variants is not None:
             # For an "all-variants" attribute,
@@ -110,8 +117,8 @@ class Action(object):
             # several of the types values specified in to trigger the action.
             variant_matched = (len(disp_set) > 0
                                and disp_set.issubset(self.all_variants))
-            rule_logger.info('Action %s: all-variants matched: %s',
-                             self, variant_matched)
+            trace.info('Action %s: all-variants matched: %s',
+                       self, variant_matched)
         # Fifth bullet
         elif self.only_variants is not None:
             # For an "only-variants" attribute,
@@ -125,16 +132,16 @@ class Action(object):
             variant_matched = (only_variants
                                and len(disp_set) > 0
                                and disp_set.issubset(self.only_variants))
-            rule_logger.info('Action %s: only-variants matched: %s',
-                             self, variant_matched)
+            trace.info('Action %s: only-variants matched: %s',
+                       self, variant_matched)
 
         # Last bullet: rule_matched and variant_matched are initialised to True
         if rule_matched and variant_matched:
-            rule_logger.info('Action %s triggered, disposition: %s',
-                             self, self.disp)
+            trace.info('Action %s triggered, disposition: %s',
+                       self, self.disp)
             return self.disp
 
-        rule_logger.info('Action %s not triggered', self)
+        trace.info('Action %s not triggered', self)
         return None
 
     def __repr__(self):
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+budget.py - Limits on the processing of a label.
+"""
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+
+from lgr.exceptions import BudgetExceeded
+
+logger = logging.getLogger(__name__)
+
+# Reasons of a budget exhaustion
+MAX_VARIANTS_REACHED = 'max-variants'
+MAX_TIME_REACHED = 'max-time'
+MAX_RULE_EVALUATIONS_REACHED = 'max-rule-evaluations'
+CANCELLED = 'cancelled'
+
+
+class VariantBudget(object):
+    """
+    Budget allocated to the generation of the variants of a label.
+
+    A budget is used for a single processing: when it is exhausted,
+    processing is stopped and `truncated` tells why.
+    Processing can also be cancelled at any time from another thread,
+    by calling `cancel` or by setting the given cancel event.
+    """
+
+    def __init__(self, max_variants=None, max_time=None, max_rule_evaluations=None, cancel_event=None):
+        """
+        Create a budget. All limits are optional.
+
+        :param max_variants: Maximum number of variants to generate.
+        :param max_time: Maximum processing time, in seconds.
+        :param max_rule_evaluations: Maximum number of rule evaluations.
+        :param cancel_event: Event (e.g. `threading.Event`) cancelling the processing when set.
+        """
+        self.max_variants = max_variants
+        self.max_time = max_time
+        self.max_rule_evaluations = max_rule_evaluations
+        self._cancel_event = cancel_event if cancel_event is not None else threading.Event()
+        self._deadline = None
+        self.nb_variants = 0
+        self.nb_rule_evaluations = 0
+        # Reason of the truncation, None if the budget is not exhausted
+        self.truncated = None
+
+    def start(self):
+        """
+        Start the processing, the maximum time is counted from now.
+        """
+        if self.max_time is not None:
+            self._deadline = time.monotonic() + self.max_time
+
+    def cancel(self):
+        """
+        Cancel the processing.
+        """
+        self._cancel_event.set()
+
+    def _exhausted(self, reason):
+        logger.warning('Label processing budget exhausted: %s', reason)
+        self.truncated = reason
+        raise BudgetExceeded(reason)
+
+    def check(self):
+        """
+        Check the processing can continue.
+
+        :raises BudgetExceeded: If processing was cancelled or took too much time.
+        """
+        if self.truncated is not None:
+            raise BudgetExceeded(self.truncated)
+        if self._cancel_event.is_set():
+            self._exhausted(CANCELLED)
+        if self._deadline is not None and time.monotonic() > self._deadline:
+            self._exhausted(MAX_TIME_REACHED)
+
+    def add_variant(self):
+        """
+        Account for a new variant.
+
+        :raises BudgetExceeded: If the maximum number of variants is already reached,
+                                or if the processing cannot continue.
+        """
+        if self.max_variants is not None and self.nb_variants >= self.max_variants:
+            self._exhausted(MAX_VARIANTS_REACHED)
+        self.check()
+        self.nb_variants += 1
+
+    def add_rule_evaluation(self):
+        """
+        Account for a new rule evaluation.
+
+        :raises BudgetExceeded: If the maximum number of rule evaluations is already reached,
+                                or if the processing cannot continue.
+        """
+        if self.max_rule_evaluations is not None and self.nb_rule_evaluations >= self.max_rule_evaluations:
+            self._exhausted(MAX_RULE_EVALUATIONS_REACHED)
+        self.check()
+        self.nb_rule_evaluations += 1
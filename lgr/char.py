@@ -4,7 +4,10 @@ char.py - Definition of base classes for character objects.
 """
 from __future__ import unicode_literals
 
+import bisect
 import logging
+import sys
+from types import MappingProxyType
 
 from lgr import text_type
 from lgr.exceptions import (CharAlreadyExists,
@@ -16,6 +19,45 @@ from lgr.utils import cp_to_str, format_cp, cp_to_ulabel
 
 logger = logging.getLogger(__name__)
 
+# Shared immutable empty containers, used as default values of the attributes
+# of the (numerous) character and variant objects
+_EMPTY = ()
+_EMPTY_VARIANTS = MappingProxyType({})
+
+
+def _intern_list(values):
+    """
+    Intern the strings of a list of values.
+
+    The list is updated in place, so it can still be shared between objects
+    (as done by the code points of a range).
+
+    :param values: List of values, or None.
+    :return: The list of values, or a shared empty tuple if there is no value.
+
+    >>> _intern_list(None) is _intern_list([])
+    True
+    >>> _intern_list(['sc:' + 'Latn'])[0] is _intern_list(['sc:Latn'])[0]
+    True
+    """
+    if not values:
+        return _EMPTY
+    if isinstance(values, list):
+        for (i, value) in enumerate(values):
+            if type(value) is str:
+                values[i] = sys.intern(value)
+    return values
+
+
+def _intern(value):
+    """
+    Intern a string value.
+
+    :param value: The value, may be None.
+    :return: The interned value.
+    """
+    return sys.intern(value) if type(value) is str else value
+
 
 def _to_index(i):
     """
@@ -56,16 +98,18 @@ class Variant(object):
     # code point (or sequence). This seems very similar to what a CharBase is,
     # and maybe we should base the Variant class on it?
 
+    __slots__ = ('cp', 'type', 'when', 'not_when', 'comment', 'references')
+
     def __init__(self, cp_or_sequence,
                  variant_type=None,
                  when=None, not_when=None,
                  comment=None, ref=None):
         self.cp = tuple(cp_or_sequence)
-        self.type = variant_type
-        self.when = when
-        self.not_when = not_when
+        self.type = _intern(variant_type)
+        self.when = _intern(when)
+        self.not_when = _intern(not_when)
         self.comment = comment
-        self.references = ref if ref is not None else []
+        self.references = _intern_list(ref)
 
     def __unicode__(self):
         return cp_to_ulabel(self.cp)
@@ -90,8 +134,13 @@ class Variant(object):
 class CharBase(object):
     """
     Base class for char objects.
+
+    Objects are slotted, and the attributes without value share the same
+    empty immutable containers, as an LGR may contain a lot of chars.
     """
 
+    __slots__ = ('cp', 'comment', 'references', 'tags', 'when', 'not_when', '_variants', '_sorted_variants')
+
     def __init__(self, cp_or_sequence,
                  comment=None, ref=None,
                  tag=None,
@@ -99,11 +148,29 @@ class CharBase(object):
         assert len(cp_or_sequence), "there should be at least one char"
         self.cp = tuple(cp_or_sequence)
         self.comment = comment
-        self.references = ref if ref is not None else []
-        self.tags = tag if tag is not None else []
-        self.when = when
-        self.not_when = not_when
-        self._variants = {}
+        self.references = _intern_list(ref)
+        self.tags = _intern_list(tag)
+        self.when = _intern(when)
+        self.not_when = _intern(not_when)
+        self._variants = _EMPTY_VARIANTS
+        # Sorted tuple of the variants, None until computed
+        self._sorted_variants = None
+
+    def __getstate__(self):
+        state = {name: getattr(self, name)
+                 for cls in type(self).__mro__
+                 for name in getattr(cls, '__slots__', ())}
+        del state['_sorted_variants']
+        if not self._variants:
+            # Shared empty mapping cannot be pickled
+            del state['_variants']
+        return state
+
+    def __setstate__(self, state):
+        self._variants = _EMPTY_VARIANTS
+        self._sorted_variants = None
+        for (name, value) in state.items():
+            setattr(self, name, value)
 
     def as_index(self):
         return _to_index(self.cp)
@@ -138,14 +205,17 @@ class CharBase(object):
                       when=when, not_when=not_when,
                       comment=comment, ref=ref)
 
-        idx = tuple(cp_or_sequence)
+        idx = var.cp
         if idx in self._variants and var in set(self._variants[idx]):
             logger.error("%r: Variant '%s' already exists",
                          self,
                          format_cp(cp_or_sequence))
             raise VariantAlreadyExists(self.cp, var.cp)
         else:
+            if not self._variants:
+                self._variants = {}
             self._variants.setdefault(idx, []).append(var)
+            self._sorted_variants = None
 
     def del_variant(self, cp_or_sequence, when=None, not_when=None):
         """
@@ -171,9 +241,12 @@ class CharBase(object):
         idx = tuple(cp_or_sequence)
         if idx in self._variants and var in set(self._variants[idx]):
             self._variants[idx].remove(var)
+            self._sorted_variants = None
             if len(self._variants[idx]) == 0:
                 # Variant was last variant with this code point
                 del self._variants[idx]
+                if not self._variants:
+                    self._variants = _EMPTY_VARIANTS
             return True
         else:
             return False
@@ -226,13 +299,19 @@ class CharBase(object):
         """
         Return a generator to iterate through the variants of a char.
 
+        Variants are sorted by code point once, until the variants are modified.
+        The char may be modified while iterating.
+
         :returns: Generator of Variant objects of a char.
         """
-
-        for variant_cp in sorted(self._variants):
-            variants = self._variants[variant_cp]
-            for var in variants:
-                yield var
+        variants = self._sorted_variants
+        if variants is None:
+            variants = tuple(var
+                             for variant_cp in sorted(self._variants)
+                             for var in self._variants[variant_cp])
+            self._sorted_variants = variants
+        for var in variants:
+            yield var
 
     def get_variant(self, var_cp):
         """
@@ -282,6 +361,8 @@ class Char(CharBase):
     Represent a <char cp="XXXX"> element in the XML file.
     """
 
+    __slots__ = ()
+
     def __init__(self, cp, *args, **kwargs):
         # Convert single code point to tuple
         super(Char, self).__init__((cp,), *args, **kwargs)
@@ -298,6 +379,8 @@ class RangeChar(Char):
     character belongs to.
     """
 
+    __slots__ = ('first_cp', 'last_cp')
+
     def __init__(self, cp, first_cp, last_cp, *args, **kwargs):
         # Convert single code point to tuple
         super(RangeChar, self).__init__(cp, *args, **kwargs)
@@ -325,18 +408,136 @@ class RangeChar(Char):
                                               cp_to_str(self.last_cp))
 
 
+def _make_range_char(cp, first_char):
+    """
+    Create the RangeChar of a code point of a range.
+
+    :param cp: The code point.
+    :param first_char: The RangeChar of the first code point of the range,
+                       whose properties are shared with the new char.
+    :return: The RangeChar object.
+    """
+    return RangeChar(cp, first_char.first_cp, first_char.last_cp,
+                     comment=first_char.comment, ref=first_char.references, tag=first_char.tags,
+                     when=first_char.when, not_when=first_char.not_when)
+
+
 class CharSequence(CharBase):
     """
     A char sequence object.
 
     Represent a <char cp="XXXX YYYY..."> element in the XML file.
     """
-    pass
+
+    __slots__ = ()
+
+
+class _VariantSets(object):
+    """
+    Disjoint sets of the chars of a repertoire linked by variants (union-find).
+
+    Variants can only be added to the sets, removing a variant or a char
+    requires to build the sets again.
+
+    The sets are the variant sets of the repertoire only if the variant
+    relation is symmetric, so the variants without their reverse variant
+    are also recorded.
+    """
+
+    def __init__(self):
+        # Code point -> parent code point, roots are their own parent
+        self.parent = {}
+        # Root code point -> list of the code points of its set
+        self.members = {}
+        # (code point, variant code point) of the variants whose code point
+        # is in the repertoire without the reverse variant
+        self.one_way = set()
+        # Variant code point not in the repertoire -> set of code points
+        # having this variant
+        self.missing = {}
+        # Sorted list of the variant sets, None until computed
+        self._sets = None
+
+    def find(self, cp):
+        """
+        Get the root code point of the set of a code point.
+
+        :param cp: The code point (or sequence), as a tuple.
+        :return: The root code point, the code point itself if it is not
+                 in any set.
+        """
+        parent = self.parent.get(cp)
+        if parent is None:
+            return cp
+        while parent != cp:
+            # Path halving
+            grandparent = self.parent[parent]
+            self.parent[cp] = grandparent
+            cp = parent
+            parent = grandparent
+        return cp
+
+    def union(self, cp1, cp2):
+        """
+        Merge the sets of two code points.
+
+        :param cp1: The first code point (or sequence), as a tuple.
+        :param cp2: The second code point (or sequence), as a tuple.
+
+        >>> sets = _VariantSets()
+        >>> sets.union((1,), (2,))
+        >>> sets.union((3,), (4,))
+        >>> sets.union((4,), (1,))
+        >>> sets.get_sets() == [((1,), (2,), (3,), (4,))]
+        True
+        """
+        root1 = self.find(cp1)
+        root2 = self.find(cp2)
+        if root1 == root2:
+            return
+        self._sets = None
+        members1 = self.members.get(root1) or self._add(root1)
+        members2 = self.members.get(root2) or self._add(root2)
+        if len(members1) < len(members2):
+            (root1, root2) = (root2, root1)
+            (members1, members2) = (members2, members1)
+        self.parent[root2] = root1
+        members1.extend(members2)
+        del self.members[root2]
+
+    def _add(self, cp):
+        self.parent[cp] = cp
+        members = self.members[cp] = [cp]
+        return members
+
+    def get_set(self, cp):
+        """
+        Get the set of a code point.
+
+        :param cp: The code point (or sequence), as a tuple.
+        :return: The sorted tuple of the code points of the set,
+                 an empty tuple if the code point is not in a set.
+        """
+        members = self.members.get(self.find(cp), _EMPTY)
+        return tuple(sorted(members)) if len(members) > 1 else _EMPTY
+
+    def get_sets(self):
+        """
+        Get all the sets.
+
+        :return: The sorted list of the sets, as sorted tuples of code points.
+        """
+        if self._sets is None:
+            self._sets = sorted(tuple(sorted(members)) for members in self.members.values())
+        return self._sets
 
 
 class Repertoire(object):
     """
     A structure used to store various code points types.
+
+    Ranges are stored as intervals: the RangeChar of a code point of a range
+    is only created when it is accessed.
     """
 
     def __init__(self):
@@ -344,11 +545,28 @@ class Repertoire(object):
         # This list MUST be kept in order!
         # Should this really be here?
         self.ranges = []
+        # Code point -> RangeChar of the code points of ranges created so far.
+        # The RangeChar of the first code point of a range always exists,
+        # and holds the properties shared by all code points of the range.
+        self._range_chars = dict()
         # Code point objects are indexed by their first code point, as an int.
         # So the key for a <char cp="1234"/> object is 1234,
         # and the key for a  <char cp="1234 5678"/> also is 1234.
         # The value stored is a list of CharBase objects.
+        # Only the first RangeChar of a range is included.
         self._chardict = dict()
+        # Code point tuple -> CharBase object, for exact lookups.
+        # RangeChar objects are not included.
+        self._chars = dict()
+        # Tuple of the characters in iteration order, None until computed.
+        self._sorted_chars = None
+        # _VariantSets of the repertoire, None until computed.
+        self._variant_sets = None
+        # Code point trie of the characters, used to match labels.
+        # Each node is a [char, children] list, where char is the character
+        # ending on this node (or None) and children maps the next code point
+        # to its node. This is the children mapping of the root node.
+        self._trie = dict()
 
     # Note for the following methods:
     # People may want to easily access the repertoire without having to wonder
@@ -378,16 +596,13 @@ class Repertoire(object):
         """
         if isinstance(k, CharBase):
             cp = k.cp
-            k = k.as_index()
         elif isinstance(k, int):
             cp = (k,)
-            k = _to_index(k)
         else:
             cp = tuple(k)
-            k = _to_index(k)
-        if k not in self._chardict:
-            return False
-        return cp in [c.cp for c in set(self._chardict[k])]
+        if cp in self._chars:
+            return True
+        return len(cp) == 1 and self._find_range(cp[0]) is not None
 
     def __getitem__(self, k):
         """
@@ -419,24 +634,15 @@ class Repertoire(object):
         >>> [char, seq] == list(cd)
         True
         """
-        last_cp = None
-        for index in sorted(self._chardict.keys()):
-            char_list = self._chardict[index]
-
-            # Reset last_cp once we have exhausted the range
-            if last_cp is not None and last_cp < index:
-                last_cp = None
-
-            for char in sorted(char_list, key=lambda c: len(c.cp)):
-
-                if isinstance(char, RangeChar):
-                    if last_cp is not None:
-                        # Skip all RangeChar of a range
-                        continue
-                    else:
-                        last_cp = char.last_cp
-
-                yield char
+        chars = self._sorted_chars
+        if chars is None:
+            # Only the first RangeChar of a range is in the dictionary
+            chars = tuple(char
+                          for index in sorted(self._chardict.keys())
+                          for char in sorted(self._chardict[index], key=lambda c: len(c.cp)))
+            self._sorted_chars = chars
+        for char in chars:
+            yield char
 
     def all_repertoire(self, include_sequences=True, include_ranges=True):
         """
@@ -457,7 +663,12 @@ class Repertoire(object):
             for char in char_list:
                 if isinstance(char, CharSequence) and not include_sequences:
                     continue
-                if isinstance(char, RangeChar) and not include_ranges:
+                if isinstance(char, RangeChar):
+                    if include_ranges:
+                        for cp in range(char.first_cp, char.last_cp + 1):
+                            # Do not keep the RangeChar objects created only for this iteration
+                            range_char = self._range_chars.get(cp)
+                            yield range_char if range_char is not None else _make_range_char(cp, char)
                     continue
                 yield char
 
@@ -477,8 +688,13 @@ class Repertoire(object):
         >>> _ = cd.add_char([0x002A, 0x002B])
         >>> len(cd)
         3
+        >>> cd.add_range(0x0030, 0x0039)
+        >>> len(cd)
+        13
         """
-        return sum(len(c) for c in self._chardict.values())
+        # The first code point of ranges is counted in the dictionary
+        return (sum(len(c) for c in self._chardict.values())
+                + sum(last_cp - first_cp for (first_cp, last_cp) in self.ranges))
 
     def add_char(self, cp_or_sequence,
                  comment=None, ref=None,
@@ -588,14 +804,21 @@ class Repertoire(object):
             raise RangeAlreadyExists(first_cp, last_cp)
 
         for cp in range(first_cp, last_cp + 1):
-            char = RangeChar(cp, first_cp, last_cp,
-                             comment=comment, ref=ref, tag=tag,
-                             when=when, not_when=not_when)
-            # TODO: clean-up range on error.
-            self._add_char(char)
-
+            if (cp,) in self._chars or self._find_range(cp) is not None:
+                logger.error("Char '%s' already exists", format_cp(cp))
+                raise CharAlreadyExists((cp,))
+
+        first_char = RangeChar(first_cp, first_cp, last_cp,
+                               comment=comment, ref=ref, tag=tag,
+                               when=when, not_when=not_when)
+        self._chardict.setdefault(first_cp, []).append(first_char)
+        self._range_chars[first_cp] = first_char
+        self._sorted_chars = None
         # Insert by first cp
-        self.ranges.append((first_cp, last_cp))
+        bisect.insort(self.ranges, (first_cp, last_cp))
+        if self._variant_sets is not None and self._variant_sets.missing:
+            self._add_missing_variants([cp for cp in self._variant_sets.missing
+                                        if len(cp) == 1 and first_cp <= cp[0] <= last_cp])
 
     def del_range(self, first_cp, last_cp):
         """
@@ -620,24 +843,12 @@ class Repertoire(object):
         """
         assert first_cp < last_cp, "range must be defined in order"
 
-        if (first_cp, last_cp) not in self.ranges:
+        if self._find_range(first_cp) != (first_cp, last_cp):
             logger.error("Range '%s - %s' does not exist",
                          format_cp(first_cp), format_cp(last_cp))
             raise NotInLGR(first_cp)
 
-        for cp in range(first_cp, last_cp + 1):
-            char = RangeChar(cp, first_cp, last_cp)
-            if not self._del_char(char):
-                # TODO: clean-up range on error
-                # This should only happen if range insertion failed
-                # -> inconsistent state for now
-                logger.critical("Range '%s - %s' is missing code point %s",
-                                format_cp(first_cp), format_cp(last_cp),
-                                format_cp(cp))
-                raise NotInLGR(cp)
-
-        # Remove and sort by first cp
-        self.ranges.remove((first_cp, last_cp))
+        self._remove_range(first_cp, last_cp)
 
     def get_char(self, cp_or_sequence):
         """
@@ -653,24 +864,20 @@ class Repertoire(object):
         >>> c is char
         True
         """
-        assert len(cp_or_sequence), "there should be at least one char"
-
-        origin = CharBase.from_cp_or_sequence(cp_or_sequence)
-
-        idx = origin.as_index()
-        if idx not in self._chardict:
-            raise NotInLGR(cp_or_sequence)
-
-        chars = self._chardict[idx]
-        try:
-            list_idx = chars.index(origin)
-        except ValueError:
+        cp = (cp_or_sequence,) if isinstance(cp_or_sequence, int) else tuple(cp_or_sequence)
+        assert len(cp), "there should be at least one char"
+
+        char = self._chars.get(cp)
+        if char is not None:
+            return char
+        if len(cp) == 1:
+            char = self._get_range_char(cp[0])
+            if char is not None:
+                return char
+        if cp[0] in self._chardict:
             logger.error("Code point '%s' does not exist",
                          format_cp(cp_or_sequence))
-            raise NotInLGR(cp_or_sequence)
-
-        char = chars[list_idx]
-        return char
+        raise NotInLGR(cp_or_sequence)
 
     def add_variant(self, cp_or_sequence,
                     variant_cp_or_sequence, variant_type=None,
@@ -705,6 +912,9 @@ class Repertoire(object):
                          when=when, not_when=not_when,
                          comment=comment,
                          ref=ref)
+        variant_cp = tuple(variant_cp_or_sequence)
+        if self._variant_sets is not None and len(char._variants[variant_cp]) == 1:
+            self._add_to_variant_sets(self._variant_sets, char.cp, variant_cp)
 
     def del_variant(self, cp_or_sequence,
                     variant_cp_or_sequence,
@@ -731,7 +941,10 @@ class Repertoire(object):
         True
         """
         char = self.get_char(cp_or_sequence)
-        return char.del_variant(variant_cp_or_sequence, when, not_when)
+        deleted = char.del_variant(variant_cp_or_sequence, when, not_when)
+        if deleted and tuple(variant_cp_or_sequence) not in char._variants:
+            self._variant_sets = None
+        return deleted
 
     def get_variants(self, cp_or_sequence):
         """
@@ -774,19 +987,74 @@ class Repertoire(object):
         """
         Return the list of variants set contained in the repertoire.
 
-        Note: This function is very stupid and NOT optimised in complexity
-        nor memory consumption.
+        The sets are maintained as disjoint sets when variants are added.
+        If some variants do not have their reverse variant, the sets are
+        computed from each character instead.
 
         :param force: Include variant sets which are not symmetric or transitive.
         :returns: List of variant set, with a variant set being
                   a list of code points included in the set.
+
+        >>> cd = Repertoire()
+        >>> for cp in (0x0061, 0x0062, 0x0063):
+        ...     _ = cd.add_char([cp])
+        >>> cd.add_variant([0x0061], [0x0062])
+        >>> cd.add_variant([0x0062], [0x0061])
+        >>> cd.get_variant_sets() == [((0x0061,), (0x0062,))]
+        True
+        """
+        variant_sets = self._get_variant_sets()
+        if not variant_sets.one_way and not (force and variant_sets.missing):
+            return list(variant_sets.get_sets())
+
+        sets = set()
+        for index in sorted(self._chardict.keys()):
+            for char in self._chardict[index]:
+                # XXX: Convert to tuple here so it is hashable
+                variant_set = tuple(sorted(self._traverse_variants(char, force)))
+                if len(variant_set) > 1:
+                    sets.add(variant_set)
+
+        return sorted(sets)
+
+    def get_variant_set(self, cp_or_sequence):
+        """
+        Return the variant set of a code point.
+
+        :param cp_or_sequence: Code point or code point sequence.
+        :returns: The variant set, as a sorted tuple of code points,
+                  an empty tuple if the code point has no variant.
+        :raises NotInLGR: If the code point does not exist.
+
+        >>> cd = Repertoire()
+        >>> for cp in (0x0061, 0x0062, 0x0063):
+        ...     _ = cd.add_char([cp])
+        >>> cd.add_variant([0x0061], [0x0062])
+        >>> cd.add_variant([0x0062], [0x0061])
+        >>> cd.get_variant_set([0x0062]) == ((0x0061,), (0x0062,))
+        True
+        >>> cd.get_variant_set([0x0063])
+        ()
+        """
+        char = self.get_char(cp_or_sequence)
+        variant_sets = self._get_variant_sets()
+        if not variant_sets.one_way:
+            return variant_sets.get_set(char.cp)
+        variant_set = tuple(sorted(self._traverse_variants(char)))
+        return variant_set if len(variant_set) > 1 else _EMPTY
+
+    def _traverse_variants(self, char, force=False):
         """
+        Get the code points reachable from a char through variants.
 
-        def dfs(char, visited=None):
-            """ Utility function to iterate in a char/variants (Depth-First Search)."""
-            if visited is None:
-                visited = set()
-            visited.add(char.cp)
+        :param char: The char to start from.
+        :param force: Also go through variants which are not in the repertoire.
+        :return: The set of reachable code points, including the char.
+        """
+        visited = {char.cp}
+        stack = [char]
+        while stack:
+            char = stack.pop()
             for variant in char.get_variants():
                 if variant.cp in visited:
                     continue
@@ -794,22 +1062,59 @@ class Repertoire(object):
                     reverse_char = self.get_char(variant.cp)
                 except NotInLGR:
                     if force:
-                        dfs(CharBase(variant.cp), visited)
+                        visited.add(variant.cp)
                     # Ignore invalid LGR
                     continue
-                dfs(reverse_char, visited)
-            return visited
+                visited.add(variant.cp)
+                stack.append(reverse_char)
+        return visited
 
-        variant_sets = set()
-        for index in sorted(self._chardict.keys()):
-            for char in self._chardict[index]:
-                # XXX: Convert to tuple here so it is hashable
-                variant_set = tuple(sorted(dfs(char)))
-                if len(variant_set) > 1:
-                    lowest = min(variant_set)
-                    variant_sets.add((lowest, variant_set))
+    def _get_variant_sets(self):
+        """
+        Get the variant sets of the repertoire, building them if needed.
+
+        :return: The _VariantSets object.
+        """
+        variant_sets = self._variant_sets
+        if variant_sets is None:
+            variant_sets = _VariantSets()
+            # RangeChar objects have no variant
+            for char in self._chars.values():
+                for variant_cp in char._variants:
+                    self._add_to_variant_sets(variant_sets, char.cp, variant_cp)
+            self._variant_sets = variant_sets
+        return variant_sets
+
+    def _add_to_variant_sets(self, variant_sets, cp, variant_cp):
+        """
+        Add a variant to the variant sets.
+
+        :param variant_sets: The _VariantSets object.
+        :param cp: The code point of the char, as a tuple.
+        :param variant_cp: The code point of the variant, as a tuple.
+        """
+        if variant_cp not in self:
+            variant_sets.missing.setdefault(variant_cp, set()).add(cp)
+            return
+        variant_sets.union(cp, variant_cp)
+        reverse_char = self._chars.get(variant_cp)
+        if reverse_char is not None and cp in reverse_char._variants:
+            variant_sets.one_way.discard((variant_cp, cp))
+        else:
+            variant_sets.one_way.add((cp, variant_cp))
+
+    def _add_missing_variants(self, cps):
+        """
+        Update the variant sets for code points added to the repertoire.
 
-        return [variants for _, variants in sorted(variant_sets)]
+        :param cps: The new code points, as tuples.
+        """
+        variant_sets = self._variant_sets
+        if variant_sets is None or not variant_sets.missing:
+            return
+        for variant_cp in cps:
+            for cp in variant_sets.missing.pop(variant_cp, ()):
+                self._add_to_variant_sets(variant_sets, cp, variant_cp)
 
     def del_reference(self, ref_id):
         """
@@ -847,14 +1152,101 @@ class Repertoire(object):
         :param only_variants: Only return chars with variants.
         :raises NotInLGR: If the code point does not exist.
         """
+        range_char = self._get_range_char(cp)
         if cp not in self._chardict:
-            raise NotInLGR(cp)
+            if range_char is None:
+                raise NotInLGR(cp)
+            return [] if only_variants else [range_char]
         if not only_variants:
             iterable = self._chardict[cp]
+            if range_char is not None and range_char not in iterable:
+                iterable = iterable + [range_char]
         else:
             iterable = [v for v in self._chardict[cp] if v.has_variant()]
         return sorted(iterable, key=lambda x: len(x), reverse=True)
 
+    def has_prefix(self, cp):
+        """
+        Test if there is at least one character starting with cp.
+
+        :param cp: The first codepoint of the characters.
+        :return: True if a character starts with cp, False otherwise.
+
+        >>> cd = Repertoire()
+        >>> _ = cd.add_char([0x002A, 0x002B])
+        >>> cd.has_prefix(0x002A)
+        True
+        >>> cd.has_prefix(0x002B)
+        False
+        """
+        return cp in self._trie or self._find_range(cp) is not None
+
+    def starts_sequence(self, cp):
+        """
+        Test if there is at least one sequence starting with cp.
+
+        :param cp: The first codepoint of the sequences.
+        :return: True if a sequence starts with cp, False otherwise.
+
+        >>> cd = Repertoire()
+        >>> _ = cd.add_char([0x002A, 0x002B])
+        >>> _ = cd.add_char([0x002B])
+        >>> cd.starts_sequence(0x002A)
+        True
+        >>> cd.starts_sequence(0x002B)
+        False
+        """
+        node = self._trie.get(cp)
+        return node is not None and len(node[1]) > 0
+
+    def get_chars_matching(self, label, index=0, only_variants=False):
+        """
+        Return the characters matching a label at a given position.
+
+        Unlike `get_chars_from_prefix`, only return the characters
+        which are a prefix of the label from index, and do not raise
+        if no character matches.
+
+        :param label: The label, as a sequence of code points.
+        :param index: The position in the label to match characters from.
+        :param only_variants: Only return chars with variants.
+        :return: List of characters, ordered by decreasing length.
+                 Empty list if no character matches.
+
+        >>> cd = Repertoire()
+        >>> char = cd.add_char([0x002A])
+        >>> seq = cd.add_char([0x002A, 0x002B])
+        >>> _ = cd.add_char([0x002A, 0x002C])
+        >>> cd.get_chars_matching([0x002D, 0x002A, 0x002B], 1) == [seq, char]
+        True
+        >>> cd.get_chars_matching([0x002A, 0x002D]) == [char]
+        True
+        >>> cd.get_chars_matching([0x002B])
+        []
+        >>> cd.add_range(0x0030, 0x0039)
+        >>> cd.get_chars_matching([0x0035]) == [cd[0x0035]]
+        True
+        """
+        matches = []
+        if index < len(label) and not only_variants and self.ranges:
+            # Characters of ranges are not in the trie, and have no variant
+            node = self._trie.get(label[index])
+            if node is None or node[0] is None:
+                range_char = self._get_range_char(label[index])
+                if range_char is not None:
+                    matches.append(range_char)
+        children = self._trie
+        for i in range(index, len(label)):
+            node = children.get(label[i])
+            if node is None:
+                break
+            char = node[0]
+            if char is not None and (not only_variants or char.has_variant()):
+                matches.append(char)
+            children = node[1]
+        matches.reverse()
+        return matches
+
     def _check_range_overlap(self, first_cp, last_cp):
         """
         Check that a range is not already inserted in this repertoire.
@@ -865,18 +1257,102 @@ class Repertoire(object):
         False
         >>> cd._check_range_overlap(1, 5)
         True
+        >>> cd._check_range_overlap(11, 19)
+        False
+        >>> cd._check_range_overlap(11, 40)
+        True
+        """
+        # Ranges do not overlap, so only the last range starting before
+        # the end of the new range can overlap it
+        i = bisect.bisect_right(self.ranges, (last_cp, sys.maxsize)) - 1
+        return i >= 0 and self.ranges[i][1] >= first_cp
+
+    def _find_range(self, cp):
+        """
+        Find the range containing a code point.
+
+        :param cp: The code point.
+        :return: The (first_cp, last_cp) range, None if cp is not in a range.
+
+        >>> cd = Repertoire()
+        >>> cd.add_range(0x002A, 0x0030)
+        >>> cd._find_range(0x002B) == (0x002A, 0x0030)
+        True
+        >>> cd._find_range(0x0031) is None
+        True
+        """
+        i = bisect.bisect_right(self.ranges, (cp, sys.maxsize)) - 1
+        if i >= 0 and self.ranges[i][1] >= cp:
+            return self.ranges[i]
+        return None
+
+    def _get_range_char(self, cp):
+        """
+        Get the RangeChar of a code point, creating it if needed.
+
+        :param cp: The code point.
+        :return: The RangeChar object, None if cp is not in a range.
+        """
+        char = self._range_chars.get(cp)
+        if char is not None:
+            return char
+        cp_range = self._find_range(cp)
+        if cp_range is None:
+            return None
+        char = _make_range_char(cp, self._range_chars[cp_range[0]])
+        # Concurrent calls may create the char, only keep one
+        return self._range_chars.setdefault(cp, char)
+
+    def _remove_range(self, first_cp, last_cp):
+        """
+        Remove a range and the RangeChar objects of its code points.
+
+        :param first_cp: First code point of the range.
+        :param last_cp: Last code point of the range.
+        """
+        self.ranges.remove((first_cp, last_cp))
+        char_list = self._chardict[first_cp]
+        char_list.remove(self._range_chars[first_cp])
+        if not char_list:
+            del self._chardict[first_cp]
+        self._sorted_chars = None
+        self._variant_sets = None
+        if last_cp - first_cp + 1 < len(self._range_chars):
+            cps = [cp for cp in range(first_cp, last_cp + 1) if cp in self._range_chars]
+        else:
+            cps = [cp for cp in self._range_chars if first_cp <= cp <= last_cp]
+        for cp in cps:
+            del self._range_chars[cp]
+
+    def _split_range(self, cp):
+        """
+        Remove a code point from the range containing it.
+
+        The range is replaced by the ranges (or single code points)
+        on both sides of the code point.
+
+        :param cp: The code point, in a range.
+
+        >>> cd = Repertoire()
+        >>> cd.add_range(0x002A, 0x0030)
+        >>> cd._split_range(0x002B)
+        >>> cd.ranges == [(0x002C, 0x0030)]
+        True
+        >>> isinstance(cd[0x002A], RangeChar)
+        False
+        >>> cd[0x002D].first_cp == 0x002C
+        True
         """
-        # Sort self.ranges by first_cp
-        self.ranges.sort()
-        for (range_first, range_last) in self.ranges:
-            if first_cp > range_last or last_cp < range_first:
-                continue
-            # From now on:
-            #    * first_cp <= range_last
-            #    * last_cp >= range_first
-            if first_cp >= range_first or last_cp <= range_last:
-                return True
-        return False
+        (first_cp, last_cp) = self._find_range(cp)
+        first_char = self._range_chars[first_cp]
+        self._remove_range(first_cp, last_cp)
+        properties = dict(comment=first_char.comment, ref=first_char.references, tag=first_char.tags,
+                          when=first_char.when, not_when=first_char.not_when)
+        for (part_first, part_last) in ((first_cp, cp - 1), (cp + 1, last_cp)):
+            if part_first == part_last:
+                self.add_char([part_first], **properties)
+            elif part_first < part_last:
+                self.add_range(part_first, part_last, skip_check=True, **properties)
 
     def _add_char(self, char):
         """
@@ -898,11 +1374,20 @@ class Repertoire(object):
         CharAlreadyExists:
         """
         idx = char.as_index()
-        if idx in self._chardict and char in set(self._chardict[idx]):
+        if char.cp in self._chars or \
+                (len(char.cp) == 1 and self._find_range(idx) is not None):
             logger.error("Char '%s' already exists", char)
             raise CharAlreadyExists(char.cp)
         else:
             self._chardict.setdefault(idx, []).append(char)
+            self._chars[char.cp] = char
+            self._sorted_chars = None
+            self._add_missing_variants([char.cp])
+            children = self._trie
+            for cp in char.cp:
+                node = children.setdefault(cp, [None, {}])
+                children = node[1]
+            node[0] = char
 
     def _del_char(self, char):
         """
@@ -922,15 +1407,40 @@ class Repertoire(object):
         False
         """
         idx = char.as_index()
-        if idx in self._chardict and char in set(self._chardict[idx]):
+        if len(char.cp) == 1 and self._find_range(idx) is not None:
+            self._split_range(idx)
+            return True
+        if char.cp in self._chars:
+            del self._chars[char.cp]
             self._chardict[idx].remove(char)
             if len(self._chardict[idx]) == 0:
                 # CP was only one (no sequence starting with this CP)
                 del self._chardict[idx]
+            self._sorted_chars = None
+            self._variant_sets = None
+            self._del_from_trie(char)
             return True
         else:
             return False
 
+    def _del_from_trie(self, char):
+        """
+        Delete a character from the code point trie, pruning unused nodes.
+
+        :param char: Char object (a subclass of CharBase).
+        """
+        path = []
+        children = self._trie
+        for cp in char.cp:
+            node = children[cp]
+            path.append((children, cp, node))
+            children = node[1]
+        path[-1][2][0] = None
+        for children, cp, node in reversed(path):
+            if node[0] is not None or node[1]:
+                break
+            del children[cp]
+
 
 if __name__ == "__main__":
     import doctest
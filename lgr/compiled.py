@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+"""
+compiled.py - Definition of a frozen LGR structure optimised for label processing.
+"""
+from __future__ import unicode_literals
+
+import copy
+import logging
+import re
+
+from picu.exceptions import PICUException
+
+from lgr.core import LGR
+from lgr.exceptions import LGRApiException, RuleError
+from lgr.rule import ANCHOR_PLACEHOLDER, compile_rule_regex, regex_matches
+from lgr.trace import RuleTrace
+from lgr.utils import format_cp
+
+logger = logging.getLogger(__name__)
+
+
+class _CompiledRule(object):
+    """
+    A rule with its regex pattern resolved and compiled once.
+
+    Exposes the same `matches` interface as `lgr.rule.Rule`, so it can be used
+    in place of a rule in a rules lookup dictionary.
+    """
+
+    def __init__(self, rule, rules_lookup, classes_lookup, unicode_database):
+        self.rule = rule
+        self.name = rule.name
+        self._unicode_database = unicode_database
+        self._error = None
+        self._pattern = ''
+        self._regex = None
+        self._is_parameterized = False
+
+        try:
+            self._pattern = rule.get_pattern(rules_lookup,
+                                             classes_lookup,
+                                             unicode_database)
+            self._is_parameterized = ANCHOR_PLACEHOLDER in self._pattern
+            if self._pattern and not self._is_parameterized:
+                self._regex = unicode_database.compile_regex(self._pattern)
+        except (re.error, PICUException) as re_exc:
+            # Only raise when the rule is actually used, as non-compiled LGR do
+            logger.error('Cannot compile rule %s: %s', rule, re_exc)
+            self._error = RuleError(self.name, re_exc)
+
+    def _compile_regex(self, anchor, trace):
+        try:
+            return compile_rule_regex(self._pattern, self._unicode_database, anchor)
+        except (re.error, PICUException) as re_exc:
+            trace.error('Cannot compile regex: %s', re_exc)
+            raise RuleError(self.name, re_exc)
+
+    def matches(self, label,
+                rules_lookup=None,
+                classes_lookup=None,
+                unicode_database=None,
+                anchor=None,
+                index=0,
+                trace=None,
+                revision=None):
+        """
+        Test if the rule matches a label.
+
+        :param label: Label to test, as a sequence of code points.
+        :param rules_lookup: Not used, kept for compatibility with `Rule.matches`.
+        :param classes_lookup: Not used, kept for compatibility with `Rule.matches`.
+        :param unicode_database: Not used, kept for compatibility with `Rule.matches`.
+        :param anchor: Optional anchor to use for look-around rules.
+        :param index: If anchor is used, its index (0-based).
+        :param trace: The RuleTrace collecting the rule processing log.
+        :param revision: Not used, kept for compatibility with `Rule.matches`.
+        :return: True if label is matched by the rule, False otherwise.
+        """
+        if trace is None:
+            trace = RuleTrace()
+        if trace.debug_enabled:
+            trace.debug("Test match on %s for label '%s' with anchor '%s' (%d)",
+                        self.rule,
+                        format_cp(label),
+                        format_cp(anchor) if anchor else anchor,
+                        index)
+        if trace.budget is not None:
+            trace.budget.add_rule_evaluation()
+        if self._error is not None:
+            raise self._error
+
+        if len(self._pattern) == 0:
+            # Pattern is empty, nothing will match
+            trace.debug('Empty pattern')
+            return False
+
+        pattern = self._pattern
+        regex = self._regex
+        if anchor is not None:
+            if not self._is_parameterized:
+                trace.debug('Not a parameterized context rule')
+                # Pattern is not a parameterized context-rule, so set index to 0
+                index = 0
+                anchor = None
+            else:
+                pattern, regex = self._compile_regex(tuple(anchor), trace)
+        elif self._is_parameterized:
+            # Parameterized rule used without anchor: let ICU handle it as usual
+            pattern, regex = self._compile_regex(None, trace)
+        trace.debug("Pattern for rule %s: '%s'", self.rule, pattern)
+
+        return regex_matches(regex, label, anchor, index, trace=trace)
+
+    def __repr__(self):
+        return '<CompiledRule: %s>' % self.name
+
+
+def _frozen(method_name):
+    """
+    Create a method raising an exception, used to forbid modifications of a compiled LGR.
+
+    :param method_name: The name of the forbidden method.
+    :return: The method.
+    """
+    def forbidden(self, *args, **kwargs):
+        logger.error("Cannot call '%s' on compiled LGR '%s'", method_name, self)
+        raise LGRApiException()
+
+    forbidden.__name__ = method_name
+    forbidden.__doc__ = "Not available: a compiled LGR cannot be modified."
+    return forbidden
+
+
+class CompiledLGR(LGR):
+    """
+    A frozen snapshot of an LGR, optimised for label processing.
+
+    Compared to the LGR it is created from, a compiled LGR holds:
+
+        - the when/not-when rules resolved to their compiled regex,
+        - the precomputed list of effective actions,
+        - the precomputed table of code point indexes used to compute index labels.
+
+    It exposes the same label processing API (label eligibility,
+    disposition, index label, ...) as the LGR object, but all methods that
+    would modify the LGR raise an LGRApiException.
+    Later modifications of the source LGR are not reflected
+    in the compiled LGR.
+    """
+
+    def __init__(self, lgr):
+        """
+        Create a compiled LGR.
+
+        :param LGR lgr: The LGR to compile.
+        """
+        # Do not call LGR.__init__, take a snapshot of the LGR state instead.
+        # __getstate__ does not include the Unicode database, which is shared,
+        # nor the regex compiled with it, which may not be copied (e.g. ICU).
+        self.__dict__.update(copy.deepcopy(lgr.__getstate__()))
+        self._unicode_database = lgr.unicode_database
+        self._reset_caches()
+        self._actions = tuple(LGR.effective_actions.fget(self))
+        self._compiled_rules = None
+        self._compile_rules()
+        self._build_cp_index_table()
+
+    def __getstate__(self):
+        """
+        Called when pickling a compiled LGR instance.
+        """
+        odict = super(CompiledLGR, self).__getstate__()
+        # Compiled regex are bound to the Unicode database
+        del odict['_compiled_rules']
+        return odict
+
+    def __setstate__(self, idict):
+        """
+        Called when un-pickling a compiled LGR instance.
+        """
+        super(CompiledLGR, self).__setstate__(idict)
+        self.__dict__['_compiled_rules'] = None
+
+    def _build_cp_index_table(self):
+        """
+        Compute the index of all code points not depending on the label, see `LGR._get_cp_index`.
+        """
+        for char in self.repertoire.all_repertoire(include_sequences=False):
+            self._get_cp_index(char.cp[0])
+
+    def _compile_rules(self):
+        """
+        Resolve and compile all rules, if a Unicode database is available.
+        """
+        if self._unicode_database is None:
+            self._compiled_rules = None
+            return
+        self._compiled_rules = {name: _CompiledRule(rule,
+                                                    self.rules_lookup,
+                                                    self.classes_lookup,
+                                                    self._unicode_database)
+                                for name, rule in self.rules_lookup.items()}
+
+    @LGR.unicode_database.setter
+    def unicode_database(self, unidb):
+        """
+        Setter property for the Unicode database.
+
+        Rules are compiled against the new database.
+
+        :param UnicodeDatabase unidb: New Unicode database to use.
+        """
+        LGR.unicode_database.fset(self, unidb)
+        self._compile_rules()
+
+    @property
+    def effective_actions(self):
+        """
+        The effective list of actions (i.e. including `DEFAULT_ACTIONS`) of the LGR
+        """
+        return list(self._actions)
+
+    def compile(self):
+        """
+        Compile the LGR.
+
+        :return: The LGR itself, as it is already compiled.
+        """
+        return self
+
+    add_reference = _frozen('add_reference')
+    del_reference = _frozen('del_reference')
+    del_tag = _frozen('del_tag')
+    add_cp = _frozen('add_cp')
+    del_cp = _frozen('del_cp')
+    add_range = _frozen('add_range')
+    del_range = _frozen('del_range')
+    expand_ranges = _frozen('expand_ranges')
+    expand_range = _frozen('expand_range')
+    add_variant = _frozen('add_variant')
+    del_variant = _frozen('del_variant')
+    add_codepoints = _frozen('add_codepoints')
+    add_rule = _frozen('add_rule')
+    add_action = _frozen('add_action')
+    add_class = _frozen('add_class')
+    populate_variants = _frozen('populate_variants')
+
+    def _apply_actions(self, label, disp_set, only_variants, trace=None):
+        """
+        Apply the defined action of an LGR to a label and its dispositions.
+
+        Same as `LGR._apply_actions`, using the precomputed action list
+        and the compiled rules.
+        """
+        if trace is None:
+            trace = RuleTrace()
+        rules_lookup = self._compiled_rules if self._compiled_rules is not None else self.rules_lookup
+        for idx, action in enumerate(self._actions):
+            trace.info("Apply action %d (%s)", idx, action)
+            disp = action.apply(label, disp_set, only_variants,
+                                rules_lookup, self.classes_lookup,
+                                self._unicode_database,
+                                trace=trace,
+                                revision=self.revision)
+            if disp is not None:
+                trace.info("Action %d (%s) triggered", idx, action)
+                return disp, idx
+
+        # Should not happen since last DEFAULT_ACTIONS is a catch-all
+        trace.warning("No action triggered by label '%s' "
+                      "with disposition set '%s'", label, disp_set)
+        return None, -1
+
+    def _get_context_rule_result(self, rule_name, label, anchor, index, trace=None):
+        """
+        Test if a context rule matches a label.
+
+        Same as `LGR._get_context_rule_result`, using the compiled rules.
+        """
+        if self._compiled_rules is None:
+            return super(CompiledLGR, self)._get_context_rule_result(rule_name, label, anchor, index, trace=trace)
+
+        return self._compiled_rules[rule_name].matches(label, anchor=anchor, index=index, trace=trace)
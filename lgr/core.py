@@ -5,14 +5,16 @@ core.py - Definition of main object and methods of a LGR structure.
 from __future__ import unicode_literals
 
 import collections
+import itertools
 import logging
 from collections import OrderedDict
-from io import StringIO
 
 from lgr.action import Action
 from lgr.char import CharSequence, Repertoire
 from lgr.classes import Class, TAG_CLASSNAME_PREFIX
+from lgr.evaluate import DEFAULT_CHUNK_SIZE, evaluate_labels
 from lgr.exceptions import (LGRApiInvalidParameter,
+                            BudgetExceeded,
                             CharAlreadyExists,
                             CharInvalidContextRule,
                             NotInRepertoire,
@@ -26,9 +28,11 @@ from lgr.exceptions import (LGRApiInvalidParameter,
                             LGRFormatException,
                             LGRApiException,
                             LGRException)
+from lgr.memoize import LRUCache
 from lgr.metadata import Metadata, ReferenceManager
 from lgr.mixed_scripts_variant_filter import BaseMixedScriptsVariantFilter, MixedScriptsVariantFilter
 from lgr.populate import populate_lgr
+from lgr.trace import QUIET_LEVEL, RuleTrace
 from lgr.utils import (
     COMMON_SCRIPT,
     INHERITED_SCRIPT,
@@ -38,7 +42,6 @@ from lgr.utils import (
 from lgr.validate import validate_lgr
 
 logger = logging.getLogger(__name__)
-rule_logger = logging.getLogger('lgr-rule-logger')
 
 # Default disposition used in
 # 7.3.  Determining a Disposition for a Label or Variant Label, step 3
@@ -75,10 +78,40 @@ MAX_NUMBER_GENERATED_VARIANTS = 1000
 # From RFC1035, 2.3.4 Size limits
 PROTOCOL_LABEL_MAX_LENGTH = 63
 
+# Maximum number of context rules results to cache
+CONTEXT_RULES_CACHE_SIZE = 65536
+
+# Default maximum number of label results to cache, see LGR.enable_disposition_cache
+DISPOSITION_CACHE_SIZE = 4096
+
+# Revisions of LGR objects, unique in the process, see LGR.revision
+_revisions = itertools.count(1)
+
+
+def _copy_result(result):
+    """
+    Copy the mutable members of a cached label processing result.
+
+    :param result: The cached result tuple.
+    :return: A new tuple, where lists and sets are shallow copies,
+             so callers cannot alter the cached result.
+    """
+    return tuple(item.copy() if isinstance(item, (list, set)) else item for item in result)
+
 
 class LGR(object):
     """
     The main LGR object.
+
+    Label processing methods (e.g. `test_label_eligible`,
+    `compute_label_disposition`, `generate_index_label`) can be called
+    concurrently from several threads, as long as the LGR is not modified
+    at the same time.
+
+    Each modification through the LGR API gives the LGR a new `revision`,
+    on which caches of label processing data are keyed.
+    Rules, classes and characters must not be modified directly once added
+    to the LGR.
     """
 
     def __init__(self,
@@ -117,6 +150,10 @@ class LGR(object):
         # Not updated on variant deletion
         self.types = set()
 
+        # Maximum size of the label results cache, None if disabled
+        self._disposition_cache_size = None
+        self._reset_caches()
+
         # Rules are ordered, so when adding a rule:
         # - store its name in self.rules array (ordered structure).
         # - store the rule in the self.rules_lookup dict (indexed by its name).
@@ -148,6 +185,11 @@ class LGR(object):
         odict = self.__dict__.copy()  # copy the dict since we change it
         # Do not pickle the unicode database
         del odict['_unicode_database']
+        # Nor the caches, rebuilt on demand
+        del odict['_context_rules_cache']
+        del odict['_context_rule_windows']
+        del odict['_cp_index_table']
+        del odict['_disposition_cache']
         return odict
 
     def __setstate__(self, idict):
@@ -158,6 +200,67 @@ class LGR(object):
         # __init__ not called during un-pickling so we have to manually define
         # attributes which were deleted during pickling
         self.__dict__['_unicode_database'] = None
+        self.__dict__.setdefault('_disposition_cache_size', None)
+        self._reset_caches()
+
+    def _reset_caches(self):
+        """
+        Reset the caches used during label processing, and start a new revision of the LGR.
+
+        Must be called each time the LGR is modified.
+        Caches are shared by the threads processing labels, so they are
+        replaced rather than cleared.
+        """
+        # Caches outside the LGR (e.g. rules patterns) are keyed on the revision.
+        # Revisions are unique in the process, so that objects shared between
+        # LGRs cannot get the result computed for another LGR.
+        self.revision = next(_revisions)
+        # Results of context rules, see _match_context_rule
+        self._context_rules_cache = LRUCache(CONTEXT_RULES_CACHE_SIZE)
+        # (rule name, anchor length) -> window of the label seen by the rule
+        self._context_rule_windows = {}
+        # Code point -> index of the code point in any label, see _get_cp_index
+        self._cp_index_table = {}
+        # Results of label processing, see enable_disposition_cache
+        if self._disposition_cache_size is None:
+            self._disposition_cache = None
+        else:
+            self._disposition_cache = LRUCache(self._disposition_cache_size)
+
+    def enable_disposition_cache(self, maxsize=DISPOSITION_CACHE_SIZE):
+        """
+        Cache the results of label processing across calls.
+
+        The results of `test_label_eligible` and `compute_label_disposition`
+        are cached by label and options, the least recently used results being
+        evicted when the cache is full.
+        The cache is cleared each time the LGR is modified through its API.
+
+        :param maxsize: The maximum number of results to cache.
+        """
+        if maxsize < 1:
+            logger.error('Invalid disposition cache size %s', maxsize)
+            raise LGRApiInvalidParameter('maxsize')
+        self._disposition_cache_size = maxsize
+        self._disposition_cache = LRUCache(maxsize)
+
+    def disable_disposition_cache(self):
+        """
+        Stop caching the results of label processing, see `enable_disposition_cache`.
+        """
+        self._disposition_cache_size = None
+        self._disposition_cache = None
+
+    def disposition_cache_info(self):
+        """
+        Get the statistics of the label processing results cache.
+
+        Statistics are reset when the LGR is modified.
+
+        :return: CacheInfo(hits, misses, maxsize, currsize), None if the cache is disabled.
+        """
+        cache = self._disposition_cache
+        return None if cache is None else cache.info()
 
     @property
     def effective_actions(self):
@@ -198,6 +301,7 @@ class LGR(object):
                            "when LGR Unicode version is '%s'",
                            unidb_version, self.metadata.unicode_version)
         self._unicode_database = unidb
+        self._reset_caches()
 
     def add_reference(self, value, comment=None, ref_id=None):
         """
@@ -211,6 +315,7 @@ class LGR(object):
                                         and a reference with this id
                                         already exists.
         """
+        self._reset_caches()
         return self.reference_manager.add_reference(value,
                                                     comment=comment,
                                                     ref_id=ref_id)
@@ -223,6 +328,7 @@ class LGR(object):
         :param ref_id:
         :raises ReferenceNotDefined: if the ref_id is not defined.
         """
+        self._reset_caches()
         self.repertoire.del_reference(ref_id)
         self.reference_manager.del_reference(ref_id)
 
@@ -235,6 +341,7 @@ class LGR(object):
 
         :param tag_id: The tag name.
         """
+        self._reset_caches()
         self.repertoire.del_tag(tag_id)
         self.classes_lookup.pop(TAG_CLASSNAME_PREFIX + tag_id, None)
 
@@ -288,6 +395,7 @@ class LGR(object):
         >>> lgr.repertoire[[0x0063, 0x002D]] is not None
         True
         """
+        self._reset_caches()
         logger.debug("Add cp '%s' to LGR '%s'", cp_or_sequence, self)
 
         cp_or_sequence = self._check_convert_cp(cp_or_sequence)
@@ -406,6 +514,7 @@ class LGR(object):
         >>> len(lgr.repertoire) == 0
         True
         """
+        self._reset_caches()
         logger.debug("Delete cp '%s' from LGR '%s'", cp_or_sequence, self)
 
         cp_or_sequence = self._check_convert_cp(cp_or_sequence)
@@ -456,6 +565,7 @@ class LGR(object):
         >>> 0x007A in lgr.repertoire
         True
         """
+        self._reset_caches()
         logger.debug("Add range '%s-%s' to LGR '%s'", first_cp, last_cp, self)
 
         if first_cp > last_cp:
@@ -568,6 +678,7 @@ class LGR(object):
         >>> len(lgr.repertoire)
         0
         """
+        self._reset_caches()
         logger.debug("Delete range '%s-%s' from LGR '%s'",
                      first_cp, last_cp, self)
 
@@ -612,6 +723,7 @@ class LGR(object):
         # Retrieve the first char as a reference for properties.
         range_char = self.get_char(first_cp)
 
+        self._reset_caches()
         self.repertoire.del_range(first_cp, last_cp)
 
         for cp in range(first_cp, last_cp + 1):
@@ -673,6 +785,7 @@ class LGR(object):
         ...
         NotInLGR:
         """
+        self._reset_caches()
         logger.debug("Add variant '%s' for cp '%s' to LGR '%s'",
                      variant_cp, cp_or_sequence, self)
 
@@ -767,6 +880,7 @@ class LGR(object):
         ...
         NotInLGR:
         """
+        self._reset_caches()
         logger.debug("Delete variant '%s' for cp '%s' from LGR '%s'",
                      variant_cp, cp_or_sequence, self)
 
@@ -974,6 +1088,7 @@ class LGR(object):
         :param force: If True, insert the rule in the LGR even if it does not
                       validate.
         """
+        self._reset_caches()
         logger.debug("Add '%s'", rule)
 
         try:
@@ -995,6 +1110,7 @@ class LGR(object):
         :param force: If True, insert the action in the LGR even if it does not
                       validate.
         """
+        self._reset_caches()
         logger.debug("Add '%s'", action)
         # TODO: implement action validity testing
         self.actions.append(action)
@@ -1007,6 +1123,7 @@ class LGR(object):
         :param force: If True, insert the class in the LGR even if it does not
                       validate.
         """
+        self._reset_caches()
         logger.debug("Add '%s'", cls)
         try:
             cls.validate([], self.rules_lookup, self.classes_lookup)
@@ -1018,6 +1135,18 @@ class LGR(object):
         self.classes_lookup[cls.name] = cls
         self.classes.append(cls.name)
 
+    def compile(self):
+        """
+        Compile the LGR to a frozen snapshot optimised for label processing.
+
+        The compiled LGR exposes the same label processing API
+        (eligibility, disposition, index label...) but cannot be modified.
+        Further modifications of this LGR are not reflected in the compiled one.
+
+        :return: The CompiledLGR object.
+        """
+        from lgr.compiled import CompiledLGR
+        return CompiledLGR(self)
 
     # TODO get rid of generate_chars and always return them
     def test_label_eligible(self, label, is_variant=False, collect_log=True, generate_chars=False):
@@ -1029,7 +1158,8 @@ class LGR(object):
 
         :param label: The label to test, as an array of codepoints.
         :param is_variant: Whether we are testing a variant label eligibility.
-        :param collect_log: If False, do not collect rule processing log.
+        :param collect_log: If False, do not collect rule processing log,
+                            nor forward its debug and info messages to the logger.
         :return: (result, label_parts, label_invalid_parts, disposition, action_idx, log)
                  with:
 
@@ -1048,65 +1178,122 @@ class LGR(object):
         if not label:
             raise LGRApiInvalidParameter('label')
 
-        log_output = StringIO()
+        # Get the cache once, as it may be replaced by _reset_caches
+        cache = self._disposition_cache
+        if cache is not None:
+            key = ('eligible', tuple(label), is_variant, collect_log, generate_chars)
+            try:
+                return _copy_result(cache[key])
+            except KeyError:
+                pass
+
         if collect_log:
-            # Configure log system to redirect logs to local attribute
-            ch = logging.StreamHandler(log_output)
-            ch.setLevel(logging.INFO)
-            rule_logger.addHandler(ch)
+            trace = RuleTrace(logging.INFO)
+        else:
+            trace = RuleTrace(log_level=QUIET_LEVEL)
+        result = self._test_label_eligible(label, is_variant=is_variant, generate_chars=generate_chars, trace=trace)
+        if cache is not None:
+            cache[key] = result
+            return _copy_result(result)
+        return result
+
+    def _test_label_eligible(self, label, is_variant=False, generate_chars=False, trace=None):
+        """
+        Test label eligibility against an LGR.
+
+        :param label: The label to test, as an array of codepoints.
+        :param is_variant: Whether we are testing a variant label eligibility.
+        :param generate_chars: Whether to return the LGR chars included in label.
+        :param trace: The RuleTrace collecting the rule processing log.
+        :return: See test_label_eligible.
+        """
+        if trace is None:
+            trace = RuleTrace()
 
         # Start by testing presence of code points in LGR
         chars = []
         if generate_chars:
-            (valid, label_parts, label_invalid_parts, chars) = self._test_preliminary_eligibility(label, generate_chars=generate_chars)
+            (valid, label_parts, label_invalid_parts, chars) = self._test_preliminary_eligibility(label,
+                                                                                                  generate_chars=True,
+                                                                                                  trace=trace)
         else:
-            (valid, label_parts, label_invalid_parts) = self._test_preliminary_eligibility(label, generate_chars=generate_chars)
+            (valid, label_parts, label_invalid_parts) = self._test_preliminary_eligibility(label, trace=trace)
         if not valid:
-            rule_logger.error("Label '%s' is not in the LGR", format_cp(label))
-            if collect_log:
-                rule_logger.removeHandler(ch)
+            trace.error("Label '%s' is not in the LGR", format_cp(label))
             if generate_chars:
-                return False, label_parts, label_invalid_parts, INVALID_DISPOSITION, -1, log_output.getvalue(), chars
+                return False, label_parts, label_invalid_parts, INVALID_DISPOSITION, -1, trace.getvalue(), chars
             else:
-                return False, label_parts, label_invalid_parts, INVALID_DISPOSITION, -1, log_output.getvalue()
+                return False, label_parts, label_invalid_parts, INVALID_DISPOSITION, -1, trace.getvalue()
 
         # Compute label disposition by analyzing reflexive mappings
-        (disposition, action_idx) = self._test_label_disposition(label, apply_reflexive_mapping=not is_variant)
+        (disposition, action_idx) = self._test_label_disposition(label, apply_reflexive_mapping=not is_variant,
+                                                                 trace=trace)
         if disposition == INVALID_DISPOSITION:
-            rule_logger.error("Invalid disposition for reflexive mapping, "
-                              "triggered by action #%d", action_idx)
-            if collect_log:
-                rule_logger.removeHandler(ch)
+            trace.error("Invalid disposition for reflexive mapping, "
+                        "triggered by action #%d", action_idx)
             if generate_chars:
-                return False, [], [], disposition, action_idx, log_output.getvalue(), chars
+                return False, [], [], disposition, action_idx, trace.getvalue(), chars
             else:
-                return False, [], [], disposition, action_idx, log_output.getvalue()
+                return False, [], [], disposition, action_idx, trace.getvalue()
 
-        if collect_log:
-            rule_logger.removeHandler(ch)
         if generate_chars:
-            return True, label, [], disposition, action_idx, log_output.getvalue(), chars
+            return True, label, [], disposition, action_idx, trace.getvalue(), chars
         else:
-            return True, label, [], disposition, action_idx, log_output.getvalue()
+            return True, label, [], disposition, action_idx, trace.getvalue()
+
+    def evaluate_labels(self, labels, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                        with_variants=False, hide_mixed_script_variants=False,
+                        unidb_factory=None):
+        """
+        Evaluate a stream of labels, possibly in parallel.
+
+        :param labels: Iterable of labels, as sequences of code points.
+        :param workers: Number of worker processes, all available cores if None.
+                        If 1, labels are evaluated in the current process.
+        :param chunk_size: Number of labels sent at once to a worker.
+        :param with_variants: If True, also compute the variants of eligible labels.
+        :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+        :param unidb_factory: Picklable callable returning the Unicode database to use in workers,
+                              needed if the Unicode database cannot be pickled.
+        :return: Generator of LabelEvaluation, in the order of the input labels.
+        """
+        # Let evaluate module handle that
+        return evaluate_labels(self, labels,
+                               workers=workers,
+                               chunk_size=chunk_size,
+                               with_variants=with_variants,
+                               hide_mixed_script_variants=hide_mixed_script_variants,
+                               unidb_factory=unidb_factory)
 
     def compute_label_disposition(self, label, include_invalid=False,
                                   collect_log=True, hide_mixed_script_variants=False,
-                                  with_labels=None, generate_chars=False):
+                                  with_labels=None, generate_chars=False, budget=None):
         """
         Given a label, compute its disposition and its variants.
 
         The original label (unpermuted or with reflexive variants) will be the
         last label returned.
 
+        If a budget is given and gets exhausted, the variants generation is
+        stopped: the variants already computed and the original label are
+        still returned, and `budget.truncated` is set to the reason of the truncation.
+
+        If the disposition cache is enabled (see `enable_disposition_cache`)
+        and neither `with_labels` nor `budget` are given, all the results are
+        computed on the first iteration and cached.
+
         :param label: The label to compute the disposition of,
                       as a sequence of code points.
                       Label MUST be eligible.
         :param include_invalid: If True, also return variants with "invalid"
                                 disposition, which are normally eliminated
                                 during the generation process.
-        :param collect_log: If False, do not collect rule processing log.
+        :param collect_log: If False, do not collect rule processing log,
+                            nor forward its debug and info messages to the logger.
         :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
         :param with_labels: Compute disposition of selected labels only, all if None
+        :param generate_chars: Whether to return the LGR chars included in variants.
+        :param budget: The VariantBudget limiting the variants generation, None for no limit.
         :return: Generator of (variant_cp, variant_invalid_parts, disp, action_idx, disp_set, log)
                  with:
                      - variant_cp: The code point sequence of a variant.
@@ -1118,6 +1305,44 @@ class LGR(object):
                              empty if collect_log is True.
                      - chars: List of the LGR chars included in label (as a CharBase class) if generate_chars is True
         """
+        # Get the cache once, as it may be replaced by _reset_caches
+        cache = self._disposition_cache
+        if cache is None or with_labels or budget is not None:
+            yield from self._compute_label_disposition(label, include_invalid=include_invalid,
+                                                       collect_log=collect_log,
+                                                       hide_mixed_script_variants=hide_mixed_script_variants,
+                                                       with_labels=with_labels,
+                                                       generate_chars=generate_chars,
+                                                       budget=budget)
+            return
+
+        key = ('disposition', tuple(label), include_invalid, collect_log, hide_mixed_script_variants, generate_chars)
+        try:
+            results = cache[key]
+        except KeyError:
+            results = tuple(self._compute_label_disposition(label, include_invalid=include_invalid,
+                                                            collect_log=collect_log,
+                                                            hide_mixed_script_variants=hide_mixed_script_variants,
+                                                            generate_chars=generate_chars))
+            cache[key] = results
+        for result in results:
+            yield _copy_result(result)
+
+    def _compute_label_disposition(self, label, include_invalid=False,
+                                   collect_log=True, hide_mixed_script_variants=False,
+                                   with_labels=None, generate_chars=False, budget=None):
+        """
+        Given a label, compute its disposition and its variants.
+
+        :param label: The label to compute the disposition of.
+        :param include_invalid: If True, also return variants with "invalid" disposition.
+        :param collect_log: If False, do not collect rule processing log.
+        :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+        :param with_labels: Compute disposition of selected labels only, all if None
+        :param generate_chars: Whether to return the LGR chars included in variants.
+        :param budget: The VariantBudget limiting the variants generation, None for no limit.
+        :return: See compute_label_disposition.
+        """
         # Implements process described in 8. Processing a Label Against an LGR
 
         if self._unicode_database is None:
@@ -1134,71 +1359,75 @@ class LGR(object):
 
         # 8.2 Determining Variants for a Label
         # Step 1 - 2 - 3
-        variant_set = self._generate_label_variants(label, hide_mixed_script_variants=hide_mixed_script_variants)
+        if budget is not None:
+            budget.start()
+        # Variants generation log is not collected
+        trace = RuleTrace(budget=budget, log_level=None if collect_log else QUIET_LEVEL)
+        variant_set = self._generate_label_variants(label, hide_mixed_script_variants=hide_mixed_script_variants,
+                                                    trace=trace)
 
         original_label = None
         # sometimes we have duplicated (e.g. twice the same characters)
         already_handled = set()
 
-        # Step 4 - 8.3.  Determining a Disposition for a Label or Variant Label
-        for (variant_cp, disp_set, only_variants, chars) in variant_set:
-            # TODO fix methods using this with !generate_chars:
-            #  we should get all combination of chars with the same variant_cp here and
-            #  then decide which disposition to keep, and not only handle the first one
-            if not generate_chars and variant_cp in already_handled:
-                continue
+        try:
+            # Step 4 - 8.3.  Determining a Disposition for a Label or Variant Label
+            for (variant_cp, disp_set, only_variants, chars) in variant_set:
+                # TODO fix methods using this with !generate_chars:
+                #  we should get all combination of chars with the same variant_cp here and
+                #  then decide which disposition to keep, and not only handle the first one
+                if not generate_chars and variant_cp in already_handled:
+                    continue
 
-            # TODO we may have another method that doesn't retrieve all variants then loop to
-            # find with_labels, but only loop on the labels in with_labels, and ensure they
-            # share the same index for sanity checking
-            if with_labels and variant_cp not in with_labels:
-                continue
-            already_handled.add(variant_cp)
-            # Configure log system to redirect logs to local attribute
-            log_output = StringIO()
-            if collect_log:
-                ch = logging.StreamHandler(log_output)
-                ch.setLevel(logging.DEBUG)
-                rule_logger.addHandler(ch)
-
-            # 8.3.  Determining a Disposition for a Label or Variant Label
-            # Step 1
-            eligible, _, variant_invalid_parts, _, idx, _ = self.test_label_eligible(variant_cp,
-                                                                                     is_variant=variant_cp != label,
-                                                                                     collect_log=collect_log)
-            if not eligible:
-                variant_disp = INVALID_DISPOSITION
-            else:
-                # 8.3.  Determining a Disposition for a Label or Variant Label
-                # Step 2 - 3
-                (variant_disp, idx) = self._apply_actions(variant_cp,
-                                                          disp_set,
-                                                          only_variants)
+                # TODO we may have another method that doesn't retrieve all variants then loop to
+                # find with_labels, but only loop on the labels in with_labels, and ensure they
+                # share the same index for sanity checking
+                if with_labels and variant_cp not in with_labels:
+                    continue
+                already_handled.add(variant_cp)
+                if budget is not None:
+                    budget.add_variant()
+                variant_trace = RuleTrace(logging.DEBUG, budget=budget) if collect_log else trace
 
-                if variant_disp is None:
-                    # 8.3.  Determining a Disposition for a Label or Variant Label
-                    # Step 4
-                    variant_disp = DEFAULT_DISPOSITION
-
-            if (variant_disp != INVALID_DISPOSITION) or include_invalid:
-                if variant_cp == label:
-                    # Skip original label, yield last
-                    if generate_chars:
-                        original_label = variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log_output.getvalue(), chars
-                    else:
-                        original_label = variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log_output.getvalue()
+                # 8.3.  Determining a Disposition for a Label or Variant Label
+                # Step 1
+                eligible, _, variant_invalid_parts, _, idx, _ = self._test_label_eligible(variant_cp,
+                                                                                          is_variant=variant_cp != label,
+                                                                                          trace=variant_trace)
+                if not eligible:
+                    variant_disp = INVALID_DISPOSITION
                 else:
-                    if generate_chars:
-                        yield variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log_output.getvalue(), chars
+                    # 8.3.  Determining a Disposition for a Label or Variant Label
+                    # Step 2 - 3
+                    (variant_disp, idx) = self._apply_actions(variant_cp,
+                                                              disp_set,
+                                                              only_variants,
+                                                              trace=variant_trace)
+
+                    if variant_disp is None:
+                        # 8.3.  Determining a Disposition for a Label or Variant Label
+                        # Step 4
+                        variant_disp = DEFAULT_DISPOSITION
+
+                if (variant_disp != INVALID_DISPOSITION) or include_invalid:
+                    log = variant_trace.getvalue() if collect_log else ''
+                    if variant_cp == label:
+                        # Skip original label, yield last
+                        if generate_chars:
+                            original_label = variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log, chars
+                        else:
+                            original_label = variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log
                     else:
-                        yield variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log_output.getvalue()
-
-            if collect_log:
-                rule_logger.removeHandler(ch)
+                        if generate_chars:
+                            yield variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log, chars
+                        else:
+                            yield variant_cp, variant_disp, variant_invalid_parts, idx, disp_set, log
+        except BudgetExceeded as exc:
+            trace.warning("Variants generation of label '%s' stopped: %s", format_cp(label), exc.reason)
 
         if not original_label:
             # TODO: already computed since label MUST be eligible
-            rule_logger.debug('Add original label')
+            trace.debug('Add original label')
             if generate_chars:
                 _, _, _, disposition, action_idx, log, chars = self.test_label_eligible(label, collect_log=collect_log,
                                                                                         generate_chars=generate_chars)
@@ -1210,7 +1439,8 @@ class LGR(object):
 
         yield original_label
 
-    def compute_label_disposition_summary(self, label, include_invalid=False, hide_mixed_script_variants=False):
+    def compute_label_disposition_summary(self, label, include_invalid=False, hide_mixed_script_variants=False,
+                                          budget=None):
         """
         Given a label compute its disposition and variants along with a summary.
 
@@ -1221,6 +1451,7 @@ class LGR(object):
                                 disposition, which are normally eliminated
                                 during the generation process.
         :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+        :param budget: The VariantBudget limiting the variants generation, None for no limit.
         :return: Generator of (variant_cp, variant_invalid_parts, disp, action_idx, disp_set, log)
                  with:
 
@@ -1237,12 +1468,158 @@ class LGR(object):
         # This might cause some issues with memory/time computation.
         label_dispositions = list(self.compute_label_disposition(label,
                                                                  include_invalid=include_invalid,
-                                                                 hide_mixed_script_variants=hide_mixed_script_variants))
+                                                                 hide_mixed_script_variants=hide_mixed_script_variants,
+                                                                 budget=budget))
 
         summary = collections.Counter([disp for (_, disp, _, _, _, _)
                                        in label_dispositions])
         return summary, label_dispositions
 
+    def count_label_dispositions(self, label, include_invalid=False, hide_mixed_script_variants=False):
+        """
+        Count the variants of a label by disposition.
+
+        Give the same counts as the summary of `compute_label_disposition_summary`.
+        When possible, variants are counted position by position without being
+        enumerated, so the time is linear in the label length and not
+        in the number of variants.
+        This is not possible if the label characters or their variants are
+        sequences or have context rules, if an action uses a rule, or if
+        mixed scripts variants are hidden: variants are then enumerated.
+
+        :param label: The label to compute the disposition of,
+                      as a sequence of code points.
+                      Label MUST be eligible.
+        :param include_invalid: If True, also count variants with "invalid"
+                                disposition.
+        :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+        :return: Counter of the number of variants (including the label) by disposition.
+        """
+        if self._unicode_database is None:
+            logger.error("You need to define the Unicode database "
+                         "to use this function")
+            raise LGRApiException()
+
+        if len(label) > PROTOCOL_LABEL_MAX_LENGTH:
+            logger.warning('Label is too long')
+            raise LGRApiInvalidParameter('label')
+
+        label = tuple(label)
+        counts = None
+        if not hide_mixed_script_variants:
+            counts = self._count_label_dispositions(label, include_invalid)
+        if counts is None:
+            logger.debug("Cannot count variants of label '%s' without enumerating them", format_cp(label))
+            counts = collections.Counter(disp for (_, disp, _, _, _, _)
+                                         in self.compute_label_disposition(label,
+                                                                           include_invalid=include_invalid,
+                                                                           collect_log=False,
+                                                                           hide_mixed_script_variants=hide_mixed_script_variants))
+        return counts
+
+    def _count_label_dispositions(self, label, include_invalid):
+        """
+        Count the variants of a label by disposition, without enumerating them.
+
+        Follow the variants generation of `_generate_label_variants` and the
+        disposition computation of `compute_label_disposition`, in the case
+        where the disposition of a variant only depends on its disposition set
+        and only-variants flag, and its eligibility only on each of its code points.
+        The number of variants is then computed position by position, for each
+        (disposition set, only variants, eligible, same as label) state.
+
+        :param label: The label to compute the disposition of, as a tuple of code points.
+        :param include_invalid: If True, also count variants with "invalid" disposition.
+        :return: Counter of the number of variants by disposition,
+                 None if variants need to be enumerated.
+        """
+        if not label:
+            return None
+
+        if any(action.match is not None or action.not_match is not None
+               for action in self.effective_actions):
+            # Disposition depends on the whole variant label
+            return None
+
+        def get_single_char(cp):
+            # Return (safe, char) with char the LGR character of cp (None if cp is not in LGR),
+            # and safe False if cp may be a part of a sequence or the character has a context rule
+            if self.repertoire.starts_sequence(cp):
+                return False, None
+            chars = self.repertoire.get_chars_matching((cp,))
+            if not chars:
+                return True, None
+            char = chars[0]
+            return char.when is None and char.not_when is None, char
+
+        # For each position: (character, [(disp, is_variant, eligible, same as label), ...])
+        positions = []
+        for cp in label:
+            (safe, char) = get_single_char(cp)
+            if not safe or char is None:
+                return None
+            perms = []
+            has_reflexive_mapping = False
+            for var in char.get_variants():
+                if len(var.cp) != 1 or var.when is not None or var.not_when is not None:
+                    return None
+                (var_safe, var_char) = get_single_char(var.cp[0])
+                if not var_safe:
+                    return None
+                is_reflexive = var.cp == char.cp
+                has_reflexive_mapping |= is_reflexive
+                var_disp = frozenset() if var.type is None else frozenset([var.type])
+                perms.append((var_disp, True, var_char is not None, is_reflexive))
+            if not has_reflexive_mapping:
+                perms.insert(0, (frozenset(), False, True, True))
+            positions.append((char, has_reflexive_mapping, perms))
+
+        # (disp_set, only_variants, eligible, same as label) -> number of variant labels
+        states = {(frozenset(), True, True, True): 1}
+        for (_, _, perms) in positions:
+            next_states = collections.Counter()
+            for ((disp_set, only_variants, eligible, same), count) in states.items():
+                for (disp, is_variant, var_eligible, is_same) in perms:
+                    next_states[(disp_set | disp,
+                                 only_variants and is_variant,
+                                 eligible and var_eligible,
+                                 same and is_same)] += count
+            states = next_states
+
+        dispositions = {}
+
+        def get_disposition(disp_set, only_variants):
+            key = (disp_set, only_variants)
+            if key not in dispositions:
+                (disp, _) = self._apply_actions(label, disp_set, only_variants)
+                dispositions[key] = DEFAULT_DISPOSITION if disp is None else disp
+            return dispositions[key]
+
+        # Disposition computed for a variant, when testing its eligibility
+        variant_invalid = self._apply_actions(label, set(), False)[0] == INVALID_DISPOSITION
+
+        counts = collections.Counter()
+        original_state = None
+        for ((disp_set, only_variants, eligible, same), count) in states.items():
+            if same:
+                original_state = (disp_set, only_variants)
+                continue
+            if not eligible or variant_invalid:
+                disp = INVALID_DISPOSITION
+            else:
+                disp = get_disposition(disp_set, only_variants)
+            if disp != INVALID_DISPOSITION or include_invalid:
+                counts[disp] += count
+
+        # The original label is only generated as a variant if it contains a variant,
+        # see _generate_label_variants
+        (eligible, _, _, disp, _, _) = self._test_label_eligible(label)
+        if eligible and (any(reflexive for (_, reflexive, _) in positions[:-1]) or positions[-1][0].has_variant()):
+            disp = get_disposition(*original_state)
+        counts[disp] += 1
+
+        return counts
+
     def estimate_variant_number(self, label, hide_mixed_script_variants=False):
         """
         Given a label, return the estimated number of variants.
@@ -1310,26 +1687,19 @@ class LGR(object):
 
         logger.debug("Generating index label for '%s'", format_cp(label))
 
-        (result, _, not_in_lgr, _) = self._test_preliminary_eligibility(label, generate_chars=True)
+        trace = RuleTrace()
+        (result, _, not_in_lgr, _) = self._test_preliminary_eligibility(label, generate_chars=True, trace=trace)
         if not result:
             logger.error('Label %s is not in LGR', format_cp(label))
             # If not result, there is at least on element in not_in_lgr.
             # See _test_preliminary_eligibility()
             raise NotInLGR(not_in_lgr[0][0])
 
-        logger.debug("Generating label partitions for '%s'", format_cp(label))
-        partitions = self._generate_label_partitions(label)
-        logger.debug("%d partition(s) found", len(partitions))
-
-        indexes = []
-        # We compute the index label for each partition then select the lowest in code point order
+        # We need the lowest index label in code point order among all label partitions.
         # Most cases would work by only computing the happy path, but some edge cases would prevent this.
         # For instance, if THE sequence {a,c} has variant {a}, then a happy path would lead to index 'ac' while
         # full computation would bring 'abc' which is lower in code point order.
-        for partition in partitions:
-            indexes.append(self._generate_index_label_on_partition(partition))
-
-        index_label = min(indexes)
+        index_label = self._generate_min_index_label(label, trace=trace)
         logger.debug("Index label: '%s'", index_label)
 
         # max_recursion should be 0 to be compliant with the Index Label Calculation reference
@@ -1346,45 +1716,139 @@ class LGR(object):
 
         return tuple(index_label)
 
-    def _generate_index_label_on_partition(self, chars):
+    def _generate_index_label_on_partition(self, chars, trace=None):
         """
         Generate the "index label" for a list of chars.
 
         :param chars: The list of chars to compute the disposition of.
+        :param trace: The RuleTrace collecting the rule processing log.
 
         :return: The index label, as a list and the index computed with minimum code point algorithm if required.
         """
         logger.debug("Computing index label for partition: %s", chars)
+        label = tuple(c for char in chars for c in char.cp)
         index_label = []
-        prefix = tuple()
-        suffix = tuple(c for cp in chars[1:] for c in cp.cp)
         idx = 0
         for char in chars:
-            logger.debug('Char CP: %s', format_cp(char.cp))
-            # Index: smallest id of the char and its variants
-            ids = [list(char.cp)]
-            for var in char.get_variants():
-                var_label = prefix + var.cp + suffix
-                logger.debug('Variant: %r', var)
-                if not self._test_context_rules(var, var_label, idx):
-                    # As per Root Zone Label Generation Rules (RZ LGR-6) Overview and Summary, section 5.5.4, step 2.c,
-                    # "In determining available variants for the following, any variant that has a variant context rule
-                    #  and does not satisfy that rule for the input label at that location is ignored."
-                    logger.debug('Variant %r does not satisfy context rule, skip', var)
-                    continue
-                ids.append(list(var.cp))
-            logger.debug('List of variant ids: %s', ids)
-            index_label.extend(list(min(ids)))
-            prefix += char.cp
-            suffix = suffix[len(char):]
+            index_label.extend(self._get_char_index(char, label, idx, trace=trace))
             idx += len(char)
 
         logger.debug("Index label: '%s'", index_label)
 
         return tuple(index_label)
 
+    def _generate_min_index_label(self, label, trace=None):
+        """
+        Generate the lowest "index label" among all the partitions of a label.
+
+        Give the same result as computing the index label of each partition
+        from `_generate_label_partitions`, then taking the lowest one, without
+        enumerating the partitions.
+        As prefix + x < prefix + y if and only if x < y, the lowest index label
+        of the label from a position is the lowest (char index + lowest
+        index label of the label after the char) among the chars at this position.
+        Lowest index labels are then computed once for each position,
+        from the end of the label.
+
+        :param label: The label to compute the index label of, as a sequence of code points.
+        :param trace: The RuleTrace collecting the rule processing log.
 
-    def _generate_label_partitions(self, label, prefix=None):
+        :return: The index label, as a tuple. None if label cannot be partitioned.
+        """
+        label = tuple(label)
+        cp_indexes = [self._get_cp_index(cp) for cp in label]
+        if None not in cp_indexes:
+            # Context-free label
+            return tuple(c for cp_index in cp_indexes for c in cp_index)
+
+        label_length = len(label)
+        # Lowest index label of label[i:], None if it cannot be partitioned
+        lowest = [None] * (label_length + 1)
+        lowest[label_length] = tuple()
+        for i in range(label_length - 1, -1, -1):
+            if cp_indexes[i] is not None:
+                # Only one char, without context rule
+                rest = lowest[i + 1]
+                lowest[i] = None if rest is None else cp_indexes[i] + rest
+                continue
+            for char in self.repertoire.get_chars_matching(label, i):
+                rest = lowest[i + len(char)]
+                if rest is None:
+                    continue
+                if not self._test_context_rules(char, label, i, trace=trace):
+                    # As per Root Zone Label Generation Rules (RZ LGR-6) Overview and Summary, section 5.5.4,
+                    # step 2.b, "Further evaluation is skipped for any [partition] that have a code point context
+                    # rule and do not satisfy that rule for the input label at that location."
+                    continue
+                index_label = self._get_char_index(char, label, i, trace=trace) + rest
+                if lowest[i] is None or index_label < lowest[i]:
+                    lowest[i] = index_label
+        return lowest[0]
+
+    def _get_cp_index(self, cp):
+        """
+        Get the index of a code point which does not depend on the label.
+
+        This is the case if no sequence starts with the code point, and if
+        its char and variants have no context rule: the index is then the
+        lowest code point sequence among the char and its variants.
+        Indexes are computed once and stored in a table.
+
+        :param cp: The code point.
+        :return: The index of the code point, as a tuple.
+                 None if it depends on the label, or if cp is not in LGR.
+        """
+        table = self._cp_index_table
+        try:
+            return table[cp]
+        except KeyError:
+            pass
+
+        index = None
+        if not self.repertoire.starts_sequence(cp):
+            chars = self.repertoire.get_chars_matching((cp,))
+            if chars and chars[0].when is None and chars[0].not_when is None:
+                ids = [chars[0].cp]
+                for var in chars[0].get_variants():
+                    if var.when is not None or var.not_when is not None:
+                        break
+                    ids.append(var.cp)
+                else:
+                    index = tuple(min(ids))
+        table[cp] = index
+        return index
+
+    def _get_char_index(self, char, label, index, trace=None):
+        """
+        Get the index of a char of a label: the lowest code point sequence
+        among the char and its variants.
+
+        :param char: The char.
+        :param label: The label, as a tuple of code points.
+        :param index: The position of the char in the label.
+        :param trace: The RuleTrace collecting the rule processing log.
+
+        :return: The index of the char, as a tuple.
+        """
+        logger.debug('Char CP: %s', format_cp(char.cp))
+        prefix = label[:index]
+        suffix = label[index + len(char):]
+        # Index: smallest id of the char and its variants
+        ids = [char.cp]
+        for var in char.get_variants():
+            var_label = prefix + var.cp + suffix
+            logger.debug('Variant: %r', var)
+            if not self._test_context_rules(var, var_label, index, trace=trace):
+                # As per Root Zone Label Generation Rules (RZ LGR-6) Overview and Summary, section 5.5.4, step 2.c,
+                # "In determining available variants for the following, any variant that has a variant context rule
+                #  and does not satisfy that rule for the input label at that location is ignored."
+                logger.debug('Variant %r does not satisfy context rule, skip', var)
+                continue
+            ids.append(var.cp)
+        logger.debug('List of variant ids: %s', ids)
+        return tuple(min(ids))
+
+    def _generate_label_partitions(self, label, prefix=None, trace=None):
         """
         Retrieve all partitions of a given label.
 
@@ -1393,29 +1857,26 @@ class LGR(object):
         then label 'abc' can be partitioned as: ab c and a b c.
 
         :param label: The label to compute the disposition of, as a sequence of code points.
+        :param prefix: The prefix of the label (used for recursion).
+        :param trace: The RuleTrace collecting the rule processing log.
 
         :return: A list of label partitions, as lists of chars. An empty list if label in invalid.
         """
+        if trace is None:
+            trace = RuleTrace()
         all_partitions = []
-        cp = label[0]
         prefix = prefix or ()
         original_label = prefix + tuple(label)
 
-        try:
-            char_list = self.repertoire.get_chars_from_prefix(cp)
-        except NotInLGR:
-            return []
-
-        for char in char_list:
-            if not char.is_prefix_of(label):
-                continue
-            if not self._test_context_rules(char, original_label, len(prefix)):
+        for char in self.repertoire.get_chars_matching(label):
+            if not self._test_context_rules(char, original_label, len(prefix), trace=trace):
                 # As per Root Zone Label Generation Rules (RZ LGR-6) Overview and Summary, section 5.5.4, step 2.b,
                 # "Further evaluation is skipped for any [partition] that have a code point context rule and do not
                 #  satisfy that rule for the input label at that location."
                 continue
             if len(label) > len(char):
-                partitions = self._generate_label_partitions(label[len(char):], prefix=prefix + char.cp)
+                partitions = self._generate_label_partitions(label[len(char):], prefix=prefix + char.cp,
+                                                             trace=trace)
                 if not partitions:
                     continue
                 for label_partition in partitions:
@@ -1511,7 +1972,7 @@ class LGR(object):
         logger.debug('Populate LGR variants')
         return populate_lgr(self)
 
-    def _test_preliminary_eligibility(self, label, generate_chars=False):
+    def _test_preliminary_eligibility(self, label, generate_chars=False, trace=None):
         """
         Test label eligibility against an LGR.
 
@@ -1519,6 +1980,7 @@ class LGR(object):
 
         :param label: The label to test, as an array of codepoints.
         :param generate_chars: Return list of corresponding char objects.
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: (result, label_parts, label_invalid_parts, chars), with:
 
                  * result: True if the label is eligible according to the LGR,
@@ -1531,7 +1993,10 @@ class LGR(object):
                           (only if generate_chars=True).
         :raises RuleError: If rule is invalid.
         """
-        rule_logger.debug("Testing label '%s'", format_cp(label))
+        if trace is None:
+            trace = RuleTrace()
+        if trace.debug_enabled:
+            trace.debug("Testing label '%s'", format_cp(label))
         i = 0
         label_length = len(label)
 
@@ -1544,14 +2009,12 @@ class LGR(object):
 
         while i < label_length:
             cp = label[i]
-            rule_logger.debug("Code point: '%s'", format_cp(cp))
+            if trace.debug_enabled:
+                trace.debug("Code point: '%s'", format_cp(cp))
 
-            try:
-                # Get the list of all char starting with this codepoint
-                char_list = self.repertoire.get_chars_from_prefix(cp)
-            except NotInLGR:
-                rule_logger.warning("No character in LGR starting with '%s'",
-                                    format_cp(cp))
+            if not self.repertoire.has_prefix(cp):
+                trace.warning("No character in LGR starting with '%s'",
+                              format_cp(cp))
                 result = False
                 label_invalid_parts.append((cp, None))
                 i += 1
@@ -1560,26 +2023,24 @@ class LGR(object):
             pending_rules_not_in_lgr = []
 
             valid = False
-            for char in char_list:
-                if isinstance(char, CharSequence):
-                    if not char.is_prefix_of(label[i:]):
-                        continue
-
+            # Get the list of all char matching the label at this position
+            for char in self.repertoire.get_chars_matching(label, i):
                 # Test when/not-when rules:
-                if not self._test_context_rules(char, label, i):
+                if not self._test_context_rules(char, label, i, trace=trace):
                     pending_rules_not_in_lgr.append(char.when or char.not_when)
                     continue
 
                 i += len(char)
                 valid = True
-                rule_logger.debug("Code point '%s' in LGR", format_cp(cp))
+                if trace.debug_enabled:
+                    trace.debug("Code point '%s' in LGR", format_cp(cp))
                 label_parts += char.cp
                 chars.append(char)
                 break
 
             if not valid:
-                rule_logger.warning("Code point '%s' does not comply with contextual rules: %s",
-                                    format_cp(cp), ','.join(pending_rules_not_in_lgr))
+                trace.warning("Code point '%s' does not comply with contextual rules: %s",
+                              format_cp(cp), ','.join(pending_rules_not_in_lgr))
                 result = False
                 label_invalid_parts.append((cp, pending_rules_not_in_lgr or None))
                 i += 1
@@ -1589,7 +2050,7 @@ class LGR(object):
         else:
             return result, label_parts, label_invalid_parts, chars
 
-    def _test_label_disposition(self, label, apply_reflexive_mapping=True):
+    def _test_label_disposition(self, label, apply_reflexive_mapping=True, trace=None):
         """
         Compute the final disposition of a label.
 
@@ -1600,6 +2061,7 @@ class LGR(object):
                       Must have passed the 'preliminary' eligibility test.
         :param apply_reflexive_mapping: Whether the reflexive mapping should be considered for disposition
                                         (This should be False when evaluating a variant)
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: - original_disp: The final disposition of the original label.
                  - action_idx: The index of the action which triggered
                                the disposition.
@@ -1609,7 +2071,10 @@ class LGR(object):
         # from _test_preliminary_eligibility and both of them could be merged in
         # the same code, but it feels cleaner to keep them separate.
 
-        rule_logger.info("Testing disposition of label %s", format_cp(label))
+        if trace is None:
+            trace = RuleTrace()
+        if trace.info_enabled:
+            trace.info("Testing disposition of label %s", format_cp(label))
 
         # Init to True so we can use simple test. Need a final check before use
         only_variants = True
@@ -1619,36 +2084,31 @@ class LGR(object):
 
         for i in range(len(label)):
             cp = label[i]
-            rule_logger.debug("Code point: '%s'", format_cp(cp))
+            if trace.debug_enabled:
+                trace.debug("Code point: '%s'", format_cp(cp))
 
-            try:
-                # Get the list of all char starting with this codepoint
-                char_list = self.repertoire.get_chars_from_prefix(cp)
-            except NotInLGR:
-                rule_logger.info("No character in LGR starting with '%s'", cp)
+            if not self.repertoire.has_prefix(cp):
+                trace.info("No character in LGR starting with '%s'", cp)
                 # Don't care that code point is not in LGR:
                 # We know that label is valid, so it must be a code point
                 # sequence which was collected when considering the
                 # first code point of the sequence.
                 continue
 
-            for char in char_list:
-                if isinstance(char, CharSequence):
-                    if not char.is_prefix_of(label[i:]):
-                        continue
-
+            # Get the list of all char matching the label at this position
+            for char in self.repertoire.get_chars_matching(label, i):
                 # Test when/not-when rules:
-                if not self._test_context_rules(char, label, i):
+                if not self._test_context_rules(char, label, i, trace=trace):
                     continue
 
                 is_variant = False
 
                 if apply_reflexive_mapping:
                     for var in char.get_reflexive_variants():
-                        if not self._test_context_rules(var, label, i):
+                        if not self._test_context_rules(var, label, i, trace=trace):
                             continue
 
-                        rule_logger.debug('Reflexive variant %s is valid', var)
+                        trace.debug('Reflexive variant %s is valid', var)
                         # Reflexive variant is valid, add disposition
                         disp_set.add(var.type)
 
@@ -1662,16 +2122,17 @@ class LGR(object):
         # Variants where encountered only if disp set is not empty
         only_variants = only_variants if len(disp_set) > 0 else False
 
-        rule_logger.info("Label '%s' gave reflexive mapping "
-                          "with disposition set %s",
-                          format_cp(label), disp_set)
-        rule_logger.info("Label '%s' gave reflexive mapping "
-                          "with only variants: %s",
-                          format_cp(label), only_variants)
+        if trace.info_enabled:
+            trace.info("Label '%s' gave reflexive mapping "
+                       "with disposition set %s",
+                       format_cp(label), disp_set)
+            trace.info("Label '%s' gave reflexive mapping "
+                       "with only variants: %s",
+                       format_cp(label), only_variants)
 
-        return self._apply_actions(label, disp_set, only_variants)
+        return self._apply_actions(label, disp_set, only_variants, trace=trace)
 
-    def _get_prefix_list(self, label, label_prefix):
+    def _get_prefix_list(self, label, label_prefix, trace=None):
         """
         Generate the list of characters with same prefix.
 
@@ -1681,15 +2142,14 @@ class LGR(object):
 
         :param label: The label to generate the variants of.
         :param label_prefix: The prefix of the label.
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: list of valid prefix characters.
         """
+        if trace is None:
+            trace = RuleTrace()
         prefix_list = []
-        for prefix in self.repertoire.get_chars_from_prefix(label[0],
-                                                            only_variants=True):
-            # Ensure prefix is valid for label
-            if not prefix.is_prefix_of(label):
-                continue
-
+        for prefix in self.repertoire.get_chars_matching(label,
+                                                         only_variants=True):
             # Generate "prefixed label":
             # label prefix + variant code point + label 'suffix'
             # label suffix is obtained by removing
@@ -1699,8 +2159,9 @@ class LGR(object):
             # Test when/not-when rules on prefixed_label
             if not self._test_context_rules(prefix,
                                             prefixed_label,
-                                            len(label_prefix)):
-                rule_logger.debug('No context rule')
+                                            len(label_prefix),
+                                            trace=trace):
+                trace.debug('No context rule')
                 continue
 
             prefix_list.append(prefix)
@@ -1711,7 +2172,8 @@ class LGR(object):
                                  orig_label=None, label_prefix=None,
                                  has_variant=False,
                                  mixed_script_filter: BaseMixedScriptsVariantFilter = None,
-                                 hide_mixed_script_variants=False):
+                                 hide_mixed_script_variants=False,
+                                 trace=None):
         """
         Generate a list of all the variants for a given label.
 
@@ -1731,6 +2193,7 @@ class LGR(object):
                             (used for recursion).
         :param mixed_script_filter: Filter for mixed script (used for recursion).
         :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: A generator of (variant_cp, variant_disp, only_variants, chars),
                  with:
 
@@ -1743,10 +2206,13 @@ class LGR(object):
                     * chars: List of the LGR chars included in label (as a CharBase class)
         :raises RuleError: If rule is invalid.
         """
-        rule_logger.debug("Generate variants for label %s", format_cp(label))
-        rule_logger.debug("Original label: %s", format_cp(orig_label))
-        rule_logger.debug("Prefix: %s", format_cp(label_prefix))
-        rule_logger.debug("Has Variant: %s", has_variant)
+        if trace is None:
+            trace = RuleTrace()
+        if trace.debug_enabled:
+            trace.debug("Generate variants for label %s", format_cp(label))
+            trace.debug("Original label: %s", format_cp(orig_label))
+            trace.debug("Prefix: %s", format_cp(label_prefix))
+            trace.debug("Has Variant: %s", has_variant)
 
         # current `label` will be consumed by recursion,
         # so need to save the original.
@@ -1758,41 +2224,37 @@ class LGR(object):
             label_prefix = tuple()
 
         if len(label) == 0:
-            rule_logger.debug("Empty label")
+            trace.debug("Empty label")
             return
 
+        if trace.budget is not None:
+            trace.budget.check()
+
         if hide_mixed_script_variants and not mixed_script_filter:
             mixed_script_filter = MixedScriptsVariantFilter(label, self.repertoire, unidb=self._unicode_database)
 
-        try:
-            same_prefix = self._get_prefix_list(label, label_prefix)
-        except NotInLGR:
-            rule_logger.debug('Char is not in LGR,'
-                              'assume we are handling a sequence')
-            # This is not an error: we might be handling code points
-            # belonging to a sequence which is being decomposed by the
-            # variant generation process.
-            # The sequence is part of the LGR,
-            # but not the individual code points.
-            same_prefix = []
-        else:
-            if len(same_prefix) == 0:
-                # No code point in LGR with variants,
-                # stick to first one found (longest in label)
-                for cp in self.repertoire.get_chars_from_prefix(label[0]):
-                    if cp.is_prefix_of(label):
-                        same_prefix = [cp]
-                        break
+        # Characters matching the start of the label, longest first.
+        # May be empty: we might be handling code points belonging to a
+        # sequence which is being decomposed by the variant generation
+        # process. The sequence is part of the LGR,
+        # but not the individual code points.
+        matching_chars = self.repertoire.get_chars_matching(label)
+        same_prefix = self._get_prefix_list(label, label_prefix, trace=trace)
+        if len(same_prefix) == 0 and matching_chars:
+            # No code point in LGR with variants,
+            # stick to first one found (longest in label)
+            same_prefix = [matching_chars[0]]
 
         for char in [ch for ch in same_prefix if isinstance(ch, CharSequence)]:
             # char is a sequence, if first code point of the sequence is in the LGR we need to consider it
-            for cp in self.repertoire.get_chars_from_prefix(label[0]):
-                if len(cp) < len(char) and cp.is_prefix_of(label):
+            for cp in matching_chars:
+                if len(cp) < len(char):
                     same_prefix.append(cp)
 
         # Iterate through characters matching the start of the label
         for char in same_prefix:
-            rule_logger.debug("Char %s", format_cp(char.cp))
+            if trace.debug_enabled:
+                trace.debug("Char %s", format_cp(char.cp))
 
             has_reflexive_mapping = False
             # List of character permutations,
@@ -1802,7 +2264,8 @@ class LGR(object):
 
             for var in char.get_variants():
                 script_filter: BaseMixedScriptsVariantFilter = mixed_script_filter
-                rule_logger.debug("Variant %s", format_cp(var.cp))
+                if trace.debug_enabled:
+                    trace.debug("Variant %s", format_cp(var.cp))
 
                 # Generate variant label:
                 # label prefix + variant code point + label 'suffix'
@@ -1812,19 +2275,23 @@ class LGR(object):
 
                 if hide_mixed_script_variants:
                     if first_call and mixed_script_filter.cp_in_other_scripts(var.cp):
-                        rule_logger.debug("Variant script is eligible for non mixed-scripts", format_cp(var.cp))
+                        trace.debug("Variant script is eligible for non mixed-scripts")
                         script_filter = mixed_script_filter.get_filter_for_other_script(
                             self.unicode_database.get_script(var.cp[0]))
                     elif not mixed_script_filter.cp_in_base_scripts(var.cp):
-                        rule_logger.debug("Variant %s contains mixed-scripts", format_cp(var.cp))
+                        if trace.debug_enabled:
+                            trace.debug("Variant %s contains mixed-scripts", format_cp(var.cp))
                         continue
                 # Test when/not-when rules - Use variant label
                 if not self._test_context_rules(var,
                                                 variant_label,
-                                                len(label_prefix)):
-                    rule_logger.debug("Variant %s is not in LGR", format_cp(var.cp))
+                                                len(label_prefix),
+                                                trace=trace):
+                    if trace.debug_enabled:
+                        trace.debug("Variant %s is not in LGR", format_cp(var.cp))
                     continue
-                rule_logger.debug("Variant %s is valid", format_cp(var.cp))
+                if trace.debug_enabled:
+                    trace.debug("Variant %s is valid", format_cp(var.cp))
 
                 if var.type is None:
                     var_disp = frozenset()
@@ -1859,7 +2326,8 @@ class LGR(object):
                                                           # Mark if prefix is part of a variant
                                                           is_variant | has_variant,
                                                           mixed_script_filter=script_filter,
-                                                          hide_mixed_script_variants=hide_mixed_script_variants):
+                                                          hide_mixed_script_variants=hide_mixed_script_variants,
+                                                          trace=trace):
                         yield (char_perm.cp + perm_cps,
                                # Construct new set of types
                                perm_disp | disp,
@@ -1874,7 +2342,7 @@ class LGR(object):
                 for (char_perm, disp, is_variant, chars) in char_perms:
                     yield char_perm.cp, disp, is_variant, [char_perm]
 
-    def _apply_actions(self, label, disp_set, only_variants):
+    def _apply_actions(self, label, disp_set, only_variants, trace=None):
         """
         Apply the defined action of an LGR to a label and its dispositions.
 
@@ -1885,70 +2353,149 @@ class LGR(object):
         :param disp_set: Set of dispositions used to generate the label.
         :param only_variants: True if label only contains code point
                               from variant mapping.
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: The final label disposition and the action index.
                  Index includes default actions, ie
                  if index > len(self.actions): action == DEFAULT_ACTION[index - len(actions)]
         :raises RuleError: If rule is invalid.
         """
 
+        if trace is None:
+            trace = RuleTrace()
         action_list = self.effective_actions
         idx = 0
         for action in action_list:
-            rule_logger.info("Apply action %d (%s)",
-                             action_list.index(action), action)
+            if trace.info_enabled:
+                trace.info("Apply action %d (%s)",
+                           action_list.index(action), action)
             disp = action.apply(label, disp_set, only_variants,
                                 self.rules_lookup, self.classes_lookup,
-                                self._unicode_database,)
+                                self._unicode_database,
+                                trace=trace,
+                                revision=self.revision)
             if disp is not None:
-                rule_logger.info("Action %d (%s) triggered",
-                                  action_list.index(action),
-                                  action)
+                if trace.info_enabled:
+                    trace.info("Action %d (%s) triggered",
+                               action_list.index(action),
+                               action)
                 return disp, idx
 
             idx += 1
 
         # Should not happen since last DEFAULT_ACTIONS is a catch-all
-        rule_logger.warning("No action triggered by label '%s' "
-                            "with disposition set '%s'", label, disp_set)
+        trace.warning("No action triggered by label '%s' "
+                      "with disposition set '%s'", label, disp_set)
         return None, -1
 
-    def _test_context_rules(self, char, orig_label, index):
+    def _test_context_rules(self, char, orig_label, index, trace=None):
         """
         Test if context rules apply to the character.
 
         :param char: The current character to test.
         :param orig_label: The original label the character is a part of.
+        :param trace: The RuleTrace collecting the rule processing log.
         :return: True if context rules apply (or none defined), False otherwise.
         :raises RuleError: If rule is invalid.
         """
+        if trace is None:
+            trace = RuleTrace()
         when = char.when
         not_when = char.not_when
 
         if when is not None:
-            rule = self.rules_lookup[when]
-            if not rule.matches(orig_label,
-                                self.rules_lookup,
-                                self.classes_lookup,
-                                self._unicode_database,
-                                char.cp,
-                                index):
-                rule_logger.info("when rule '%s' does not validate for code point '%s'",
-                                 when, format_cp(char.cp))
+            if not self._match_context_rule(when, orig_label, char.cp, index, trace=trace):
+                if trace.info_enabled:
+                    trace.info("when rule '%s' does not validate for code point '%s'",
+                               when, format_cp(char.cp))
                 return False
         elif not_when is not None:
-            rule = self.rules_lookup[not_when]
-            if rule.matches(orig_label,
-                            self.rules_lookup,
-                            self.classes_lookup,
-                            self._unicode_database,
-                            char.cp,
-                            index):
-                rule_logger.info("not-when rule '%s' validates for code point '%s'",
-                                 not_when, format_cp(char.cp))
+            if self._match_context_rule(not_when, orig_label, char.cp, index, trace=trace):
+                if trace.info_enabled:
+                    trace.info("not-when rule '%s' validates for code point '%s'",
+                               not_when, format_cp(char.cp))
                 return False
 
         return True
 
+    def _match_context_rule(self, rule_name, label, anchor, index, trace=None):
+        """
+        Test if a context rule matches a label, using cached results.
+
+        Results are cached on the part of the label the rule can see
+        around the anchor, so they are shared between labels (e.g. variants)
+        with the same context.
+        If the trace processes debug messages, the rule is always tested,
+        so that the log does not depend on the labels processed before.
+
+        :param rule_name: The name of the rule to test.
+        :param label: The label to test, as a sequence of code points.
+        :param anchor: The anchor of the rule.
+        :param index: The index of the anchor in the label.
+        :param trace: The RuleTrace collecting the rule processing log.
+        :return: True if label is matched by the rule, False otherwise.
+        :raises RuleError: If rule is invalid.
+        """
+        if trace is None:
+            trace = RuleTrace()
+        # Get the caches once, as they may be replaced by _reset_caches
+        cache = self._context_rules_cache
+        windows = self._context_rule_windows
+
+        window_key = (rule_name, len(anchor))
+        try:
+            window = windows[window_key]
+        except KeyError:
+            rule = self.rules_lookup[rule_name]
+            window = rule.get_context_window(self.rules_lookup,
+                                             self.classes_lookup,
+                                             self._unicode_database,
+                                             len(anchor),
+                                             revision=self.revision)
+            windows[window_key] = window
+
+        label_length = len(label)
+        if window is None:
+            # Not a parameterized context rule, the whole label is used
+            key = (rule_name, None, tuple(label), 0, True, True)
+        else:
+            (behind, ahead) = window
+            start = 0 if behind is None else max(0, index - behind)
+            end = label_length if ahead is None else min(label_length, index + ahead)
+            key = (rule_name, tuple(anchor), tuple(label[start:end]), index - start,
+                   start == 0, end == label_length)
+
+        if not trace.debug_enabled:
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+
+        result = self._get_context_rule_result(rule_name, label, anchor, index, trace=trace)
+        cache[key] = result
+        return result
+
+    def _get_context_rule_result(self, rule_name, label, anchor, index, trace=None):
+        """
+        Test if a context rule matches a label.
+
+        :param rule_name: The name of the rule to test.
+        :param label: The label to test, as a sequence of code points.
+        :param anchor: The anchor of the rule.
+        :param index: The index of the anchor in the label.
+        :param trace: The RuleTrace collecting the rule processing log.
+        :return: True if label is matched by the rule, False otherwise.
+        :raises RuleError: If rule is invalid.
+        """
+        rule = self.rules_lookup[rule_name]
+        return rule.matches(label,
+                            self.rules_lookup,
+                            self.classes_lookup,
+                            self._unicode_database,
+                            anchor,
+                            index,
+                            trace=trace,
+                            revision=self.revision)
+
     def _check_convert_cp(self, cp_or_sequence, assert_in_script=False):
         """
         Check validity of code point input.
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+evaluate.py - Bulk evaluation of labels against an LGR.
+"""
+from __future__ import unicode_literals
+
+import itertools
+import logging
+import multiprocessing
+import pickle
+from collections import namedtuple
+
+from lgr.exceptions import NotInLGR
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 256
+# Number of chunks per worker submitted at once to the pool, to bound the number of pending labels
+CHUNKS_PER_WORKER = 4
+
+LabelEvaluation = namedtuple('LabelEvaluation', ['label',
+                                                 'eligible',
+                                                 'label_invalid_parts',
+                                                 'disposition',
+                                                 'action_idx',
+                                                 'variants'])
+LabelEvaluation.__doc__ = """
+Result of the evaluation of a label.
+
+    - label: The evaluated label, as a tuple of code points.
+    - eligible: True if the label is eligible according to the LGR.
+    - label_invalid_parts: List of code points not valid in the LGR.
+    - disposition: Disposition of the label.
+    - action_idx: Index of the action which triggered the disposition.
+    - variants: List of (variant_cp, disposition, action_idx) of the label,
+                None if variants were not requested or label is not eligible.
+"""
+
+# LGR used by the worker processes, set by _init_worker
+_worker_lgr = None
+
+
+def _init_worker(pickled_lgr, unidb, unidb_factory):
+    """
+    Initialize a worker process with the LGR to evaluate labels against.
+
+    :param pickled_lgr: The pickled LGR.
+    :param unidb: The Unicode database to attach to the LGR, may be None.
+    :param unidb_factory: Callable creating the Unicode database, used if unidb is None.
+    """
+    global _worker_lgr
+    _worker_lgr = pickle.loads(pickled_lgr)
+    # Unicode database is not pickled with the LGR, re-attach it
+    _worker_lgr.unicode_database = unidb if unidb is not None else unidb_factory()
+
+
+def _evaluate_worker(args):
+    """
+    Evaluate a label in a worker process.
+
+    :param args: Tuple of (label, with_variants, hide_mixed_script_variants).
+    :return: The LabelEvaluation of the label.
+    """
+    label, with_variants, hide_mixed_script_variants = args
+    return evaluate_label(_worker_lgr, label,
+                          with_variants=with_variants,
+                          hide_mixed_script_variants=hide_mixed_script_variants)
+
+
+def _index_worker(label):
+    """
+    Compute the index label of a label in a worker process.
+
+    :param label: The label, as a tuple of code points.
+    :return: Tuple of (label, index label), see `index_label`.
+    """
+    return label, index_label(_worker_lgr, label)
+
+
+def evaluate_label(lgr, label, with_variants=False, hide_mixed_script_variants=False):
+    """
+    Evaluate a label against an LGR.
+
+    :param lgr: The LGR to evaluate the label against.
+    :param label: The label to evaluate, as a sequence of code points.
+    :param with_variants: If True, also compute the variants of eligible labels.
+    :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+    :return: The LabelEvaluation of the label.
+    """
+    label = tuple(label)
+    (eligible, _, label_invalid_parts, disp, action_idx, _) = lgr.test_label_eligible(label, collect_log=False)
+    variants = None
+    if eligible and with_variants:
+        variants = [(variant_cp, var_disp, var_action_idx)
+                    for (variant_cp, var_disp, _, var_action_idx, _, _)
+                    in lgr.compute_label_disposition(label, collect_log=False,
+                                                     hide_mixed_script_variants=hide_mixed_script_variants)]
+    return LabelEvaluation(label, eligible, label_invalid_parts, disp, action_idx, variants)
+
+
+def index_label(lgr, label):
+    """
+    Compute the index label of a label.
+
+    :param lgr: The LGR to compute the index label with.
+    :param label: The label, as a sequence of code points.
+    :return: The index label, as a tuple of code points, None if the label is not in the LGR.
+    """
+    try:
+        return lgr.generate_index_label(label)
+    except NotInLGR:
+        return None
+
+
+def _imap(lgr, func, args, workers, chunk_size, unidb_factory):
+    """
+    Apply a worker function to a stream of arguments in a pool of processes.
+
+    Each worker process is primed once with the pickled LGR.
+    As the Unicode database is not pickled with the LGR, it is either pickled
+    separately or, if it cannot be (e.g. the ICU-based database),
+    created in each worker by calling unidb_factory.
+    Arguments are submitted to the pool by batches, so the input stream is
+    not entirely read in memory.
+
+    :param lgr: The LGR used by the worker function.
+    :param func: The worker function, using the `_worker_lgr` global.
+    :param args: Iterable of the arguments of the worker function.
+    :param workers: Number of worker processes.
+    :param chunk_size: Number of arguments sent at once to a worker.
+    :param unidb_factory: Picklable callable returning the Unicode database to use in workers.
+    :return: Generator of the results, in the order of the arguments.
+    """
+    unidb = None
+    if unidb_factory is None:
+        unidb = lgr.unicode_database
+        try:
+            pickle.dumps(unidb)
+        except Exception:
+            logger.error('Unicode database cannot be pickled, '
+                         'provide a factory to create it in worker processes')
+            raise
+
+    logger.debug('Process labels with %d workers', workers)
+    args = iter(args)
+    batch_size = chunk_size * workers * CHUNKS_PER_WORKER
+    pool = multiprocessing.Pool(workers,
+                                initializer=_init_worker,
+                                initargs=(pickle.dumps(lgr), unidb, unidb_factory))
+    try:
+        while True:
+            batch = list(itertools.islice(args, batch_size))
+            if not batch:
+                break
+            for result in pool.imap(func, batch, chunksize=chunk_size):
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def evaluate_labels(lgr, labels, workers=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                    with_variants=False, hide_mixed_script_variants=False,
+                    unidb_factory=None):
+    """
+    Evaluate a stream of labels against an LGR.
+
+    If more than one worker is requested, labels are evaluated in a pool of
+    processes, see `_imap`.
+
+    :param lgr: The LGR to evaluate the labels against.
+    :param labels: Iterable of labels, as sequences of code points.
+    :param workers: Number of worker processes. If 1, labels are evaluated in the current process.
+    :param chunk_size: Number of labels sent at once to a worker.
+    :param with_variants: If True, also compute the variants of eligible labels.
+    :param hide_mixed_script_variants: Whether we hide mixed scripts variants.
+    :param unidb_factory: Picklable callable returning the Unicode database to use in workers.
+    :return: Generator of LabelEvaluation, in the order of the input labels.
+    """
+    if workers is None or workers < 1:
+        workers = multiprocessing.cpu_count()
+
+    if workers == 1:
+        for label in labels:
+            yield evaluate_label(lgr, label,
+                                 with_variants=with_variants,
+                                 hide_mixed_script_variants=hide_mixed_script_variants)
+        return
+
+    args = zip(labels,
+               itertools.repeat(with_variants),
+               itertools.repeat(hide_mixed_script_variants))
+    for result in _imap(lgr, _evaluate_worker, args, workers, chunk_size, unidb_factory):
+        yield result
+
+
+def generate_index_labels(lgr, labels, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, unidb_factory=None):
+    """
+    Compute the index labels of a stream of labels.
+
+    If more than one worker is requested, index labels are computed in a
+    pool of processes, see `_imap`.
+
+    :param lgr: The LGR to compute the index labels with.
+    :param labels: Iterable of labels, as sequences of code points.
+    :param workers: Number of worker processes. If 1, index labels are computed in the current process.
+    :param chunk_size: Number of labels sent at once to a worker.
+    :param unidb_factory: Picklable callable returning the Unicode database to use in workers.
+    :return: Generator of (label, index label), in the order of the input labels, see `index_label`.
+    """
+    labels = (tuple(label) for label in labels)
+    if workers is None or workers < 1:
+        workers = multiprocessing.cpu_count()
+
+    if workers == 1:
+        for label in labels:
+            yield label, index_label(lgr, label)
+        return
+
+    for result in _imap(lgr, _index_worker, labels, workers, chunk_size, unidb_factory):
+        yield result
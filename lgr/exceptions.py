@@ -288,3 +288,12 @@ class LGRCrossScriptMissingDataException(LGRException):
     def __init__(self, missing_part):
         super(LGRCrossScriptMissingDataException, self).__init__()
         self.missing_part = missing_part
+
+
+class BudgetExceeded(LGRException):
+    """
+    Raised when the budget allocated to the processing of a label is exhausted.
+    """
+    def __init__(self, reason):
+        super(BudgetExceeded, self).__init__()
+        self.reason = reason
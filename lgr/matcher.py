@@ -7,6 +7,7 @@ from __future__ import unicode_literals
 import logging
 
 from lgr.exceptions import LGRFormatException
+from lgr.rule import add_reach, max_reach, mul_reach, sequence_window
 from lgr.utils import format_cp_collapsed
 from lgr.core import PROTOCOL_LABEL_MAX_LENGTH
 
@@ -27,7 +28,7 @@ class Matcher(object):
         self.comment = comment
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         """
         Resolve a matcher operator to a regex pattern.
 
@@ -37,10 +38,24 @@ class Matcher(object):
                              for by-ref classes.
         :param unicode_database: The Unicode Database.
         :param is_look_behind: True if matcher is used in a look-behind element.
+        :param revision: The revision of the LGR used to cache rules patterns,
+                         see `Rule.get_pattern`.
         :return: String to be compiled to a regex.
         """
         raise NotImplementedError()
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        """
+        Compute the window of a label the matcher can see.
+
+        :param rules_lookup: Dictionary of defined rules in the LGR to use
+                             for by-ref rules.
+        :param anchor_length: The length of the anchor.
+        :param is_look_behind: True if matcher is used in a look-behind element.
+        :return: The (behind, ahead) window, see `lgr.rule.sequence_window`.
+        """
+        raise NotImplementedError()
+
     def validate(self, parents, rules_lookup, classes_lookup):
         """
         Ensure a matcher has a valid definition.
@@ -99,6 +114,24 @@ class CompoundMatcher(Matcher):
         return self.MAX_CHILDREN and len(self._children) < self.MAX_CHILDREN
 
 
+def _may_look_ahead(matcher):
+    """
+    Test if a matcher may contain a look-ahead matcher.
+
+    :param matcher: The matcher to test.
+    :return: True if the matcher may contain a look-ahead matcher.
+    """
+    for child in matcher.iter_children():
+        if isinstance(child, LookAheadMatcher):
+            return True
+        if getattr(child, 'by_ref', None) is not None:
+            # Referenced rule is not resolved here, be conservative
+            return True
+        if _may_look_ahead(child):
+            return True
+    return False
+
+
 class StartMatcher(Matcher):
     """
     Represent the start of the label.
@@ -110,9 +143,12 @@ class StartMatcher(Matcher):
     MAX_CHILDREN = 0
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         return '^'
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        return 0, 0
+
     def __str__(self):
         return '(start)'
 
@@ -131,9 +167,12 @@ class EndMatcher(Matcher):
     MAX_CHILDREN = 0
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         return '$'
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        return 0, 0
+
     def __str__(self):
         return '(end)'
 
@@ -152,7 +191,7 @@ class AnchorMatcher(Matcher):
     MAX_CHILDREN = 0
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         # Note: anchor must be of the following format:
         # (\x{AAAA})+
 
@@ -160,6 +199,9 @@ class AnchorMatcher(Matcher):
         # because \x{AAAA} is used for CharMatcher
         return '%(anchor)s'
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        return 0, anchor_length
+
     def __str__(self):
         return '⚓'
 
@@ -191,13 +233,19 @@ class LookAheadMatcher(LookAroundMatcher):
         # TODO: Implement complete validation
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         sub_regex = ''.join([m.get_pattern(rules_lookup,
                                            classes_lookup,
-                                           unicode_database)
+                                           unicode_database,
+                                           revision=revision)
                              for m in self._children])
         return '(?=%s)' % sub_regex
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        # Does not consume input, but sees the matched code points
+        return sequence_window(m.get_window(rules_lookup, anchor_length)
+                               for m in self._children)
+
     def __str__(self):
         return '→({})'.format(''.join('{}'.format(m) for m in self._children))
 
@@ -219,14 +267,22 @@ class LookBehindMatcher(LookAroundMatcher):
         # TODO: Implement complete validation
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         sub_regex = ''.join([m.get_pattern(rules_lookup,
                                            classes_lookup,
                                            unicode_database,
-                                           True)
+                                           True,
+                                           revision)
                              for m in self._children])
         return '(?<=%s)' % sub_regex
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        (behind, ahead) = sequence_window(m.get_window(rules_lookup, anchor_length, True)
+                                          for m in self._children)
+        # Sees up to the maximal length of the sub-expression before current input.
+        # Only a nested look-ahead may also see after current input.
+        return add_reach(behind, ahead), ahead if _may_look_ahead(self) else 0
+
     def __str__(self):
         return '({})←'.format(''.join('{}'.format(m) for m in self._children))
 
@@ -247,7 +303,7 @@ class CountMatcher(Matcher):
 
     def get_pattern(self, rules_lookup=None, classes_lookup=None,
                     unicode_database=None,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         if not self.count:
             return ''
 
@@ -269,6 +325,24 @@ class CountMatcher(Matcher):
 
         return '{%s}' % self.count
 
+    def get_count_max(self, is_look_behind=False):
+        """
+        Get the maximum number of repetitions allowed by the count.
+
+        :param is_look_behind: True if matcher is used in a look-behind element.
+        :return: The maximum number of repetitions, None if unbounded.
+        """
+        if not self.count:
+            return 1
+
+        if ':' in self.count:
+            return int(self.count.split(':')[1])
+        elif self.count.endswith('+'):
+            # See get_pattern
+            return PROTOCOL_LABEL_MAX_LENGTH if is_look_behind else None
+
+        return int(self.count)
+
 
 class ChoiceMatcher(CountMatcher, CompoundMatcher):
     """
@@ -284,14 +358,15 @@ class ChoiceMatcher(CountMatcher, CompoundMatcher):
         CompoundMatcher.validate(self, parents, rules_lookup, classes_lookup)
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         count = CountMatcher.get_pattern(self, is_look_behind=is_look_behind)
         choice = '(?:' + \
                  '(?:' + \
                  ')|(?:'.join([m.get_pattern(rules_lookup,
                                              classes_lookup,
                                              unicode_database,
-                                             is_look_behind)
+                                             is_look_behind,
+                                             revision)
                                for m in self._children]) + \
                  ')' + \
                  ')'
@@ -300,6 +375,13 @@ class ChoiceMatcher(CountMatcher, CompoundMatcher):
         else:
             return choice
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        windows = [m.get_window(rules_lookup, anchor_length, is_look_behind)
+                   for m in self._children] or [(0, 0)]
+        behind = max_reach(*[b for (b, _) in windows])
+        ahead = max_reach(*[a for (_, a) in windows])
+        return behind, mul_reach(ahead, self.get_count_max(is_look_behind))
+
     def __str__(self):
         count = CountMatcher.get_pattern(self)
         return '({}){}'.format('|'.join('{}'.format(m) for m in self._children), count)
@@ -320,10 +402,13 @@ class AnyMatcher(CountMatcher):
     MAX_CHILDREN = 0
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         count = super(AnyMatcher, self).get_pattern(is_look_behind=is_look_behind)
         return '.%s' % count
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        return 0, self.get_count_max(is_look_behind)
+
     def __str__(self):
         count = CountMatcher.get_pattern(self)
         return '(any){}'.format(count)
@@ -358,7 +443,7 @@ class CharMatcher(CountMatcher):
         self.references = ref
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         count = super(CharMatcher, self).get_pattern(is_look_behind=is_look_behind)
         regex = ''.join('\\x{%X}' % x for x in self.cp_or_sequence)
 
@@ -367,6 +452,9 @@ class CharMatcher(CountMatcher):
         else:
             return regex
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        return 0, mul_reach(len(self.cp_or_sequence), self.get_count_max(is_look_behind))
+
     def __str__(self):
         count = CountMatcher.get_pattern(self)
         if len(count) > 1:
@@ -395,15 +483,20 @@ class RuleMatcher(CountMatcher):
         self._rule = rule
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         count = super(RuleMatcher, self).get_pattern(is_look_behind=is_look_behind)
         regex = self._rule.get_pattern(rules_lookup, classes_lookup,
-                                       unicode_database, is_look_behind)
+                                       unicode_database, is_look_behind,
+                                       revision)
         if len(count) > 0:
             return '(%s)%s' % (regex, count)
         else:
             return regex
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        (behind, ahead) = self._rule.get_window(rules_lookup, anchor_length, is_look_behind)
+        return behind, mul_reach(ahead, self.get_count_max(is_look_behind))
+
     def validate(self, parents, rules_lookup, classes_lookup):
         super(RuleMatcher, self).validate(parents,
                                           rules_lookup, classes_lookup)
@@ -450,7 +543,7 @@ class ClassMatcher(CountMatcher):
         self._cls = cls
 
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         count = super(ClassMatcher, self).get_pattern(is_look_behind=is_look_behind)
         regex = self._cls.get_pattern(rules_lookup, classes_lookup,
                                       unicode_database, is_look_behind)
@@ -459,6 +552,10 @@ class ClassMatcher(CountMatcher):
         else:
             return regex
 
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        # A class matches a single code point
+        return 0, self.get_count_max(is_look_behind)
+
     def validate(self, parents, rules_lookup, classes_lookup):
         super(ClassMatcher, self).validate(parents,
                                            rules_lookup, classes_lookup)
@@ -4,12 +4,37 @@ memoize.py - Definition of memoize decorators.
 """
 from __future__ import unicode_literals
 import functools
+import threading
+from collections import OrderedDict, namedtuple
+
+
+def freeze(value):
+    """
+    Convert a value to a hashable value, to be used in a cache key.
+
+    Lists and tuples are converted to tuples, sets to frozensets
+    and dictionaries to frozensets of their items, recursively.
+
+    >>> freeze(['a', {'b': [1, 2]}, {3}])
+    ('a', frozenset({('b', (1, 2))}), frozenset({3}))
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(freeze(v) for v in value)
+    if isinstance(value, dict):
+        return frozenset((k, freeze(v)) for k, v in value.items())
+    return value
 
 
 class MethodAttributeMemoizer(object):
     """
     Define a decorator which caches results of an instance method.
-    Results are cached according to the value of a specific instance attribute.
+    Results are cached according to the value of a specific instance attribute,
+    and of the method arguments, which must be hashable once frozen (see `freeze`).
+
+    The decorated method can be called concurrently from several threads:
+    a result may then be computed more than once, but only one is cached.
     """
 
     def __init__(self, attribute_name):
@@ -18,6 +43,7 @@ class MethodAttributeMemoizer(object):
         """
         # The decorator has arguments which are given to __init__ function
         self.attribute_name = attribute_name
+        self._lock = threading.Lock()
 
     def __call__(self, func):
         # The function itself is only available here
@@ -29,11 +55,99 @@ class MethodAttributeMemoizer(object):
             try:
                 cache = obj.__cache
             except AttributeError:
-                cache = obj.__cache = {}
+                with self._lock:
+                    try:
+                        cache = obj.__cache
+                    except AttributeError:
+                        cache = obj.__cache = {}
             # Generate a key
-            key = (str(func.__name__), str(getattr(obj, self.attribute_name)), str(args[1:]) + str(kwargs.items()))
-            if key not in cache:
-                cache[key] = func(*args, **kwargs)
-            return cache[key]
+            key = (func.__name__, freeze(getattr(obj, self.attribute_name)), freeze(args[1:]), freeze(kwargs))
+            try:
+                return cache[key]
+            except KeyError:
+                pass
+            result = func(*args, **kwargs)
+            with self._lock:
+                return cache.setdefault(key, result)
 
         return wrapped_f
+
+
+class CacheInfo(namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])):
+    """
+    Statistics of a cache.
+    """
+    __slots__ = ()
+
+    @property
+    def hit_ratio(self):
+        """
+        The ratio of lookups found in the cache, 0 if the cache was never used.
+        """
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class LRUCache(object):
+    """
+    A dictionary-like cache with a maximum size.
+
+    When the cache is full, the least recently used entry is evicted.
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, maxsize=1024):
+        """
+        Create the cache.
+
+        :param maxsize: The maximum number of entries in the cache.
+        """
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __getitem__(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                raise
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def clear(self):
+        """
+        Remove all entries from the cache, and reset statistics.
+        """
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Get the cache statistics.
+
+        :return: CacheInfo(hits, misses, maxsize, currsize).
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self._data))
@@ -354,6 +354,13 @@ class XMLParser(LGRParser):
                 self.rfc7940_checks.error("parse_xml")
             child.clear()
 
+        if self._unicode_database:
+            # Patterns are cached for the revision of the LGR, so only
+            # compute them once all rules, classes and actions are added
+            for rule in self._lgr.rules_lookup.values():
+                rule.precalculate_patterns(self._lgr.rules_lookup, self._lgr.classes_lookup,
+                                           self._unicode_database, self._lgr.revision)
+
     def _parse_rule(self, elem):
         """
         Parse a <rule> element.
@@ -367,10 +374,6 @@ class XMLParser(LGRParser):
 
         for child in elem:
             self._parse_rule_helper(child, rule)
-        
-        if self._unicode_database:
-            rule.precalculate_patterns(self._lgr.rules_lookup, self._lgr.classes_lookup,
-                                    self._unicode_database)
 
         return rule
 
@@ -7,14 +7,222 @@ from __future__ import unicode_literals
 import re
 import logging
 import io
+import threading
+import weakref
 
 from picu.exceptions import PICUException
 
+from lgr.memoize import LRUCache
+from lgr.trace import RuleTrace
 from lgr.utils import format_cp, cp_to_ulabel
 from lgr.exceptions import LGRFormatException, RuleError
 
 logger = logging.getLogger(__name__)
-rule_logger = logging.getLogger('lgr-rule-logger')
+
+# Placeholder used by the AnchorMatcher in parameterized context rules
+ANCHOR_PLACEHOLDER = '%(anchor)s'
+
+# Maximum number of compiled regex to cache per Unicode database
+REGEX_CACHE_SIZE = 4096
+
+# id(Unicode database) -> LRUCache((pattern, anchor) -> (formatted pattern, compiled regex)).
+# The Unicode database is not referenced, its cache is dropped when it is garbage collected.
+_regex_caches = {}
+_regex_caches_lock = threading.Lock()
+
+
+def _get_regex_cache(unicode_database):
+    """
+    Get the cache of the regex compiled with a Unicode database.
+
+    :param unicode_database: The Unicode Database.
+    :return: The LRUCache of the compiled regex.
+    """
+    key = id(unicode_database)
+    try:
+        return _regex_caches[key]
+    except KeyError:
+        pass
+
+    with _regex_caches_lock:
+        cache = _regex_caches.get(key)
+        if cache is None:
+            cache = LRUCache(REGEX_CACHE_SIZE)
+            try:
+                # Drop the cache with the database, before its id can be reused
+                weakref.finalize(unicode_database, _regex_caches.pop, key, None)
+            except TypeError:
+                # Database cannot be weakly referenced, do not share the cache
+                return cache
+            _regex_caches[key] = cache
+    return cache
+
+
+def format_anchor_pattern(pattern, anchor):
+    """
+    Substitute the anchor in the pattern of a parameterized context rule.
+
+    :param pattern: The rule pattern, containing the anchor placeholder.
+    :param anchor: The anchor, as a sequence of code points.
+    :return: The pattern with the anchor placeholder replaced.
+    """
+    # Format anchor - Can be a sequence.
+    # Use old-style formatting, see note in matcher.AnchorMatcher
+    return pattern % {'anchor': ''.join(map(lambda c: '\\x{{{:X}}}'.format(c),
+                                            anchor))}
+
+
+def compile_rule_regex(pattern, unicode_database, anchor=None):
+    """
+    Compile the regex of a rule pattern, using a cache.
+
+    :param pattern: The rule pattern.
+    :param unicode_database: The Unicode Database used to compile the regex.
+    :param anchor: The anchor to substitute in the pattern of a
+                   parameterized context rule, as a tuple of code points.
+                   None if the pattern has no anchor.
+    :return: (pattern, regex) with pattern the pattern with substituted anchor,
+             and regex the compiled regex.
+    :raises re.error: If the pattern cannot be compiled.
+    :raises PICUException: If the pattern cannot be compiled.
+    """
+    # Unicode database object also identifies the Unicode version
+    cache = _get_regex_cache(unicode_database)
+    key = (pattern, anchor)
+    try:
+        return cache[key]
+    except KeyError:
+        pass
+
+    if anchor is not None:
+        pattern = format_anchor_pattern(pattern, anchor)
+    value = (pattern, unicode_database.compile_regex(pattern))
+    cache[key] = value
+    return value
+
+
+def regex_cache_info(unicode_database):
+    """
+    Get the statistics of the cache of the regex compiled with a Unicode database.
+
+    :param unicode_database: The Unicode Database.
+    :return: CacheInfo(hits, misses, maxsize, currsize).
+    """
+    return _get_regex_cache(unicode_database).info()
+
+
+def clear_regex_cache():
+    """
+    Remove all the compiled regex from the caches of all Unicode databases.
+    """
+    with _regex_caches_lock:
+        caches = list(_regex_caches.values())
+    for cache in caches:
+        cache.clear()
+
+
+def regex_matches(regex, label, anchor=None, index=0, trace=None):
+    """
+    Test if a compiled rule regex matches a label.
+
+    :param regex: The compiled regex of the rule.
+    :param label: Label to test, as a sequence of code points.
+    :param anchor: Anchor used to build the regex, None if the rule
+                   is not a parameterized context rule.
+    :param index: If anchor is used, its index (0-based).
+    :param trace: The RuleTrace collecting the rule processing log.
+    :return: True if label is matched by the regex, False otherwise.
+    """
+    if trace is None:
+        trace = RuleTrace()
+    trace.debug("Index: %d", index)
+
+    # Convert label to U-format to be used in regex
+    label_u = cp_to_ulabel(label)
+
+    # Look for match. It is important to use "search" and not "match"
+    # here, since a rule may not match at the beginning of a label.
+    result = regex.search(label_u, index=index)
+    trace.debug("Result of match: %s", result)
+    if result is None:
+        return False
+
+    if anchor is not None:
+        match_index = result.start()
+        trace.debug('Match index: %d - Index: %d', match_index, index)
+        if match_index > index:
+            trace.debug('Match found after index, invalid')
+            return False
+    return True
+
+
+def add_reach(*reaches):
+    """
+    Add reaches (number of code points), None meaning unbounded.
+
+    >>> add_reach(1, 2)
+    3
+    >>> add_reach(1, None) is None
+    True
+    """
+    if None in reaches:
+        return None
+    return sum(reaches)
+
+
+def max_reach(*reaches):
+    """
+    Get the maximum of reaches (number of code points), None meaning unbounded.
+
+    >>> max_reach(1, 2)
+    2
+    >>> max_reach(1, None) is None
+    True
+    """
+    if None in reaches:
+        return None
+    return max(reaches)
+
+
+def mul_reach(reach, count):
+    """
+    Multiply a reach (number of code points) by a count, None meaning unbounded.
+
+    >>> mul_reach(2, 3)
+    6
+    >>> mul_reach(2, None) is None
+    True
+    """
+    if reach is None or count is None:
+        return None
+    return reach * count
+
+
+def sequence_window(windows):
+    """
+    Combine the windows of consecutive matchers.
+
+    A window is a (behind, ahead) tuple with behind the maximal number of
+    code points before the start of a matcher it can see, and ahead the maximal
+    number of code points from the start of a matcher it can see.
+    None means unbounded.
+
+    :param windows: Iterable of the windows of the matchers.
+    :return: The window of the sequence of matchers.
+
+    >>> sequence_window([(0, 1), (2, 0), (0, 3)])
+    (2, 4)
+    >>> sequence_window([(0, 1), (None, 1)])
+    (None, 2)
+    """
+    behind = 0
+    ahead = 0
+    for (matcher_behind, matcher_ahead) in windows:
+        # Matchers start after (or at) the start of the sequence,
+        # so the maximum look-behind is a conservative value
+        behind = max_reach(behind, matcher_behind)
+        ahead = add_reach(ahead, matcher_ahead)
+    return behind, ahead
 
 
 class Rule(object):
@@ -39,7 +247,10 @@ class Rule(object):
         self.references = ref or []
         self.by_ref = by_ref
         self.children = []
-        self._pattern_cache = {}
+        # (LGR revision, {(Unicode database, is_look_behind): pattern})
+        self._pattern_cache = (None, {})
+        # (pattern, Unicode database, compiled regex) of a non-anchor rule
+        self._compiled_regex = None
 
         if name is not None and by_ref is not None:
             logger.error("Cannot create a rule with both a 'name' and a 'by-ref'")
@@ -61,23 +272,48 @@ class Rule(object):
             raise LGRFormatException(LGRFormatException.LGRFormatReason.BY_REF_AND_OTHER)
         self.children.append(child)
 
+    def __getstate__(self):
+        """
+        Called when pickling a rule instance.
+        """
+        odict = self.__dict__.copy()
+        # Revisions are only unique in the current process
+        odict['_pattern_cache'] = (None, {})
+        # Compiled regex is bound to the Unicode database, which is not pickled
+        odict['_compiled_regex'] = None
+        return odict
+
     def get_pattern(self, rules_lookup, classes_lookup, unicode_database,
-                    is_look_behind=False):
+                    is_look_behind=False, revision=None):
         """
         Resolve a rule to a regex pattern.
 
+        Patterns are cached for the given revision of the LGR defining the
+        lookup dictionaries: the cache is dropped when a new revision is used.
+
         :param rules_lookup: Dictionary of defined rules in the LGR to use
                              for by-ref rules.
         :param classes_lookup: Dictionary of defined classes in the LGR to use
                              for by-ref classes.
         :param unicode_database: The Unicode Database.
         :param is_look_behind: True if rule is used in a look-behind element.
+        :param revision: The revision of the LGR, see `LGR.revision`.
+                         If None, the pattern is not cached.
         :return: String to be compiled to a regex.
         """
-        cache_key = (id(rules_lookup), id(classes_lookup), id(unicode_database), is_look_behind)
-        if cache_key in self._pattern_cache:
-            return self._pattern_cache[cache_key]
-        
+        cache = None
+        if revision is not None:
+            # Read once, as it may be replaced concurrently
+            (cache_revision, cache) = self._pattern_cache
+            if cache_revision != revision:
+                cache = {}
+                self._pattern_cache = (revision, cache)
+            cache_key = (unicode_database, is_look_behind)
+            try:
+                return cache[cache_key]
+            except KeyError:
+                pass
+
         if self.by_ref is not None:
             if self.by_ref not in rules_lookup:
                 logger.error("Rule cannot reference inexisting rule '%s'",
@@ -89,41 +325,113 @@ class Rule(object):
             return rules_lookup[self.by_ref].get_pattern(rules_lookup,
                                                          classes_lookup,
                                                          unicode_database,
-                                                         is_look_behind)
+                                                         is_look_behind,
+                                                         revision)
 
         pattern_io = io.StringIO()
         for m in self.children:
             pattern_io.write(m.get_pattern(rules_lookup,
                                            classes_lookup,
                                            unicode_database,
-                                           is_look_behind))
-
-        self._pattern_cache[cache_key] = pattern_io.getvalue()
-        return pattern_io.getvalue()
+                                           is_look_behind,
+                                           revision))
+
+        # Concurrent calls compute the same pattern, no need to lock
+        pattern = pattern_io.getvalue()
+        if cache is not None:
+            cache[cache_key] = pattern
+        return pattern
     
-    def precalculate_patterns(self, rules_lookup, classes_lookup, unicode_database):
+    def precalculate_patterns(self, rules_lookup, classes_lookup, unicode_database, revision=None):
         """
         Precalculate patterns for this rule and all its children.
 
         :param rules_lookup: Dictionary of defined rules in the LGR.
         :param classes_lookup: Dictionary of defined classes in the LGR.
         :param unicode_database: The Unicode Database.
+        :param revision: The revision of the LGR, see `get_pattern`.
         """
         # Calculate patterns for both is_look_behind=True and False
         for is_look_behind in [True, False]:
-            self.get_pattern(rules_lookup, classes_lookup, unicode_database, is_look_behind)
+            pattern = self.get_pattern(rules_lookup, classes_lookup, unicode_database, is_look_behind, revision)
+
+        # Compile regex of non-anchor rules, which does not depend on the label
+        if pattern and ANCHOR_PLACEHOLDER not in pattern:
+            try:
+                regex = unicode_database.compile_regex(pattern)
+            except (re.error, PICUException) as re_exc:
+                # Error will be raised when matching the rule
+                logger.warning('Cannot compile regex for rule %s: %s', self, re_exc)
+            else:
+                self._compiled_regex = (pattern, unicode_database, regex)
 
         # Recursively precalculate patterns for children
         for child in self.children:
             if isinstance(child, Rule):
-                child.precalculate_patterns(rules_lookup, classes_lookup, unicode_database)
+                child.precalculate_patterns(rules_lookup, classes_lookup, unicode_database, revision)
+
+    def get_window(self, rules_lookup, anchor_length, is_look_behind=False):
+        """
+        Compute the window of a label the rule can see.
+
+        :param rules_lookup: Dictionary of defined rules in the LGR to use
+                             for by-ref rules.
+        :param anchor_length: The length of the anchor.
+        :param is_look_behind: True if rule is used in a look-behind element.
+        :return: The (behind, ahead) window, see `sequence_window`.
+        """
+        if self.by_ref is not None:
+            return rules_lookup[self.by_ref].get_window(rules_lookup,
+                                                        anchor_length,
+                                                        is_look_behind)
+
+        return sequence_window(m.get_window(rules_lookup,
+                                            anchor_length,
+                                            is_look_behind)
+                               for m in self.children)
+
+    def get_context_window(self, rules_lookup, classes_lookup,
+                           unicode_database, anchor_length, revision=None):
+        """
+        Compute the window of a label a context rule can see around its anchor.
+
+        The result of `matches` for a parameterized context rule only depends
+        on the label code points in this window, and on whether the window
+        is at the start and/or at the end of the label.
+
+        :param rules_lookup: Dictionary of defined rules in the LGR to use
+                             for by-ref rules.
+        :param classes_lookup: Dictionary of defined classes in the LGR to use
+                               for by-ref classes.
+        :param unicode_database: The Unicode Database.
+        :param anchor_length: The length of the anchor.
+        :param revision: The revision of the LGR, see `get_pattern`.
+        :return: The (behind, ahead) window from the anchor index,
+                 None if the rule is not a parameterized context rule.
+        """
+        try:
+            pattern = self.get_pattern(rules_lookup,
+                                       classes_lookup,
+                                       unicode_database,
+                                       revision=revision)
+        except (re.error, PICUException, RuleError):
+            # Error will be raised when matching the rule
+            return None
+
+        if ANCHOR_PLACEHOLDER not in pattern:
+            # Rule is tested against the whole label
+            return None
+
+        return self.get_window(rules_lookup, anchor_length)
 
     def matches(self, label,
                 rules_lookup,
                 classes_lookup,
                 unicode_database,
                 anchor=None,
-                index=0):
+                index=0,
+                trace=None,
+                revision=None):
         """
         Test if a rule matches a label.
 
@@ -135,64 +443,58 @@ class Rule(object):
         :param unicode_database: The Unicode Database.
         :param anchor: Optional anchor to use for look-around rules.
         :param index: If anchor is used, its index (0-based).
+        :param trace: The RuleTrace collecting the rule processing log.
+        :param revision: The revision of the LGR, see `get_pattern`.
         :return: True if label is matched by the rule, False otherwise.
         """
-        rule_logger.debug("Test match on %s for label '%s' with anchor '%s' (%d)",
-                          self,
-                          format_cp(label),
-                          format_cp(anchor) if anchor else anchor,
-                          index)
+        if trace is None:
+            trace = RuleTrace()
+        if trace.debug_enabled:
+            trace.debug("Test match on %s for label '%s' with anchor '%s' (%d)",
+                        self,
+                        format_cp(label),
+                        format_cp(anchor) if anchor else anchor,
+                        index)
+        if trace.budget is not None:
+            trace.budget.add_rule_evaluation()
         try:
             pattern = self.get_pattern(rules_lookup,
                                        classes_lookup,
-                                       unicode_database)
+                                       unicode_database,
+                                       revision=revision)
         except (re.error, PICUException) as re_exc:
-            rule_logger.error('Cannot get pattern for rule %s: %s',
-                              self, re_exc)
+            trace.error('Cannot get pattern for rule %s: %s',
+                        self, re_exc)
             raise RuleError(self.name, re_exc)
 
         if len(pattern) == 0:
             # Pattern is empty, nothing will match
-            rule_logger.debug('Empty pattern')
+            trace.debug('Empty pattern')
             return False
 
         if anchor is not None:
-            if '%(anchor)s' not in pattern:
-                rule_logger.debug('Not a parameterized context rule')
+            if ANCHOR_PLACEHOLDER not in pattern:
+                trace.debug('Not a parameterized context rule')
                 # Pattern is not a parameterized context-rule, so set index to 0
                 index = 0
                 anchor = None
             else:
-                # Format anchor - Can be a sequence.
-                # Use old-style formatting, see note in matcher.AnchorMatcher
-                pattern = pattern % {'anchor': ''.join(map(lambda c: '\\x{{{:X}}}'.format(c),
-                                                           anchor))}
-        rule_logger.debug("Pattern for rule %s: '%s'", self, pattern)
-        try:
-            regex = unicode_database.compile_regex(pattern)
-        except (re.error, PICUException) as re_exc:
-            rule_logger.error('Cannot compile regex: %s', re_exc)
-            raise RuleError(self.name, re_exc)
-
-        rule_logger.debug("Index: %d", index)
-
-        # Convert label to U-format to be used in regex
-        label_u = cp_to_ulabel(label)
+                anchor = tuple(anchor)
 
-        # Look for match. It is important to use "search" and not "match"
-        # here, since a rule may not match at the beginning of a label.
-        result = regex.search(label_u, index=index)
-        rule_logger.debug("Result of match: %s", result)
-        if result is None:
-            return False
-
-        if anchor is not None:
-            match_index = result.start()
-            rule_logger.debug('Match index: %d - Index: %d', match_index, index)
-            if match_index > index:
-                rule_logger.debug('Match found after index, invalid')
-                return False
-        return True
+        # Read once, as it may be set concurrently by precalculate_patterns
+        compiled_regex = self._compiled_regex
+        if anchor is None and compiled_regex is not None \
+                and compiled_regex[:2] == (pattern, unicode_database):
+            regex = compiled_regex[2]
+        else:
+            try:
+                (pattern, regex) = compile_rule_regex(pattern, unicode_database, anchor)
+            except (re.error, PICUException) as re_exc:
+                trace.error('Cannot compile regex: %s', re_exc)
+                raise RuleError(self.name, re_exc)
+        trace.debug("Pattern for rule %s: '%s'", self, pattern)
+
+        return regex_matches(regex, label, anchor, index, trace)
 
     def validate(self, parents, rules_lookup, classes_lookup):
         """
@@ -146,3 +146,24 @@ class UnicodeDatabaseMock(UnicodeDatabase):
 
     def idna_decode_label(self, input, options=None):
         return idna.decode(input)
+
+
+class UnpicklablePatternMock(PatternMock):
+    """
+    Compiled regex which cannot be pickled nor copied, as the ICU ones.
+    """
+
+    def __reduce_ex__(self, protocol):
+        raise TypeError('Compiled regex cannot be pickled')
+
+
+class UnpicklableUnicodeDatabaseMock(UnicodeDatabaseMock):
+    """
+    Unicode database which cannot be pickled nor copied, as the ICU-based one.
+    """
+
+    def __reduce_ex__(self, protocol):
+        raise TypeError('Unicode database cannot be pickled')
+
+    def compile_regex(self, regex):
+        return UnpicklablePatternMock(super(UnpicklableUnicodeDatabaseMock, self).compile_regex(regex).pattern)
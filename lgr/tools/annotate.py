@@ -4,8 +4,10 @@ annotate.py - Annotate a list of labels with their disposition.
 """
 from __future__ import unicode_literals
 
+import itertools
 import logging
 
+from lgr.evaluate import index_label
 from lgr.tools.utils import read_labels
 
 logger = logging.getLogger(__name__)
@@ -22,19 +24,24 @@ def _out_valid_label(lgr, label, eligible, label_invalid_parts, disp, action_idx
         )
 
 
-def annotate(lgr, labels_input):
+def annotate(lgr, labels_input, workers=1, unidb_factory=None):
     """
     Annotate a list of labels with their disposition.
 
     :param lgr: The LGR info object.
     :param labels_input: The file containing the labels
+    :param workers: Number of processes used to evaluate the labels.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
     """
-    for __, label, valid, error in read_labels(labels_input, lgr.unicode_database):
+    labels, labels_to_evaluate = itertools.tee(read_labels(labels_input, lgr.unicode_database))
+    evaluations = lgr.evaluate_labels((tuple([ord(c) for c in label])
+                                       for __, label, valid, __ in labels_to_evaluate if valid),
+                                      workers=workers, unidb_factory=unidb_factory)
+    for __, label, valid, error in labels:
         if valid:
-            label_cp = tuple([ord(c) for c in label])
-            (eligible, _, label_invalid_parts, disp, action_idx, _) = lgr.test_label_eligible(label_cp,
-                                                                                              collect_log=False)
-            for l in _out_valid_label(lgr, label, eligible, label_invalid_parts, disp, action_idx):
+            evaluation = next(evaluations)
+            for l in _out_valid_label(lgr, label, evaluation.eligible, evaluation.label_invalid_parts,
+                                      evaluation.disposition, evaluation.action_idx):
                 yield l
         else:
             yield "%s: %s\n" % (label, error)
@@ -49,11 +56,11 @@ def lgr_set_annotate(lgr, script_lgr, set_labels_input, labels_input):
     :param set_labels_input: The labels in the lgr set.
     :param labels_input: The file containing the labels
     """
-    from lgr.tools.diff_collisions import get_collisions
-
     # First, we need to filter-out out-of-LGR labels from the set_labels_input:
     yield "# The following labels from the set labels are invalid\n"
-    filtered_set = []
+    filtered_set = set()
+    # Index label -> set labels, computed once
+    set_indexes = {}
     for __, label, valid, error in read_labels(set_labels_input, lgr.unicode_database):
         if not valid:
             yield "%s: %s\n" % (label, error)
@@ -62,8 +69,11 @@ def lgr_set_annotate(lgr, script_lgr, set_labels_input, labels_input):
             if not lgr._test_preliminary_eligibility(label_cp)[0]:
                 yield "%s: invalid\n" % label
             else:
-                filtered_set.append(label)
+                filtered_set.add(label)
+                set_indexes.setdefault(lgr.generate_index_label(label_cp), set()).add(label)
     yield "# End of filtered set labels\n\n"
+    # If set labels collide together, any label collides with the set labels
+    set_collides = any(len(set_labels) > 1 for set_labels in set_indexes.values())
 
     for __, label, valid, error in read_labels(labels_input, script_lgr.unicode_database):
         if not valid:
@@ -81,8 +91,7 @@ def lgr_set_annotate(lgr, script_lgr, set_labels_input, labels_input):
                 # with any existing delegated labels (and any of their variants, whether blocked or allocatable).
                 if label in filtered_set:
                     collision = 'Label is in the LGR set labels'
-                indexes = get_collisions(lgr, filtered_set + [label], quiet=False)
-                if len(indexes) > 0:
+                if set_collides or set_indexes.get(index_label(lgr, label_cp), set()) - {label}:
                     collision = 'Label collides with the LGR set labels'
 
             out = disp
@@ -4,11 +4,18 @@ diff_collisions.py - Diff and collisions of labels
 """
 from __future__ import unicode_literals
 
+import heapq
+import itertools
+import logging
+import pickle
+import tempfile
 from collections import Counter
 from copy import deepcopy
+from operator import itemgetter
 from typing import List
 
-from lgr.exceptions import InvalidSymmetry, NotInLGR
+from lgr.evaluate import generate_index_labels
+from lgr.exceptions import InvalidSymmetry, LGRApiInvalidParameter
 from lgr.utils import format_cp, cp_to_ulabel
 
 MD = "\n```\n"
@@ -20,13 +27,17 @@ PRIMARY = 'Primary'
 VARIANT = 'Variant'
 TLD = 'TLD'
 
+logger = logging.getLogger(__name__)
 
-def _compute_indexes(lgr, label_list, is_tld=False):
-    for label in label_list:
-        label_cp = tuple([ord(c) for c in label])
-        try:
-            label_index = lgr.generate_index_label(label_cp)
-        except NotInLGR:
+# Maximum number of sorted runs of labels merged at once, each run being an open temporary file
+MAX_MERGED_RUNS = 64
+
+
+def _compute_indexes(lgr, label_list, is_tld=False, workers=1, unidb_factory=None):
+    for label_cp, label_index in generate_index_labels(lgr, (tuple([ord(c) for c in label]) for label in label_list),
+                                                       workers=workers, unidb_factory=unidb_factory):
+        label = cp_to_ulabel(label_cp)
+        if label_index is None:
             if is_tld:
                 continue
             yield label, label_cp, 'NotInLGR'
@@ -41,16 +52,107 @@ def _get_cached_indexes(index_list):
         yield label, label_cp, label_index
 
 
-def _generate_indexes(lgr, labels: List, tlds=None, keep=False, quiet=False, cached_indexes=None):
+def _spill_run(records):
+    """
+    Write records to a temporary file.
+
+    :param records: The records to write.
+    :return: The temporary file, positioned at its beginning.
+    """
+    run = tempfile.TemporaryFile()
+    for record in records:
+        pickle.dump(record, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    """
+    Read the records written to a temporary file by `_spill_run`, then close it.
+
+    :param run: The temporary file.
+    :return: Generator of the records.
+    """
+    with run:
+        while True:
+            try:
+                yield pickle.load(run)
+            except EOFError:
+                return
+
+
+def _merge_runs(runs):
+    """
+    Merge sorted runs written by `_spill_run`, closing them.
+
+    Records with the same index keep the order of the runs.
+
+    :param runs: The temporary files of the runs, in input order.
+    :return: Generator of the records, sorted by index.
+    """
+    return heapq.merge(*[_read_run(r) for r in runs], key=itemgetter(0))
+
+
+def _sort_by_index(records, max_records):
+    """
+    Sort records by index with an external merge sort.
+
+    Records are sorted in memory by runs of at most max_records records,
+    each full run being written to a temporary file, then all runs are merged.
+    Records with the same index keep their input order.
+
+    To bound the number of open files, as soon as MAX_MERGED_RUNS runs
+    of the same size are written, they are merged into a single bigger run.
+
+    :param records: Iterable of records, the index being the first element of a record.
+    :param max_records: The maximum number of records kept in memory.
+    :return: Generator of the records, sorted by index.
+    :raises LGRApiInvalidParameter: If max_records is lower than 1.
+    """
+    if max_records < 1:
+        logger.error('Invalid maximum number of labels in memory %s', max_records)
+        raise LGRApiInvalidParameter('max_labels_in_memory')
+
+    # (level, run), with level the number of merges of the run, in decreasing order
+    runs = []
+    records = iter(records)
+    while True:
+        run = list(itertools.islice(records, max_records))
+        run.sort(key=itemgetter(0))
+        if len(run) < max_records:
+            break
+        runs.append((0, _spill_run(run)))
+        # Only contiguous runs are merged, so that the input order is kept
+        while len(runs) >= MAX_MERGED_RUNS and runs[-MAX_MERGED_RUNS][0] == runs[-1][0]:
+            level = runs[-1][0] + 1
+            merged = _spill_run(_merge_runs([r for (_, r) in runs[-MAX_MERGED_RUNS:]]))
+            del runs[-MAX_MERGED_RUNS:]
+            runs.append((level, merged))
+
+    if runs:
+        logger.debug('Merge %d sorted runs of labels', len(runs) + 1)
+    return heapq.merge(_merge_runs([r for (_, r) in runs]), run, key=itemgetter(0))
+
+
+def _generate_indexes(lgr, labels: List, tlds=None, keep=False, quiet=False, cached_indexes=None,
+                      workers=1, max_labels_in_memory=None, unidb_factory=None):
     """
     Generate indexes based on labels provided in the list
 
+    By default, the indexes of all labels are kept in memory.
+    If max_labels_in_memory is set, the labels are grouped by index with an
+    external merge sort and only the colliding labels (all labels if keep)
+    are kept in memory, grouped by index in index order.
+
     :param lgr: The current LGR
     :param labels: The list of labels, as a list of U-Labels.
     :param tlds: The list of TLDs
     :param keep: Do we keep labels without collision in the output
     :param quiet: If True, do not collect rule log.
     :param cached_indexes: The list of indexes already computed
+    :param workers: Number of processes used to compute the indexes, all available cores if None.
+    :param max_labels_in_memory: Maximum number of labels grouped by index in memory, no limit if None.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
 
     :return: (label_indexes, not_in_lgr), with:
               - label_indexes: the dictionary containing the primary labels
@@ -58,51 +160,71 @@ def _generate_indexes(lgr, labels: List, tlds=None, keep=False, quiet=False, cac
               - not_in_lgr: List of labels that do not pass preliminary eligibility testing.
   """
 
+    # For each index, the primary labels and their variants, keyed by code points
     label_indexes = {}
     not_in_lgr = []
 
-    # Get the indexes and variants for all labels
+    # Get the indexes of all labels
     def _get_indexes(label_list, is_tld=False, is_cache=False):
         generator = _get_cached_indexes
         generator_args = [label_list]
         if not is_cache:
             generator = _compute_indexes
-            generator_args = [lgr, label_list, is_tld]
+            generator_args = [lgr, label_list, is_tld, workers, unidb_factory]
 
         for l, l_cp, l_idx in generator(*generator_args):
             if isinstance(l_idx, str):
                 if l_idx == 'NotInLGR':
                     not_in_lgr.append(l)
                 continue
-
-            label_cp_out = format_cp(l_cp)
-            if l_idx not in label_indexes:
-                label_indexes[l_idx] = []
-            label_indexes[l_idx].append({'label': l,
-                                         'bidi': "%s'%s'%s" % (LRI, l, PDI),
-                                         'cat': PRIMARY if not is_tld else TLD,
-                                         'cp': l_cp,
-                                         'cp_out': label_cp_out,
-                                         'disp': {l: '-'},
-                                         'rules': {l: '-'},
-                                         'action_idx': {l: '-'},
-                                         'index': l_idx
-                                         })
-
-    _get_indexes(labels)
+            yield l_idx, l, l_cp, is_tld
+
+    def _add_label(l_idx, l, l_cp, is_tld):
+        labels_by_cp = label_indexes.setdefault(l_idx, {})
+        if l_cp in labels_by_cp:
+            # label already provided
+            return
+        labels_by_cp[l_cp] = {'label': l,
+                              'bidi': "%s'%s'%s" % (LRI, l, PDI),
+                              'cat': PRIMARY if not is_tld else TLD,
+                              'cp': l_cp,
+                              'cp_out': format_cp(l_cp),
+                              'disp': {l: '-'},
+                              'rules': {l: '-'},
+                              'action_idx': {l: '-'},
+                              'index': l_idx
+                              }
+
+    records = _get_indexes(labels)
     if cached_indexes:
-        _get_indexes(cached_indexes, is_cache=True)
+        records = itertools.chain(records, _get_indexes(cached_indexes, is_cache=True))
     if tlds:
         # remove labels from tlds as we do not want duplicated in label_indexes lists
-        _get_indexes(tlds - set(labels), is_tld=True)
+        records = itertools.chain(records, _get_indexes(tlds - set(labels), is_tld=True))
+
+    if max_labels_in_memory is None:
+        for record in records:
+            _add_label(*record)
+    else:
+        for _, group in itertools.groupby(_sort_by_index(records, max_labels_in_memory), key=itemgetter(0)):
+            group = list(group)
+            # only keep collided labels (if not keep)
+            if len(set(l_cp for (_, _, l_cp, _) in group)) < 2 and not keep:
+                continue
+            for record in group:
+                _add_label(*record)
 
-    for (label_index, primaries) in deepcopy(label_indexes).items():
+    # Get the variants for all indexes
+    for label_index in list(label_indexes):
+        labels_by_cp = label_indexes[label_index]
         # only get variants for collided labels (if not keep)
-        if len(primaries) < 2 and not keep:
+        if len(labels_by_cp) < 2 and not keep:
             del label_indexes[label_index]
             continue
         if not keep and quiet:
             continue
+        primaries = list(labels_by_cp.values())
+        with_labels = [l['cp'] for l in primaries] if not keep else None
         for primary in primaries:
             label_cp = primary['cp']
             label = primary['label']
@@ -113,35 +235,44 @@ def _generate_indexes(lgr, labels: List, tlds=None, keep=False, quiet=False, cac
                  log) in lgr.compute_label_disposition(label_cp,
                                                        include_invalid=True,
                                                        collect_log=not quiet,
-                                                       with_labels=[l['cp'] for l in primaries] if not keep else None):
-                variant = cp_to_ulabel(variant_cp)
+                                                       with_labels=with_labels):
                 log = log.strip()
                 if quiet:
                     log = ''
-                variant_cp_out = format_cp(variant_cp)
-                # search if variant is already in our dict, then add or
-                # update it
-                existing = [var for var in label_indexes[label_index]
-                            if var['label'] == variant]
-                if len(existing) < 1:
-                    label_indexes[label_index].append({'label': variant,
-                                                       'bidi': "%s'%s'%s" % (LRI,
-                                                                             variant,
-                                                                             PDI),
-                                                       'cat': VARIANT,
-                                                       'cp': variant_cp,
-                                                       'cp_out': variant_cp_out,
-                                                       'disp': {label: variant_disp},
-                                                       'rules': {label: log},
-                                                       'action_idx': {label: action_idx}
-                                                       })
+                # add variant to our dict or update it
+                variant_cp = tuple(variant_cp)
+                existing = labels_by_cp.get(variant_cp)
+                if existing is None:
+                    variant = cp_to_ulabel(variant_cp)
+                    labels_by_cp[variant_cp] = {'label': variant,
+                                                'bidi': "%s'%s'%s" % (LRI, variant, PDI),
+                                                'cat': VARIANT,
+                                                'cp': variant_cp,
+                                                'cp_out': format_cp(variant_cp),
+                                                'disp': {label: variant_disp},
+                                                'rules': {label: log},
+                                                'action_idx': {label: action_idx}
+                                                }
                 else:
-                    assert len(existing) == 1
-                    existing[0]['disp'][label] = variant_disp
-                    existing[0]['rules'][label] = log
-                    existing[0]['action_idx'][label] = action_idx
+                    existing['disp'][label] = variant_disp
+                    existing['rules'][label] = log
+                    existing['action_idx'][label] = action_idx
 
-    return label_indexes, not_in_lgr
+    return {label_index: list(labels_by_cp.values())
+            for label_index, labels_by_cp in label_indexes.items()}, not_in_lgr
+
+
+def _get_primary_indexes(label_indexes):
+    """
+    Get the index of the primary labels.
+
+    :param label_indexes: the dictionary containing the primary labels and
+                          their variants (with various information) for each index.
+    :return: Dictionary of the index of each primary label.
+    """
+    return {l['label']: label_index
+            for label_index, labels in label_indexes.items()
+            for l in labels if l['cat'] == PRIMARY}
 
 
 def _compare(labels, label1_indexes, label2_indexes):
@@ -382,18 +513,110 @@ def _full_dump(label_indexes):
             yield MD
 
 
+def _char_signature(char):
+    """
+    Get the properties of a char used to process labels.
+
+    :param char: The char.
+    :return: Tuple of the char properties.
+    """
+    return (char.when, char.not_when, tuple(sorted(char.tags)),
+            frozenset((v.cp, v.type, v.when, v.not_when) for v in char.get_variants()))
+
+
+def _rules_changed(lgr_1, lgr_2):
+    """
+    Test if the rules or classes of two LGRs differ.
+
+    Rules and classes parsed from XML are compared on their XML definition,
+    others are only considered identical if they are the same object.
+
+    :param lgr_1: The first LGR.
+    :param lgr_2: The second LGR.
+    :return: True if the rules or classes differ.
+    """
+    for (xml_1, lookup_1, xml_2, lookup_2) in ((lgr_1.rules_xml, lgr_1.rules_lookup,
+                                                lgr_2.rules_xml, lgr_2.rules_lookup),
+                                               (lgr_1.classes_xml, lgr_1.classes_lookup,
+                                                lgr_2.classes_xml, lgr_2.classes_lookup)):
+        if xml_1 != xml_2 or lookup_1.keys() != lookup_2.keys():
+            return True
+        if len(xml_1) != len(lookup_1) and any(lookup_1[name] is not lookup_2[name] for name in lookup_1):
+            return True
+    return False
+
+
+def affected_code_points(lgr_1, lgr_2):
+    """
+    Get the code points of the labels whose processing can differ between two LGRs.
+
+    A label can only get a different disposition, variants or index label if
+    it contains a code point starting a char (code point or sequence) that
+    differs between the LGRs, or a char (or sequence) that contains a changed
+    code point or has a variant that is or contains a changed char. If the rules
+    differ, all chars with a context rule are considered changed. If the actions,
+    the rules used by the actions or the Unicode version differ, all labels
+    can be affected.
+
+    :param lgr_1: The first LGR.
+    :param lgr_2: The second LGR.
+    :return: The set of code points, None if all labels can be affected.
+    """
+    if lgr_1.metadata.unicode_version != lgr_2.metadata.unicode_version \
+            or lgr_1.effective_actions != lgr_2.effective_actions:
+        return None
+
+    rules_changed = _rules_changed(lgr_1, lgr_2)
+    if rules_changed and any(a.match or a.not_match for a in lgr_1.effective_actions):
+        return None
+
+    chars_1 = {char.cp: char for char in lgr_1.repertoire.all_repertoire()}
+    chars_2 = {char.cp: char for char in lgr_2.repertoire.all_repertoire()}
+    changed = set()
+    for char_cp in chars_1.keys() | chars_2.keys():
+        char_1 = chars_1.get(char_cp)
+        char_2 = chars_2.get(char_cp)
+        if char_1 is None or char_2 is None or _char_signature(char_1) != _char_signature(char_2):
+            changed.add(char_cp)
+            continue
+        if rules_changed and any(c.when or c.not_when for c in itertools.chain([char_1, char_2],
+                                                                               char_1.get_variants(),
+                                                                               char_2.get_variants())):
+            changed.add(char_cp)
+
+    # Variants of a label (and so its disposition) also depend on the chars of its variants
+    def is_affected(cp_or_sequence):
+        return cp_or_sequence in changed or any((cp,) in changed for cp in cp_or_sequence)
+
+    cps = {char_cp[0] for char_cp in changed}
+    for char in itertools.chain(chars_1.values(), chars_2.values()):
+        if is_affected(char.cp) or any(is_affected(variant.cp) for variant in char.get_variants()):
+            cps.add(char.cp[0])
+    return cps
+
+
 def diff(lgr_1, lgr_2, labels_input, show_collision=True,
-         show_dump=False, quiet=False):
+         show_dump=False, quiet=False, only_affected=False,
+         workers=1, unidb_factory=None):
     """
     Show diff for a list of labels between 2 LGR
 
+    With only_affected, only the labels containing a code point affected by
+    the changes between the LGRs (see `affected_code_points`) are compared and
+    only the collisions are computed for the other labels,
+    whose index label is computed once.
+
     :param lgr_1: The first LGR info object.
     :param lgr_2: The second LGR info object.
     :param labels_input: The file containing the labels
     :param show_collision: Output collisions
     :param show_dump: Generate a full dump
     :param quiet: Do not print rules
+    :param only_affected: Only compare labels affected by the changes between the LGRs
+    :param workers: Number of processes used to compute the indexes, all available cores if None.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
     """
+    from lgr.tools.label_index import LabelIndex
     from lgr.tools.utils import read_labels
     labels = set()
     for __, label, valid, error in read_labels(labels_input, lgr_1.unicode_database):
@@ -402,16 +625,48 @@ def diff(lgr_1, lgr_2, labels_input, show_collision=True,
         else:
             yield "Label {}: {}\n".format(label, error)
 
+    all_labels = labels
+    unaffected_indexes = {}
+    if only_affected:
+        changed_cps = affected_code_points(lgr_1, lgr_2)
+        if changed_cps is not None:
+            label_index = LabelIndex(tuple([ord(c) for c in label]) for label in sorted(all_labels))
+            labels = {cp_to_ulabel(label) for label in label_index.get_labels(changed_cps)}
+            # Unaffected labels have the same index label in both LGRs
+            unaffected_indexes = {l: l_idx for (l, _, l_idx) in _compute_indexes(lgr_1, all_labels - labels,
+                                                                                 workers=workers,
+                                                                                 unidb_factory=unidb_factory)}
+        yield "\n# Labels affected by LGR changes #\n\n" \
+              "{} labels out of {} can be affected.\n".format(len(labels), len(all_labels))
+
     # get diff between labels and variants for the two LGR
     # keep label without collision as we need to compare
     label1_indexes, not_in_lgr_1 = _generate_indexes(lgr_1,
                                                      labels,
                                                      keep=True,
-                                                     quiet=quiet)
+                                                     quiet=quiet,
+                                                     workers=workers,
+                                                     unidb_factory=unidb_factory)
     label2_indexes, not_in_lgr_2 = _generate_indexes(lgr_2,
                                                      labels,
                                                      keep=True,
-                                                     quiet=quiet)
+                                                     quiet=quiet,
+                                                     workers=workers,
+                                                     unidb_factory=unidb_factory)
+    # index labels are computed once per LGR
+    index1_by_label = _get_primary_indexes(label1_indexes)
+    index2_by_label = _get_primary_indexes(label2_indexes)
+    collision1_indexes = label1_indexes
+    collision2_indexes = label2_indexes
+    if unaffected_indexes:
+        unaffected_not_in_lgr = sorted(l for l, l_idx in unaffected_indexes.items() if l_idx == 'NotInLGR')
+        not_in_lgr_1 += unaffected_not_in_lgr
+        not_in_lgr_2 += unaffected_not_in_lgr
+        if show_collision:
+            collision1_indexes, _ = _generate_indexes(lgr_1, [], quiet=quiet,
+                                                      cached_indexes=dict(unaffected_indexes, **index1_by_label))
+            collision2_indexes, _ = _generate_indexes(lgr_2, [], quiet=quiet,
+                                                      cached_indexes=dict(unaffected_indexes, **index2_by_label))
 
     if not_in_lgr_1 or not_in_lgr_2:
         for index, not_in_lgr in enumerate([not_in_lgr_1, not_in_lgr_2], 1):
@@ -424,32 +679,27 @@ def diff(lgr_1, lgr_2, labels_input, show_collision=True,
     labels_dic = {}
     yield "\n# LGR comparison #\n"
     for label in labels:
-        label_cp = tuple([ord(c) for c in label])
-        try:
-            index1 = lgr_1.generate_index_label(label_cp)
-        except NotInLGR:
+        if label not in index1_by_label:
             yield "Label {} not in LGR {}\n".format(label, lgr_1)
             continue
-        try:
-            index2 = lgr_2.generate_index_label(label_cp)
-        except NotInLGR:
+        if label not in index2_by_label:
             yield "Label {} not in LGR {}\n".format(label, lgr_2)
             continue
-        labels_dic[label] = (index1, index2)
+        labels_dic[label] = (index1_by_label[label], index2_by_label[label])
 
     for output in _compare(labels_dic, label1_indexes, label2_indexes):
         yield output
     # output collisions
     if show_collision:
         yield "\n\n# Collisions for LGR1 #\n"
-        for output in _write_complete_output(labels, label1_indexes):
+        for output in _write_complete_output(all_labels, collision1_indexes):
             yield output
         if show_dump:
             yield "\n# Summary for LGR1 #\n"
             for output in _full_dump(label1_indexes):
                 yield output
         yield "\n\n# Collisions for LGR2 #\n"
-        for output in _write_complete_output(labels, label2_indexes):
+        for output in _write_complete_output(all_labels, collision2_indexes):
             yield output
         if show_dump:
             yield "\n# Summary for LGR2 #\n\n"
@@ -471,7 +721,8 @@ def _read_tlds(tlds_input, unidb):
     return tlds, errors
 
 
-def collision(lgr, labels_input, tlds_input, show_dump=False, quiet=True):
+def collision(lgr, labels_input, tlds_input, show_dump=False, quiet=True,
+              workers=1, max_labels_in_memory=None, unidb_factory=None):
     """
     Show collisions in a list of labels for a given LGR
 
@@ -480,6 +731,9 @@ def collision(lgr, labels_input, tlds_input, show_dump=False, quiet=True):
     :param tlds_input: The file containing the TLDs
     :param show_dump: Generate a full dump
     :param quiet: Do not print rules
+    :param workers: Number of processes used to compute the indexes, all available cores if None.
+    :param max_labels_in_memory: Maximum number of labels grouped by index in memory, no limit if None.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
     """
     from lgr.tools.utils import read_labels
     labels = dict()  # use dict to keep order
@@ -502,7 +756,9 @@ def collision(lgr, labels_input, tlds_input, show_dump=False, quiet=True):
                 yield "Label {}\n".format(label)
 
     # only keep label without collision for a full dump
-    label_indexes, not_in_lgr = _generate_indexes(lgr, list(labels.keys()), tlds=tlds, keep=show_dump, quiet=quiet)
+    label_indexes, not_in_lgr = _generate_indexes(lgr, list(labels.keys()), tlds=tlds, keep=show_dump, quiet=quiet,
+                                                  workers=workers, max_labels_in_memory=max_labels_in_memory,
+                                                  unidb_factory=unidb_factory)
 
     if not_in_lgr:
         yield "\n# Labels not in LGR #\n\n"
@@ -519,7 +775,8 @@ def collision(lgr, labels_input, tlds_input, show_dump=False, quiet=True):
             yield output
 
 
-def basic_collision(lgr, labels_input, tlds_input, with_annotations=False):
+def basic_collision(lgr, labels_input, tlds_input, with_annotations=False,
+                    workers=1, max_labels_in_memory=None, unidb_factory=None):
     """
     Show collisions in a list of labels for a given LGR with no information
 
@@ -527,6 +784,9 @@ def basic_collision(lgr, labels_input, tlds_input, with_annotations=False):
     :param labels_input: The file containing the labels
     :param tlds_input: The file containing the TLDs
     :param with_annotations: Add label annotation
+    :param workers: Number of processes used to compute the indexes, all available cores if None.
+    :param max_labels_in_memory: Maximum number of labels grouped by index in memory, no limit if None.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
     """
     from lgr.tools.utils import read_labels
     from lgr.tools.annotate import annotate
@@ -558,7 +818,9 @@ def basic_collision(lgr, labels_input, tlds_input, with_annotations=False):
             yield "{}: is a TLD\n".format(label)
 
     # only keep label without collision for a full dump
-    label_indexes, not_in_lgr = _generate_indexes(lgr, labels, tlds=tlds, keep=False, quiet=True)
+    label_indexes, not_in_lgr = _generate_indexes(lgr, labels, tlds=tlds, keep=False, quiet=True,
+                                                  workers=workers, max_labels_in_memory=max_labels_in_memory,
+                                                  unidb_factory=unidb_factory)
 
     label_not_in_lgr = []
     if not_in_lgr:
@@ -582,7 +844,8 @@ def basic_collision(lgr, labels_input, tlds_input, with_annotations=False):
             yield not_in_lgr + '\n'
 
 
-def get_collisions(lgr, labels_input, quiet=True, cached_indexes=None):
+def get_collisions(lgr, labels_input, quiet=True, cached_indexes=None,
+                   workers=1, max_labels_in_memory=None, unidb_factory=None):
     """
     Get collisions index in a list of labels for a given LGR
 
@@ -590,6 +853,9 @@ def get_collisions(lgr, labels_input, quiet=True, cached_indexes=None):
     :param labels_input: The file containing the labels
     :param quiet: Do not get rules
     :param cached_indexes: The list of indexes already computed
+    :param workers: Number of processes used to compute the indexes, all available cores if None.
+    :param max_labels_in_memory: Maximum number of labels grouped by index in memory, no limit if None.
+    :param unidb_factory: Callable returning the Unicode database to use in worker processes.
     :return: The indexes for collisions
     """
     from lgr.tools.utils import read_labels
@@ -597,5 +863,7 @@ def get_collisions(lgr, labels_input, quiet=True, cached_indexes=None):
     for __, label, valid, error in read_labels(labels_input, lgr.unicode_database):
         if valid:
             labels.add(label)
-    label_indexes, _ = _generate_indexes(lgr, labels, keep=False, quiet=quiet, cached_indexes=cached_indexes)
+    label_indexes, _ = _generate_indexes(lgr, labels, keep=False, quiet=quiet, cached_indexes=cached_indexes,
+                                         workers=workers, max_labels_in_memory=max_labels_in_memory,
+                                         unidb_factory=unidb_factory)
     return label_indexes
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+label_index.py - Inverted index of labels by code point.
+"""
+from __future__ import unicode_literals
+
+from array import array
+
+from lgr.exceptions import NotInLGR
+
+
+class LabelIndex(object):
+    """
+    Inverted index of a list of labels by code point.
+
+    Each label gets an id, its position in the index, and each code point is
+    associated to the posting list of the ids of the labels containing it,
+    stored as a sorted array of unsigned integers.
+
+    Labels containing a code point sequence are found by intersecting the
+    posting lists of its code points, then checking the sequence is in the label.
+    """
+
+    def __init__(self, labels=()):
+        """
+        Create the index.
+
+        :param labels: Iterable of labels to index, as sequences of code points.
+        """
+        self.labels = []
+        # code point -> sorted array of label ids
+        self._postings = {}
+        for label in labels:
+            self.add(label)
+
+    @classmethod
+    def from_labels_input(cls, labels_input, unidb=None):
+        """
+        Create the index of the valid labels of a label file.
+
+        :param labels_input: The file containing the labels, see `lgr.tools.utils.read_labels`.
+        :param unidb: The Unicode database used to parse labels.
+        :return: The index.
+        """
+        from lgr.tools.utils import read_labels
+        return cls(label for __, label, valid, __ in read_labels(labels_input, unidb, as_cp=True) if valid)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def add(self, label):
+        """
+        Add a label to the index.
+
+        :param label: The label, as a sequence of code points.
+        :return: The id of the label.
+        """
+        label = tuple(label)
+        label_id = len(self.labels)
+        self.labels.append(label)
+        for cp in set(label):
+            postings = self._postings.get(cp)
+            if postings is None:
+                postings = self._postings[cp] = array('I')
+            postings.append(label_id)
+        return label_id
+
+    def get_label_ids(self, cps):
+        """
+        Get the ids of the labels containing at least one of the code points.
+
+        :param cps: Iterable of code points.
+        :return: The sorted list of label ids.
+        """
+        label_ids = set()
+        for cp in cps:
+            label_ids.update(self._postings.get(cp, ()))
+        return sorted(label_ids)
+
+    def get_sequence_label_ids(self, sequence):
+        """
+        Get the ids of the labels containing a code point sequence.
+
+        Every label contains the empty sequence, so all the label ids
+        are returned for an empty sequence.
+
+        :param sequence: The code point sequence.
+        :return: The sorted list of label ids.
+        """
+        sequence = tuple(sequence)
+        if not sequence:
+            return list(range(len(self.labels)))
+        postings = sorted((self._postings.get(cp, ()) for cp in set(sequence)), key=len)
+        label_ids = set(postings[0])
+        for other in postings[1:]:
+            if not label_ids:
+                break
+            label_ids.intersection_update(other)
+        if len(sequence) > 1:
+            label_ids = {label_id for label_id in label_ids if _contains(self.labels[label_id], sequence)}
+        return sorted(label_ids)
+
+    def get_variant_label_ids(self, lgr, cp_or_sequence):
+        """
+        Get the ids of the labels containing a code point (or sequence) or any of its variants in an LGR.
+
+        :param lgr: The LGR defining the variants.
+        :param cp_or_sequence: The code point or code point sequence.
+        :return: The sorted list of label ids.
+        """
+        if isinstance(cp_or_sequence, int):
+            cp_or_sequence = (cp_or_sequence,)
+        sequences = {tuple(cp_or_sequence)}
+        try:
+            sequences.update(variant.cp for variant in lgr.get_variants(cp_or_sequence))
+        except NotInLGR:
+            pass
+        label_ids = set()
+        for sequence in sequences:
+            label_ids.update(self.get_sequence_label_ids(sequence))
+        return sorted(label_ids)
+
+    def get_labels(self, cps):
+        """
+        Get the labels containing at least one of the code points.
+
+        :param cps: Iterable of code points.
+        :return: The list of labels, in index order.
+        """
+        return [self.labels[label_id] for label_id in self.get_label_ids(cps)]
+
+
+def _contains(label, sequence):
+    """
+    Test if a label contains a code point sequence.
+
+    :param label: The label, as a tuple of code points.
+    :param sequence: The code point sequence, as a tuple.
+    :return: True if the sequence is in the label.
+    """
+    size = len(sequence)
+    return any(label[i:i + size] == sequence for i in range(len(label) - size + 1))
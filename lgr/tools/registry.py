@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+registry.py - Registry of labels indexed by their index label, to detect collisions.
+"""
+from __future__ import unicode_literals
+
+import hashlib
+import logging
+import sqlite3
+from collections import defaultdict
+
+from lgr.exceptions import NotInLGR
+from lgr.parser.xml_serializer import serialize_lgr_xml
+from lgr.utils import format_cp
+
+logger = logging.getLogger(__name__)
+
+
+def lgr_content_hash(lgr):
+    """
+    Compute the hash of the content of an LGR.
+
+    :param lgr: The LGR.
+    :return: The SHA-256 hex digest of the LGR XML serialization.
+    """
+    return hashlib.sha256(serialize_lgr_xml(lgr)).hexdigest()
+
+
+def _to_str(cps):
+    return ''.join(map(chr, cps))
+
+
+def _to_cps(s):
+    return tuple(map(ord, s))
+
+
+class MemoryLabelStore(object):
+    """
+    Store of the labels of a registry, in memory.
+
+    Labels and index labels are tuples of code points.
+    Labels not in the LGR are stored with a None index.
+    """
+
+    def __init__(self):
+        self.lgr_hash = None
+        # label -> index label
+        self._indexes = {}
+        # index label -> set of labels
+        self._labels = defaultdict(set)
+
+    def __len__(self):
+        return len(self._indexes)
+
+    def __contains__(self, label):
+        return label in self._indexes
+
+    def labels(self):
+        """
+        :return: Iterator of all the labels of the store.
+        """
+        return iter(list(self._indexes))
+
+    def get_index(self, label):
+        """
+        :param label: The label.
+        :return: The index label of the label.
+        :raises KeyError: If the label is not in the store.
+        """
+        return self._indexes[label]
+
+    def get_labels(self, index):
+        """
+        :param index: The index label.
+        :return: The set of labels with this index label.
+        """
+        return set(self._labels.get(index, ()))
+
+    def add(self, label, index):
+        """
+        Add or update a label.
+
+        :param label: The label.
+        :param index: The index label of the label, None if label is not in the LGR.
+        """
+        self.remove(label)
+        self._indexes[label] = index
+        if index is not None:
+            self._labels[index].add(label)
+
+    def add_many(self, labels):
+        """
+        Add or update labels.
+
+        :param labels: Iterable of (label, index label) pairs, see `add`.
+        """
+        for (label, index) in labels:
+            self.add(label, index)
+
+    def remove(self, label):
+        """
+        Remove a label, if present.
+
+        :param label: The label.
+        """
+        index = self._indexes.pop(label, None)
+        if index is not None:
+            labels = self._labels[index]
+            labels.discard(label)
+            if not labels:
+                del self._labels[index]
+
+
+class SQLiteLabelStore(object):
+    """
+    Store of the labels of a registry, in a SQLite database.
+
+    Same interface as MemoryLabelStore.
+    """
+
+    def __init__(self, path):
+        """
+        Open the store.
+
+        :param path: The path of the SQLite database, created if needed.
+        """
+        self._connection = sqlite3.connect(path)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS labels (label TEXT PRIMARY KEY, idx TEXT)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS labels_idx ON labels (idx)')
+
+    def close(self):
+        """
+        Close the store.
+        """
+        self._connection.close()
+
+    @property
+    def lgr_hash(self):
+        row = self._connection.execute("SELECT value FROM meta WHERE key = 'lgr_hash'").fetchone()
+        return row[0] if row else None
+
+    @lgr_hash.setter
+    def lgr_hash(self, value):
+        with self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('lgr_hash', ?)", (value,))
+
+    def __len__(self):
+        return self._connection.execute('SELECT COUNT(*) FROM labels').fetchone()[0]
+
+    def __contains__(self, label):
+        return self._connection.execute('SELECT 1 FROM labels WHERE label = ?',
+                                        (_to_str(label),)).fetchone() is not None
+
+    def labels(self):
+        """
+        :return: Iterator of all the labels of the store.
+        """
+        return (_to_cps(label) for (label,) in self._connection.execute('SELECT label FROM labels').fetchall())
+
+    def get_index(self, label):
+        """
+        :param label: The label.
+        :return: The index label of the label.
+        :raises KeyError: If the label is not in the store.
+        """
+        row = self._connection.execute('SELECT idx FROM labels WHERE label = ?', (_to_str(label),)).fetchone()
+        if row is None:
+            raise KeyError(label)
+        return None if row[0] is None else _to_cps(row[0])
+
+    def get_labels(self, index):
+        """
+        :param index: The index label.
+        :return: The set of labels with this index label.
+        """
+        return {_to_cps(label) for (label,)
+                in self._connection.execute('SELECT label FROM labels WHERE idx = ?', (_to_str(index),))}
+
+    def add(self, label, index):
+        """
+        Add or update a label.
+
+        :param label: The label.
+        :param index: The index label of the label, None if label is not in the LGR.
+        """
+        self.add_many([(label, index)])
+
+    def add_many(self, labels):
+        """
+        Add or update labels, in a single transaction.
+
+        :param labels: Iterable of (label, index label) pairs, see `add`.
+        """
+        with self._connection:
+            self._connection.executemany('INSERT OR REPLACE INTO labels (label, idx) VALUES (?, ?)',
+                                         ((_to_str(label), None if index is None else _to_str(index))
+                                          for (label, index) in labels))
+
+    def remove(self, label):
+        """
+        Remove a label, if present.
+
+        :param label: The label.
+        """
+        with self._connection:
+            self._connection.execute('DELETE FROM labels WHERE label = ?', (_to_str(label),))
+
+
+class LabelRegistry(object):
+    """
+    Registry of labels, indexed by their index label against an LGR.
+
+    Labels sharing the same index label collide: collisions are found with
+    a single lookup in the store instead of comparing with all the labels.
+    The store is tied to the hash of the LGR content: when the registry is
+    opened with a different LGR, or when the LGR is modified, all index labels
+    are computed again.
+    """
+
+    def __init__(self, lgr, store=None):
+        """
+        Create the registry.
+
+        :param lgr: The LGR used to compute the index labels.
+        :param store: The store of the labels, in memory if None.
+        """
+        self.lgr = lgr
+        self.store = store if store is not None else MemoryLabelStore()
+        self.lgr_hash = None
+        self.lgr_revision = None
+        self._check_lgr()
+
+    def _check_lgr(self):
+        """
+        Rebuild the registry if the LGR content changed since the index labels were computed.
+        """
+        if self.lgr_revision == self.lgr.revision:
+            return
+        self.lgr_revision = self.lgr.revision
+        self.lgr_hash = lgr_content_hash(self.lgr)
+        if self.store.lgr_hash != self.lgr_hash:
+            self.rebuild()
+
+    def __len__(self):
+        return len(self.store)
+
+    def __contains__(self, label):
+        return tuple(label) in self.store
+
+    def _compute_index(self, label):
+        try:
+            return self.lgr.generate_index_label(label)
+        except NotInLGR:
+            return None
+
+    def rebuild(self):
+        """
+        Compute the index label of all the labels of the store again.
+
+        :return: The list of labels not in the LGR.
+        """
+        if len(self.store):
+            logger.info('Rebuild label registry for LGR %s', self.lgr)
+        not_in_lgr = []
+
+        def indexes():
+            for label in self.store.labels():
+                index = self._compute_index(label)
+                if index is None:
+                    logger.warning('Label %s is not in LGR', format_cp(label))
+                    not_in_lgr.append(label)
+                yield label, index
+
+        self.store.add_many(indexes())
+        self.store.lgr_hash = self.lgr_hash
+        return not_in_lgr
+
+    def add(self, label):
+        """
+        Add a label to the registry.
+
+        :param label: The label, as a sequence of code points.
+        :return: The index label of the label.
+        :raises NotInLGR: If the label is not in the LGR.
+        """
+        self._check_lgr()
+        label = tuple(label)
+        index = self.lgr.generate_index_label(label)
+        self.store.add(label, index)
+        return index
+
+    def remove(self, label):
+        """
+        Remove a label from the registry, if present.
+
+        :param label: The label, as a sequence of code points.
+        """
+        self.store.remove(tuple(label))
+
+    def get_index(self, label):
+        """
+        Get the index label of a label of the registry.
+
+        :param label: The label, as a sequence of code points.
+        :return: The index label, None if the label is not in the LGR.
+        :raises KeyError: If the label is not in the registry.
+        """
+        self._check_lgr()
+        return self.store.get_index(tuple(label))
+
+    def get_collisions(self, label):
+        """
+        Get the labels of the registry colliding with a label.
+
+        The label itself does not need to be in the registry.
+
+        :param label: The label, as a sequence of code points.
+        :return: The set of labels of the registry colliding with the label, excluding the label itself.
+        :raises NotInLGR: If the label is not in the LGR.
+        """
+        self._check_lgr()
+        label = tuple(label)
+        try:
+            index = self.store.get_index(label)
+        except KeyError:
+            index = None
+        if index is None:
+            index = self.lgr.generate_index_label(label)
+        return self.store.get_labels(index) - {label}
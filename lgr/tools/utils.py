@@ -6,6 +6,7 @@ from __future__ import unicode_literals
 
 import argparse
 import codecs
+import functools
 import io
 import logging
 import os
@@ -16,7 +17,7 @@ from urllib.parse import urlparse
 from urllib.request import urlopen
 
 from munidata import UnicodeDataVersionManager
-from munidata.database import UnicodeDatabase
+from munidata.database import PICUDatabase, UnicodeDatabase
 
 from lgr import text_type
 from lgr.parser.xml_parser import XMLParser
@@ -429,6 +430,19 @@ class LgrToolArgParser(argparse.ArgumentParser):
             self.unidb = manager.register(None, libpath, i18n_libpath, libver)
         return self.unidb
 
+    def get_unidb_factory(self):
+        """
+        Get a picklable callable creating the Unicode database, to be used in worker processes.
+
+        :return: The callable, None if no Unicode library is provided.
+        """
+        if not self.args:
+            self.parse_args()
+        if not self.args.libs:
+            return None
+        libpath, i18n_libpath, libver = self.args.libs.split('#')
+        return functools.partial(PICUDatabase, libpath, i18n_libpath, libver)
+
 
 class LgrSetToolArgParser(LgrToolArgParser):
 
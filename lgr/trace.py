@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+trace.py - Collection of the rule processing log of a label.
+"""
+from __future__ import unicode_literals
+
+import logging
+import sys
+
+rule_logger = logging.getLogger('lgr-rule-logger')
+
+# Report the caller of the trace method in the log record,
+# stacklevel is only supported from Python 3.8
+_LOG_KWARGS = {'stacklevel': 3} if sys.version_info >= (3, 8) else {}
+
+# Minimum level of the messages forwarded by traces not collecting the log
+QUIET_LEVEL = logging.WARNING
+
+
+class RuleTrace(object):
+    """
+    Collector of the rule processing log, passed down explicitly to the
+    functions processing a label.
+
+    Messages are forwarded to the `lgr-rule-logger` logger and, if requested,
+    collected in the trace. As for a handler attached to the logger,
+    a message is only collected if it is enabled both for the logger and for
+    the collection level.
+
+    The logger level is read once when the trace is created: messages below
+    this level are dropped without being formatted nor reaching the logging
+    module. Callers should test `debug_enabled` or `info_enabled` before
+    computing costly message arguments.
+
+    A trace can also be given its own minimum level of forwarded messages,
+    whatever the logger level: label processing without log collection uses
+    `QUIET_LEVEL`, so that only warnings and errors reach the logging module.
+
+    The trace also carries the optional VariantBudget of the processing.
+    """
+
+    def __init__(self, collect_level=None, budget=None, log_level=None):
+        """
+        Create a trace.
+
+        :param collect_level: Minimum level of the collected messages,
+                              None to not collect messages.
+        :param budget: The VariantBudget limiting the processing, None for no limit.
+        :param log_level: Minimum level of the messages forwarded to the logger,
+                          None to only use the logger level.
+        """
+        self.budget = budget
+        self._logger_level = rule_logger.getEffectiveLevel()
+        if log_level is not None:
+            self._logger_level = max(log_level, self._logger_level)
+        self._collect_level = None
+        if collect_level is not None:
+            self._collect_level = max(collect_level, self._logger_level)
+        self.debug_enabled = self._logger_level <= logging.DEBUG
+        self.info_enabled = self._logger_level <= logging.INFO
+        # List of collected (level, message)
+        self.messages = []
+
+    def _log(self, level, msg, args):
+        if level < self._logger_level:
+            return
+        if self._collect_level is not None and level >= self._collect_level:
+            self.messages.append((level, msg % args if args else msg))
+        rule_logger.log(level, msg, *args, **_LOG_KWARGS)
+
+    def debug(self, msg, *args):
+        self._log(logging.DEBUG, msg, args)
+
+    def info(self, msg, *args):
+        self._log(logging.INFO, msg, args)
+
+    def warning(self, msg, *args):
+        self._log(logging.WARNING, msg, args)
+
+    def error(self, msg, *args):
+        self._log(logging.ERROR, msg, args)
+
+    def getvalue(self):
+        """
+        Get the collected log.
+
+        :return: The collected messages, one per line.
+        """
+        return ''.join('{}\n'.format(msg) for (_, msg) in self.messages)
@@ -6,6 +6,8 @@ from __future__ import unicode_literals
 
 import unittest
 import itertools
+import pickle
+import tracemalloc
 import types
 
 from lgr.char import (Variant,
@@ -264,6 +266,60 @@ class TestChar(unittest.TestCase):
         self.assertEqual(variant, expected_output)
 
 
+    def test_slots_shared_empty_containers(self):
+        c1 = Char(0x002A)
+        c2 = CharSequence((0x002A, 0x002B))
+        for obj in (c1, c2, RangeChar(0x002A, 0x002A, 0x002C), Variant([0x002A])):
+            self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertIs(c1.references, c2.references)
+        self.assertIs(c1.tags, c2.tags)
+        self.assertIs(c1._variants, c2._variants)
+
+        c1.add_variant([0x002B])
+        self.assertIsNot(c1._variants, c2._variants)
+        self.assertFalse(c2.has_variant())
+        c1.del_variant([0x002B])
+        self.assertIs(c1._variants, c2._variants)
+
+    def test_interned_strings(self):
+        tag = ''.join(['sc:', 'Latn'])
+        ref = ''.join(['1', '0'])
+        c1 = Char(0x002A, tag=['sc:Latn'], ref=['10'])
+        c2 = Char(0x002B, tag=[tag], ref=[ref])
+        self.assertIs(c1.tags[0], c2.tags[0])
+        self.assertIs(c1.references[0], c2.references[0])
+        c1.add_variant([0x002B], ''.join(['block', 'ed']))
+        c2.add_variant([0x002A], 'blocked')
+        self.assertIs(c1.get_variant((0x002B,))[0].type, c2.get_variant((0x002A,))[0].type)
+
+    def test_pickle(self):
+        c = Char(0x002A, comment='comment', ref=['1'], tag=['t'], when='rule')
+        c.add_variant([0x002B], 'blocked', ref=['2'])
+        for char in (c, Char(0x002B), RangeChar(0x002B, 0x002A, 0x002C, tag=['t'])):
+            new_char = pickle.loads(pickle.dumps(char))
+            self.assertIsInstance(new_char, type(char))
+            self.assertEqual(new_char.__getstate__(), char.__getstate__())
+            self.assertListEqual(list(new_char.get_variants()), list(char.get_variants()))
+        new_char = pickle.loads(pickle.dumps(c))
+        self.assertEqual(new_char.get_variant((0x002B,))[0].references, ['2'])
+        self.assertEqual(new_char.get_variant((0x002B,))[0].type, 'blocked')
+        self.assertFalse(pickle.loads(pickle.dumps(Char(0x002B))).has_variant())
+
+    def test_memory_footprint(self):
+        # A char used to take ~400 bytes (~680 bytes with a variant every other char)
+        tracemalloc.start()
+        try:
+            chars = [Char(cp, tag=['sc:Hani']) for cp in range(0x4E00, 0x4E00 + 1000)]
+            chars_size = tracemalloc.get_traced_memory()[0]
+            for char in chars[::2]:
+                char.add_variant([char.cp[0] + 1], 'blocked')
+            size = tracemalloc.get_traced_memory()[0]
+        finally:
+            tracemalloc.stop()
+        self.assertLess(chars_size / len(chars), 300)
+        self.assertLess(size / len(chars), 550)
+
+
 class TestRepertoire(unittest.TestCase):
 
     def setUp(self):
@@ -365,6 +421,51 @@ class TestRepertoire(unittest.TestCase):
         self.assertEqual(len(self.cd), 0)
         self.assertRaises(NotInLGR, self.cd.del_range, 0x002A, 0x0030)
 
+    def test_range_chars_created_on_access(self):
+        self.cd.add_range(0x0061, 0x007A, tag=['t'])
+        self.assertEqual(len(self.cd), 26)
+        self.assertEqual(len(self.cd._range_chars), 1)
+        char = self.cd[0x0062]
+        self.assertIs(self.cd[0x0062], char)
+        self.assertEqual(len(self.cd._range_chars), 2)
+        # Properties are shared by all code points of the range
+        self.assertIs(char.tags, self.cd[0x0061].tags)
+        self.assertEqual(len(list(self.cd.all_repertoire())), 26)
+        self.assertEqual(len(self.cd._range_chars), 2)
+
+        self.assertRaises(CharAlreadyExists, self.cd.add_char, [0x0063])
+        self.assertRaises(CharAlreadyExists, self.cd.add_range, 0x0030, 0x0061, skip_check=True)
+        self.assertRaises(RangeAlreadyExists, self.cd.add_range, 0x0030, 0x007B)
+
+    def test_sequence_in_range(self):
+        self.cd.add_range(0x0061, 0x007A)
+        seq = self.cd.add_char([0x0062, 0x0030])
+        self.assertIn([0x0062, 0x0030], self.cd)
+        self.assertEqual(self.cd.get_chars_matching([0x0062, 0x0030]), [seq, self.cd[0x0062]])
+        self.assertEqual(self.cd.get_chars_from_prefix(0x0062), [seq, self.cd[0x0062]])
+        self.assertEqual(list(self.cd), [self.cd[0x0061], seq])
+        self.assertEqual(len(self.cd), 27)
+
+    def test_del_char_in_range(self):
+        self.cd.add_range(0x0061, 0x007A, comment='range')
+        self.cd.add_char([0x0062, 0x0030])
+        char = self.cd[0x0065]
+        self.cd.del_char([0x0062])
+        self.cd.del_char([0x0064])
+        self.assertNotIn(0x0062, self.cd)
+        self.assertNotIn(0x0064, self.cd)
+        self.assertIn([0x0062, 0x0030], self.cd)
+        self.assertEqual(self.cd.ranges, [(0x0065, 0x007A)])
+        self.assertEqual(len(self.cd), 25)
+
+        for cp in (0x0061, 0x0063):
+            self.assertIsInstance(self.cd[cp], Char)
+            self.assertNotIsInstance(self.cd[cp], RangeChar)
+            self.assertEqual(self.cd[cp].comment, 'range')
+        # Chars of the removed range are not reused
+        self.assertIsNot(self.cd[0x0065], char)
+        self.assertEqual(self.cd[0x0065].first_cp, 0x0065)
+
     def test_get_char(self):
         single_char = self.cd.add_char([0x002A])
         sequence_char = self.cd.add_char([0x002B, 0x002C])
@@ -378,6 +479,30 @@ class TestRepertoire(unittest.TestCase):
             self.assertEqual(0x002D, char.first_cp)
             self.assertEqual(0x0030, char.last_cp)
 
+    def test_lookup_after_deletion(self):
+        char = self.cd.add_char([0x002A])
+        sequence_char = self.cd.add_char([0x002A, 0x002B])
+        self.cd.add_char([0x002A, 0x002B, 0x002C])
+        self.cd.del_char([0x002A, 0x002B, 0x002C])
+
+        self.assertIn(0x002A, self.cd)
+        self.assertIn(Char(0x002A), self.cd)
+        self.assertIn((0x002A, 0x002B), self.cd)
+        self.assertNotIn([0x002A, 0x002B, 0x002C], self.cd)
+        self.assertNotIn([0x002B], self.cd)
+        self.assertIs(self.cd.get_char(0x002A), char)
+        self.assertIs(self.cd.get_char((0x002A, 0x002B)), sequence_char)
+        self.assertRaises(NotInLGR, self.cd.get_char, [0x002A, 0x002B, 0x002C])
+
+        self.cd.del_char([0x002A])
+        self.assertNotIn(0x002A, self.cd)
+        self.assertIn([0x002A, 0x002B], self.cd)
+        self.assertRaises(NotInLGR, self.cd.get_char, [0x002A])
+        # Code point can be added again, including in a range
+        self.cd.add_range(0x0029, 0x002A)
+        self.assertIsInstance(self.cd[0x002A], RangeChar)
+        self.assertRaises(CharAlreadyExists, self.cd.add_char, [0x002A, 0x002B])
+
     def test_add_single_variant_single_cp(self):
         self.cd.add_char([0x002A])
         self.cd.add_variant([0x002A], [0x0030])
@@ -462,6 +587,40 @@ class TestRepertoire(unittest.TestCase):
 
         self.assertEqual(list(self.cd), expected_output)
 
+    def test_iter_after_modification(self):
+        self.cd.add_char([0x0010])
+        self.cd.add_char([0x0012])
+        self.assertEqual(list(self.cd), [Char(0x0010), Char(0x0012)])
+
+        # Chars added while iterating are not returned by the current iteration
+        for char in self.cd:
+            self.cd.add_char([char.cp[0] + 1])
+        self.assertEqual(list(self.cd), [Char(0x0010), Char(0x0011), Char(0x0012), Char(0x0013)])
+
+        self.cd.add_range(0x0001, 0x0002)
+        self.cd.del_char([0x0011])
+        self.cd.add_char([0x0010, 0x0011])
+        self.assertEqual(list(self.cd), [RangeChar(0x0001, 0x0001, 0x0002), Char(0x0010),
+                                         CharSequence([0x0010, 0x0011]), Char(0x0012), Char(0x0013)])
+        self.cd.del_char([0x0001])
+        self.assertEqual(list(self.cd)[:2], [Char(0x0002), Char(0x0010)])
+
+    def test_get_variants_after_modification(self):
+        char = self.cd.add_char([0x002A])
+        char.add_variant([0x0030])
+        char.add_variant([0x002B])
+        self.assertEqual([v.cp for v in char.get_variants()], [(0x002B,), (0x0030,)])
+
+        # Variants added while iterating are not returned by the current iteration
+        for variant in char.get_variants():
+            char.add_variant([variant.cp[0] + 1])
+        self.assertEqual([v.cp for v in char.get_variants()], [(0x002B,), (0x002C,), (0x0030,), (0x0031,)])
+
+        char.add_variant([0x0030], when='rule')
+        char.del_variant([0x002C])
+        self.assertEqual([(v.cp, v.when) for v in char.get_variants()],
+                         [((0x002B,), None), ((0x0030,), None), ((0x0030,), 'rule'), ((0x0031,), None)])
+
     def test_all_repertoire(self):
         self.cd.add_char([0x0010])
         self.cd.add_range(0x0001, 0x0005)
@@ -581,6 +740,28 @@ class TestRepertoire(unittest.TestCase):
         self.assertListEqual(char_list,
                              [c4, c3, c2, c1])
 
+    def test_get_chars_matching(self):
+        c1 = self.cd.add_char([0x002A])
+        c2 = self.cd.add_char([0x002A, 0x002B])
+        c3 = self.cd.add_char([0x002A, 0x002B, 0x002C])
+        self.cd.add_char([0x002A, 0x002C])
+        c2.add_variant([0x002D])
+
+        label = [0x002D, 0x002A, 0x002B, 0x002C]
+        self.assertListEqual(self.cd.get_chars_matching(label, 1), [c3, c2, c1])
+        self.assertListEqual(self.cd.get_chars_matching(label, 1, only_variants=True), [c2])
+        self.assertListEqual(self.cd.get_chars_matching(label[:3], 1), [c2, c1])
+        self.assertListEqual(self.cd.get_chars_matching(label), [])
+        self.assertListEqual(self.cd.get_chars_matching(label, 4), [])
+
+        self.cd.del_char([0x002A, 0x002B])
+        self.assertListEqual(self.cd.get_chars_matching(label, 1), [c3, c1])
+        self.cd.del_char([0x002A, 0x002B, 0x002C])
+        self.cd.del_char([0x002A, 0x002C])
+        self.cd.del_char([0x002A])
+        self.assertFalse(self.cd.has_prefix(0x002A))
+        self.assertListEqual(self.cd.get_chars_matching(label, 1), [])
+
     def test_get_variant_sets(self):
         self.cd.add_char([0x002A])
         self.cd.add_char([0x002B])
@@ -609,6 +790,91 @@ class TestRepertoire(unittest.TestCase):
                              ((0x002B,), (0x002E,))})
 
 
+    def _add_variant_set(self, *cps):
+        for (cp, var) in itertools.permutations(cps, 2):
+            self.cd.add_variant([cp], [var])
+
+    def test_get_variant_sets_modification(self):
+        for cp in range(0x0061, 0x0067):
+            self.cd.add_char([cp])
+        self._add_variant_set(0x0061, 0x0062)
+        self._add_variant_set(0x0063, 0x0064)
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [((0x0061,), (0x0062,)), ((0x0063,), (0x0064,))])
+
+        # Merge sets
+        self._add_variant_set(0x0062, 0x0063)
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [((0x0061,), (0x0062,), (0x0063,), (0x0064,))])
+
+        # Split sets
+        self.cd.del_variant([0x0062], [0x0063])
+        self.cd.del_variant([0x0063], [0x0062])
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [((0x0061,), (0x0062,)), ((0x0063,), (0x0064,))])
+        self.cd.del_char([0x0064])
+        self.assertListEqual(self.cd.get_variant_sets(), [((0x0061,), (0x0062,))])
+
+        # Variant not in repertoire
+        self.cd.add_variant([0x0065], [0x0067])
+        self.assertListEqual(self.cd.get_variant_sets(), [((0x0061,), (0x0062,))])
+        self.assertListEqual(self.cd.get_variant_sets(force=True),
+                             [((0x0061,), (0x0062,)), ((0x0063,), (0x0064,)), ((0x0065,), (0x0067,))])
+        self.cd.add_char([0x0067])
+        self.cd.add_variant([0x0067], [0x0065])
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [((0x0061,), (0x0062,)), ((0x0065,), (0x0067,))])
+
+    def test_get_variant_sets_copy(self):
+        for cp in range(0x0061, 0x0065):
+            self.cd.add_char([cp])
+        self._add_variant_set(0x0061, 0x0062)
+        variant_sets = self.cd.get_variant_sets()
+        variant_sets.append(((0x0063,), (0x0064,)))
+        del variant_sets[0]
+        self.assertListEqual(self.cd.get_variant_sets(), [((0x0061,), (0x0062,))])
+
+    def test_get_variant_sets_not_symmetric(self):
+        for cp in range(0x0061, 0x0064):
+            self.cd.add_char([cp])
+        self.cd.add_variant([0x0061], [0x0062])
+        self.cd.add_variant([0x0063], [0x0062])
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [((0x0061,), (0x0062,)), ((0x0062,), (0x0063,))])
+        self.assertTupleEqual(self.cd.get_variant_set([0x0061]), ((0x0061,), (0x0062,)))
+        self.assertTupleEqual(self.cd.get_variant_set([0x0062]), ())
+
+        self.cd.add_variant([0x0062], [0x0061])
+        self.cd.add_variant([0x0062], [0x0063])
+        self.assertListEqual(self.cd.get_variant_sets(), [((0x0061,), (0x0062,), (0x0063,))])
+        self.assertTupleEqual(self.cd.get_variant_set([0x0062]), ((0x0061,), (0x0062,), (0x0063,)))
+
+    def test_get_variant_set(self):
+        self.cd.add_char([0x0061])
+        self.cd.add_char([0x0061, 0x0062])
+        self.cd.add_char([0x0063])
+        self.cd.add_variant([0x0061], [0x0061, 0x0062])
+        self.cd.add_variant([0x0061, 0x0062], [0x0061])
+        self.cd.add_variant([0x0061], [0x0061])
+
+        variant_set = ((0x0061,), (0x0061, 0x0062))
+        self.assertTupleEqual(self.cd.get_variant_set([0x0061]), variant_set)
+        self.assertTupleEqual(self.cd.get_variant_set([0x0061, 0x0062]), variant_set)
+        self.assertTupleEqual(self.cd.get_variant_set([0x0063]), ())
+        self.assertRaises(NotInLGR, self.cd.get_variant_set, [0x0064])
+
+    def test_get_variant_sets_large_set(self):
+        for cp in range(0x4E00, 0x4E00 + 2000):
+            self.cd.add_char([cp])
+        for cp in range(0x4E00, 0x4E00 + 1999):
+            self._add_variant_set(cp, cp + 1)
+        self.assertListEqual(self.cd.get_variant_sets(),
+                             [tuple((cp,) for cp in range(0x4E00, 0x4E00 + 2000))])
+        # Not symmetric
+        self.cd.add_char([0x0061])
+        self.cd.add_variant([0x0061], [0x4E00])
+        self.assertEqual(len(self.cd.get_variant_set([0x0061])), 2001)
+
 if __name__ == '__main__':
     import logging
     logging.getLogger('lgr').addHandler(logging.NullHandler())
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+test_compiled.py - Unit testing of compiled LGR module.
+"""
+from __future__ import unicode_literals
+
+import pickle
+import unittest
+
+from lgr.compiled import CompiledLGR
+from lgr.exceptions import LGRApiException
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock, UnpicklableUnicodeDatabaseMock
+from tests.unit.utils import load_lgr
+
+LABELS = [
+    (0x0061,),
+    (0x0062,),
+    (0x0061, 0x0062),
+    (0x0063, 0x0064),
+    (0x0062, 0x0063, 0x0030),
+    (0x006F, 0x0065),
+    (0x0153, 0x0061),
+    (0x006F, 0x0065, 0x0153),
+    (0x006F, 0x0066),
+    (0x0031, 0x0032, 0x0033),
+    (0x0069, 0x0070),
+    (0x007A,),
+]
+
+
+class TestCompiledLGR(unittest.TestCase):
+
+    def setUp(self):
+        self.unidb = UnicodeDatabaseMock()
+        self.lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=self.unidb)
+        self.compiled = self.lgr.compile()
+
+    def test_compile(self):
+        self.assertIsInstance(self.compiled, CompiledLGR)
+        self.assertIs(self.compiled.compile(), self.compiled)
+        self.assertIs(self.compiled.unicode_database, self.unidb)
+        self.assertEqual(self.compiled.effective_actions, self.lgr.effective_actions)
+
+    def test_label_eligible(self):
+        for label in LABELS:
+            self.assertEqual(self.compiled.test_label_eligible(label, generate_chars=True),
+                             self.lgr.test_label_eligible(label, generate_chars=True),
+                             label)
+
+    def test_label_disposition(self):
+        for label in LABELS:
+            if not self.lgr.test_label_eligible(label, collect_log=False)[0]:
+                continue
+            self.assertEqual(list(self.compiled.compute_label_disposition(label, collect_log=False)),
+                             list(self.lgr.compute_label_disposition(label, collect_log=False)),
+                             label)
+
+    def test_index_label(self):
+        for label in LABELS:
+            if not self.lgr.test_label_eligible(label, collect_log=False)[0]:
+                continue
+            self.assertEqual(self.compiled.generate_index_label(label),
+                             self.lgr.generate_index_label(label),
+                             label)
+
+    def test_cp_index_table(self):
+        self.assertIn(0x0061, self.compiled._cp_index_table)
+        for cp, index in self.compiled._cp_index_table.items():
+            self.assertEqual(index, self.lgr._get_cp_index(cp))
+
+    def test_frozen(self):
+        self.assertRaises(LGRApiException, self.compiled.add_cp, 0x006A)
+        self.assertRaises(LGRApiException, self.compiled.del_cp, 0x0061)
+        self.assertRaises(LGRApiException, self.compiled.add_variant, 0x0064, 0x0065)
+        self.assertRaises(LGRApiException, self.compiled.add_range, 0x0041, 0x0043)
+        self.assertNotIn(0x006A, self.compiled.repertoire)
+
+    def test_snapshot(self):
+        self.lgr.add_cp(0x006A)
+        self.lgr.del_cp(0x0064)
+        self.assertNotIn(0x006A, self.compiled.repertoire)
+        self.assertIn(0x0064, self.compiled.repertoire)
+        self.assertTrue(self.compiled.test_label_eligible((0x0064,), collect_log=False)[0])
+        self.assertFalse(self.compiled.test_label_eligible((0x006A,), collect_log=False)[0])
+
+    def test_pickle(self):
+        compiled = pickle.loads(pickle.dumps(self.compiled))
+        self.assertIsNone(compiled.unicode_database)
+        compiled.unicode_database = self.unidb
+        for label in LABELS:
+            self.assertEqual(compiled.test_label_eligible(label, collect_log=False),
+                             self.lgr.test_label_eligible(label, collect_log=False),
+                             label)
+
+    def test_unpicklable_unicode_database(self):
+        unidb = UnpicklableUnicodeDatabaseMock()
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=unidb)
+        compiled = lgr.compile()
+        self.assertIs(compiled.unicode_database, unidb)
+        for label in LABELS:
+            self.assertEqual(compiled.test_label_eligible(label, collect_log=False),
+                             self.lgr.test_label_eligible(label, collect_log=False),
+                             label)
+
+        compiled = pickle.loads(pickle.dumps(compiled))
+        self.assertIsNone(compiled.unicode_database)
+        compiled.unicode_database = unidb
+        for label in LABELS:
+            self.assertEqual(compiled.test_label_eligible(label, collect_log=False),
+                             self.lgr.test_label_eligible(label, collect_log=False),
+                             label)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+test_evaluate.py - Unit testing of bulk label evaluation.
+"""
+from __future__ import unicode_literals
+
+import logging
+import sys
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from lgr.evaluate import LabelEvaluation, generate_index_labels
+from lgr.rule import clear_regex_cache
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock, UnpicklableUnicodeDatabaseMock
+from lgr.trace import rule_logger
+from tests.unit.utils import load_lgr
+
+LABELS = [
+    (0x0061,),
+    (0x0062,),
+    (0x0061, 0x0062),
+    (0x0063, 0x0064),
+    (0x0062, 0x0063, 0x0030),
+    (0x006F, 0x0065),
+    (0x0153, 0x0061),
+    (0x006F, 0x0066),
+    (0x007A,),
+] * 5
+
+
+class TestEvaluateLabels(unittest.TestCase):
+
+    def setUp(self):
+        self.unidb = UnicodeDatabaseMock()
+        self.lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=self.unidb)
+
+    def test_evaluate_labels(self):
+        results = list(self.lgr.evaluate_labels(LABELS))
+        self.assertEqual(len(results), len(LABELS))
+        for label, result in zip(LABELS, results):
+            self.assertIsInstance(result, LabelEvaluation)
+            (eligible, _, label_invalid_parts, disp, action_idx, _) = self.lgr.test_label_eligible(label,
+                                                                                                   collect_log=False)
+            self.assertEqual(result, (label, eligible, label_invalid_parts, disp, action_idx, None))
+
+    def test_evaluate_labels_variants(self):
+        for result in self.lgr.evaluate_labels(LABELS, with_variants=True):
+            if not result.eligible:
+                self.assertIsNone(result.variants)
+                continue
+            self.assertListEqual(result.variants,
+                                 [(v, d, a) for (v, d, _, a, _, _)
+                                  in self.lgr.compute_label_disposition(result.label, collect_log=False)])
+
+    def test_evaluate_labels_workers(self):
+        expected = list(self.lgr.evaluate_labels(LABELS, with_variants=True))
+        self.assertListEqual(list(self.lgr.evaluate_labels(LABELS, workers=2, chunk_size=4, with_variants=True)),
+                             expected)
+        self.assertListEqual(list(self.lgr.evaluate_labels(iter(LABELS), workers=2,
+                                                           with_variants=True, unidb_factory=UnicodeDatabaseMock)),
+                             expected)
+
+    def test_workers_unpicklable_unicode_database(self):
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=UnpicklableUnicodeDatabaseMock())
+        expected = list(lgr.evaluate_labels(LABELS, with_variants=True))
+        self.assertListEqual(list(lgr.evaluate_labels(LABELS, workers=2, with_variants=True,
+                                                      unidb_factory=UnpicklableUnicodeDatabaseMock)),
+                             expected)
+        self.assertListEqual(list(generate_index_labels(lgr, LABELS, workers=2,
+                                                        unidb_factory=UnpicklableUnicodeDatabaseMock)),
+                             list(generate_index_labels(lgr, LABELS)))
+        with self.assertRaises(TypeError):
+            list(lgr.evaluate_labels(LABELS, workers=2))
+
+    def test_generate_index_labels(self):
+        expected = []
+        for label in LABELS:
+            eligible = self.lgr._test_preliminary_eligibility(label)[0]
+            expected.append((label, self.lgr.generate_index_label(label) if eligible else None))
+        self.assertIn((0x007A,), [label for (label, index) in expected if index is None])
+        self.assertListEqual(list(generate_index_labels(self.lgr, LABELS)), expected)
+        self.assertListEqual(list(generate_index_labels(self.lgr, iter(LABELS), workers=2, chunk_size=4)), expected)
+
+
+class TestConcurrentEvaluation(unittest.TestCase):
+
+    def setUp(self):
+        self.unidb = UnicodeDatabaseMock()
+        self.level = rule_logger.level
+        self.switch_interval = sys.getswitchinterval()
+        # Collect messages and switch threads as often as possible.
+        # Debug messages are not collected, as they disable the context rules cache
+        rule_logger.setLevel(logging.INFO)
+        sys.setswitchinterval(1e-6)
+
+    def tearDown(self):
+        rule_logger.setLevel(self.level)
+        sys.setswitchinterval(self.switch_interval)
+
+    @staticmethod
+    def _process(lgr, label):
+        result = lgr.test_label_eligible(label)
+        variants = []
+        if result[0]:
+            variants = list(lgr.compute_label_disposition(label))
+        return result, variants, lgr.generate_index_label(label) if result[0] else None
+
+    def test_threads(self):
+        labels = sorted(set(LABELS))
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=self.unidb)
+        expected = [self._process(lgr, label) for label in labels]
+        self.assertTrue(any(log for ((_, _, _, _, _, log), _, _) in expected))
+
+        for _ in range(3):
+            # Start from cold caches so threads also race on filling them
+            clear_regex_cache()
+            lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=self.unidb)
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(lambda label: self._process(lgr, label), labels * 10))
+            self.assertListEqual(results, expected * 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
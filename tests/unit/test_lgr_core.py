@@ -4,11 +4,15 @@ test_lgr_core.py - Unit testing of LGR code module.
 """
 from __future__ import unicode_literals
 
+import itertools
+import logging
 import types
 import unittest
 
+from lgr.action import Action
+from lgr.budget import CANCELLED, MAX_RULE_EVALUATIONS_REACHED, MAX_VARIANTS_REACHED, VariantBudget
 from lgr.char import Char, RangeChar
-from lgr.classes import TAG_CLASSNAME_PREFIX
+from lgr.classes import Class, TAG_CLASSNAME_PREFIX
 from lgr.core import LGR
 from lgr.exceptions import (CharAlreadyExists,
                             VariantAlreadyExists,
@@ -19,10 +23,13 @@ from lgr.exceptions import (CharAlreadyExists,
                             NotInRepertoire,
                             NotInLGR,
                             DuplicateReference,
-                            LGRFormatException)
-from lgr.matcher import LookBehindMatcher, AnchorMatcher, CharMatcher, LookAheadMatcher
+                            LGRFormatException,
+                            LGRApiInvalidParameter)
+from lgr.matcher import LookBehindMatcher, AnchorMatcher, CharMatcher, ClassMatcher, LookAheadMatcher, StartMatcher
 from lgr.rule import Rule
 from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.trace import rule_logger
+from tests.unit.utils import load_lgr
 
 
 class TestLGRCore(unittest.TestCase):
@@ -599,6 +606,102 @@ class TestLGRCore(unittest.TestCase):
         self.assertCountEqual([((ord('á'), 0x0062), frozenset(['disp']), False, [aacute, b])],
                               self.lgr._generate_label_variants([0x0061, 0x0062], hide_mixed_script_variants=True))
 
+    def test_compute_label_disposition_budget(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_variant([0x0061], [0x0070], variant_type="type0")
+        self.lgr.add_variant([0x0062], [0x0071], variant_type="type1")
+        self.lgr.add_variant([0x0062], [0x0072], variant_type="type2")
+        label = (0x0061, 0x0062, 0x0062)
+
+        results = list(self.lgr.compute_label_disposition(label, include_invalid=True, collect_log=False))
+        self.assertEqual(len(results), 18)
+
+        budget = VariantBudget(max_variants=5)
+        results = list(self.lgr.compute_label_disposition(label, include_invalid=True, collect_log=False,
+                                                          budget=budget))
+        self.assertEqual(budget.truncated, MAX_VARIANTS_REACHED)
+        # Original label is generated first and still returned last
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[-1][0], label)
+
+        budget = VariantBudget()
+        budget.cancel()
+        results = list(self.lgr.compute_label_disposition(label, budget=budget))
+        self.assertEqual(budget.truncated, CANCELLED)
+        self.assertEqual([r[0] for r in results], [label])
+
+    def test_compute_label_disposition_budget_rule_evaluations(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_variant([0x0061], [0x0062])
+        self.lgr.add_variant([0x0062], [0x0061])
+        self.lgr.add_cp([0x0063], when='after-a-at-start')
+        rule = Rule(name='after-a-at-start')
+        look = LookBehindMatcher()
+        look.add_child(StartMatcher())
+        look.add_child(CharMatcher((0x0061,)))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+        label = (0x0061, 0x0063)
+
+        budget = VariantBudget(max_rule_evaluations=1)
+        results = list(self.lgr.compute_label_disposition(label, include_invalid=True, budget=budget))
+        self.assertIsNone(budget.truncated)
+        self.assertEqual(len(results), 2)
+
+        # Context rules results are cached
+        self.lgr._reset_caches()
+        budget = VariantBudget(max_rule_evaluations=0)
+        results = list(self.lgr.compute_label_disposition(label, include_invalid=True, budget=budget))
+        self.assertEqual(budget.truncated, MAX_RULE_EVALUATIONS_REACHED)
+        self.assertEqual([r[0] for r in results], [label])
+
+    def test_count_label_dispositions(self):
+        for cp in range(0x0061, 0x0065):
+            self.lgr.add_cp([cp])
+        self.lgr.add_variant([0x0061], [0x0061], variant_type='activated')
+        self.lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        self.lgr.add_variant([0x0062], [0x0061], variant_type='blocked')
+        self.lgr.add_variant([0x0062], [0x0063], variant_type='allocatable')
+        self.lgr.add_variant([0x0063], [0x0070], variant_type='allocatable')
+        self.lgr.add_variant([0x0064], [0x0064])
+        self.lgr.add_action(Action(disp='valid', only_variants=['activated']))
+
+        for label in [(0x0061,), (0x0063,), (0x0064,), (0x0062, 0x0063), (0x0063, 0x0064),
+                      (0x0061, 0x0062, 0x0063, 0x0064), (0x0064, 0x0062, 0x0061, 0x0061)]:
+            self.assertIsNotNone(self.lgr._count_label_dispositions(label, False))
+            for include_invalid in (False, True):
+                summary, _ = self.lgr.compute_label_disposition_summary(label, include_invalid=include_invalid)
+                self.assertEqual(self.lgr.count_label_dispositions(label, include_invalid=include_invalid),
+                                 summary)
+
+        # 6 ** 20 variants
+        counts = self.lgr.count_label_dispositions((0x0061, 0x0062) * 20)
+        self.assertEqual(sum(counts.values()), 6 ** 20)
+        self.assertEqual(counts['blocked'], 6 ** 20 - 2 ** 20)
+
+    def test_count_label_dispositions_context_rule(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        self.lgr.add_variant([0x0062], [0x0061], variant_type='blocked')
+        self.lgr.add_cp([0x0063], when='after-a-at-start')
+        rule = Rule(name='after-a-at-start')
+        look = LookBehindMatcher()
+        look.add_child(StartMatcher())
+        look.add_child(CharMatcher((0x0061,)))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+        label = (0x0061, 0x0063)
+
+        # Variants are enumerated
+        self.assertIsNone(self.lgr._count_label_dispositions(label, True))
+        summary, _ = self.lgr.compute_label_disposition_summary(label, include_invalid=True)
+        self.assertEqual(self.lgr.count_label_dispositions(label, include_invalid=True), summary)
+
     def test_generate_label_partitions(self):
         self.lgr.add_cp([0x0061])
         self.lgr.add_cp([0x0062])
@@ -654,6 +757,127 @@ class TestLGRCore(unittest.TestCase):
             [ab, cd],
         ], self.lgr._generate_label_partitions([0x0061, 0x0062, 0x0063, 0x0064]))
 
+    def test_context_rules_cache(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_cp([0x0063], when='after-a-at-start')
+        rule = Rule(name='after-a-at-start')
+        look = LookBehindMatcher()
+        look.add_child(StartMatcher())
+        look.add_child(CharMatcher((0x0061,)))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+
+        self.assertTrue(self.lgr._test_preliminary_eligibility([0x0061, 0x0063, 0x0062])[0])
+        self.assertTrue(self.lgr._test_preliminary_eligibility([0x0061, 0x0063, 0x0061])[0])
+        # Same window as previous labels, but not at the start of the label
+        self.assertFalse(self.lgr._test_preliminary_eligibility([0x0062, 0x0061, 0x0063])[0])
+        self.assertEqual(len(self.lgr._context_rules_cache), 2)
+
+        # Modifying the LGR resets the cache
+        self.lgr.add_cp([0x0064])
+        self.assertEqual(len(self.lgr._context_rules_cache), 0)
+
+    def test_context_rules_cache_log(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_cp([0x0063], when='after-a')
+        self.lgr.add_variant([0x0061], [0x0062])
+        self.lgr.add_variant([0x0062], [0x0061])
+        rule = Rule(name='after-a')
+        look = LookBehindMatcher()
+        look.add_child(CharMatcher((0x0061,)))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+
+        level = rule_logger.level
+        rule_logger.setLevel(logging.DEBUG)
+        try:
+            logs = [{variant: log for (variant, _, _, _, _, log)
+                     in self.lgr.compute_label_disposition(label, include_invalid=True)}
+                    for label in ([0x0061, 0x0063], [0x0062, 0x0061, 0x0063], [0x0061, 0x0063])]
+        finally:
+            rule_logger.setLevel(level)
+        # Log does not depend on the cached results of previous labels
+        self.assertIn('Test match on', logs[0][(0x0062, 0x0063)])
+        self.assertIn('Test match on', logs[1][(0x0061, 0x0061, 0x0063)])
+        self.assertDictEqual(logs[2], logs[0])
+
+    def test_revision_rules_patterns(self):
+        self.lgr.add_cp([0x0061], tag=['t'])
+        self.lgr.add_cp([0x0062])
+        rule = Rule(name='after-t')
+        look = LookBehindMatcher()
+        look.add_child(ClassMatcher(Class(from_tag='t')))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+        self.lgr.add_cp([0x0063], when='after-t')
+        self.assertTrue(self.lgr.test_label_eligible([0x0061, 0x0063])[0])
+        self.assertFalse(self.lgr.test_label_eligible([0x0062, 0x0063])[0])
+
+        # Rule pattern depends on the code points of the tag class
+        revision = self.lgr.revision
+        self.lgr.del_cp([0x0062])
+        self.lgr.add_cp([0x0062], tag=['t'])
+        self.assertGreater(self.lgr.revision, revision)
+        self.assertTrue(self.lgr.test_label_eligible([0x0062, 0x0063])[0])
+
+    def test_disposition_cache(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        self.assertIsNone(self.lgr.disposition_cache_info())
+        self.assertRaises(LGRApiInvalidParameter, self.lgr.enable_disposition_cache, 0)
+
+        self.lgr.enable_disposition_cache(maxsize=2)
+        expected = list(self.lgr._compute_label_disposition((0x0061,)))
+        self.assertEqual([disp for (_, disp, _, _, _, _) in expected], ['blocked', 'valid'])
+        self.assertEqual(list(self.lgr.compute_label_disposition((0x0061,))), expected)
+        self.assertEqual(list(self.lgr.compute_label_disposition((0x0061,))), expected)
+        self.assertEqual(self.lgr.test_label_eligible([0x0062]), self.lgr.test_label_eligible([0x0062]))
+        info = self.lgr.disposition_cache_info()
+        self.assertEqual((info.hits, info.misses, info.currsize), (2, 2, 2))
+        self.assertEqual(info.hit_ratio, 0.5)
+
+        # Least recently used result is evicted
+        self.lgr.test_label_eligible([0x0061])
+        self.lgr.compute_label_disposition_summary((0x0061,))
+        self.assertEqual(self.lgr.disposition_cache_info().hits, 2)
+
+        # Modifying the LGR resets the cache
+        self.lgr.add_action(Action(disp='invalid', comment='test', any_variant=['blocked']))
+        self.assertEqual(self.lgr.disposition_cache_info().currsize, 0)
+        self.assertEqual([disp for (_, disp, _, _, _, _) in self.lgr.compute_label_disposition((0x0061,))],
+                         ['valid'])
+
+        self.lgr.disable_disposition_cache()
+        self.assertIsNone(self.lgr.disposition_cache_info())
+
+    def test_disposition_cache_copy(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        self.lgr.enable_disposition_cache()
+
+        for _ in range(2):
+            eligible = self.lgr.test_label_eligible([0x0061, 0x0063])
+            self.assertEqual(eligible[1:3], ([0x0061], [(0x0063, None)]))
+            eligible[1].append(0x0063)
+            eligible[2].clear()
+
+        for _ in range(2):
+            results = list(self.lgr.compute_label_disposition((0x0061,), generate_chars=True))
+            self.assertEqual([(invalid_parts, chars) for (_, _, invalid_parts, _, _, _, chars) in results],
+                             [([], [self.lgr.get_char([0x0061]).get_variant((0x0062,))[0]]),
+                              ([], [self.lgr.get_char([0x0061])])])
+            for (_, _, invalid_parts, _, _, _, chars) in results:
+                invalid_parts.append((0x0063, None))
+                chars.clear()
+        self.assertEqual(self.lgr.disposition_cache_info().hits, 2)
+
     def test_generate_index_label_on_partition(self):
         self.lgr.add_cp([0x0061])
         self.lgr.add_cp([0x0062])
@@ -835,6 +1059,67 @@ class TestLGRCore(unittest.TestCase):
         self.assertEqual((0x062, 0x0069, 0x0075, 0x0065),
                          self.lgr.generate_index_label([0x044B, 0x045F, 0x0435], max_recursion=1))
 
+    def test_generate_min_index_label(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_cp([0x0062, 0x0062])
+        self.lgr.add_cp([0x0062, 0x0062, 0x0062])
+        self.lgr.add_cp([0x0063, 0x0062])
+        self.lgr.add_variant([0x0062, 0x0062], [0x0061])
+        self.lgr.add_variant([0x0063, 0x0062], [0x0062, 0x0061])
+
+        for label in [(0x0062,), (0x0062, 0x0062, 0x0062), (0x0063, 0x0062, 0x0062, 0x0062),
+                      (0x0062, 0x0063, 0x0062, 0x0062, 0x0061, 0x0062, 0x0062, 0x0062)]:
+            partitions = self.lgr._generate_label_partitions(label)
+            self.assertEqual(self.lgr._generate_min_index_label(label),
+                             min(self.lgr._generate_index_label_on_partition(p) for p in partitions))
+
+        # More than 10^16 partitions
+        self.assertEqual(self.lgr.generate_index_label((0x0062,) * 80), (0x0061,) * 40)
+
+    def test_get_cp_index(self):
+        self.lgr.add_cp([0x0061])
+        self.lgr.add_cp([0x0062])
+        self.lgr.add_cp([0x0063])
+        self.lgr.add_cp([0x0064], when='after-a')
+        self.lgr.add_cp([0x0065])
+        self.lgr.add_cp([0x0065, 0x0061])
+        self.lgr.add_variant([0x0062], [0x0061])
+        self.lgr.add_variant([0x0063], [0x0061], when='after-a')
+        rule = Rule(name='after-a')
+        look = LookBehindMatcher()
+        look.add_child(CharMatcher((0x0061,)))
+        rule.add_child(look)
+        rule.add_child(AnchorMatcher())
+        self.lgr.add_rule(rule)
+
+        self.assertEqual(self.lgr._get_cp_index(0x0061), (0x0061,))
+        self.assertEqual(self.lgr._get_cp_index(0x0062), (0x0061,))
+        # Context rules
+        self.assertIsNone(self.lgr._get_cp_index(0x0063))
+        self.assertIsNone(self.lgr._get_cp_index(0x0064))
+        # Sequence
+        self.assertIsNone(self.lgr._get_cp_index(0x0065))
+        # Not in LGR
+        self.assertIsNone(self.lgr._get_cp_index(0x0066))
+
+        self.assertEqual(self.lgr.generate_index_label([0x0063, 0x0062, 0x0061, 0x0063, 0x0065, 0x0061]),
+                         (0x0063, 0x0061, 0x0061, 0x0061, 0x0065, 0x0061))
+
+        # Modifying the LGR resets the table
+        self.lgr.add_variant([0x0061], [0x0030])
+        self.assertEqual(self.lgr._get_cp_index(0x0061), (0x0030,))
+
+    def test_generate_min_index_label_harmonization(self):
+        for name in ('hindi-rz.xml', 'nepali-rz.xml'):
+            lgr = load_lgr('harmonization', name, unidb=UnicodeDatabaseMock())
+            cps = [char.cp for char in lgr.repertoire]
+            for label in itertools.product(cps, repeat=3):
+                label = sum(label, ())
+                partitions = lgr._generate_label_partitions(label)
+                self.assertEqual(lgr._generate_min_index_label(label),
+                                 min(lgr._generate_index_label_on_partition(p) for p in partitions))
+
 
 
 if __name__ == '__main__':
@@ -4,13 +4,27 @@ test_rule.py - Unit testing of rule module.
 """
 from __future__ import unicode_literals
 
+import copy
+import gc
+import pickle
 import unittest
+import weakref
 
-from lgr.rule import Rule
+from lgr.rule import Rule, _regex_caches, clear_regex_cache, compile_rule_regex, regex_cache_info
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock, UnpicklableUnicodeDatabaseMock
 from lgr.matcher import (AnchorMatcher,
+                         AnyMatcher,
+                         ChoiceMatcher,
+                         ClassMatcher,
+                         EndMatcher,
                          LookAheadMatcher,
-                         CharMatcher)
+                         LookBehindMatcher,
+                         CharMatcher,
+                         RuleMatcher,
+                         StartMatcher)
+from lgr.classes import Class
 from lgr.exceptions import LGRFormatException
+from tests.unit.utils import load_lgr
 
 
 class TestRule(unittest.TestCase):
@@ -31,6 +45,89 @@ class TestRule(unittest.TestCase):
         self.assertEqual(self.rule.get_pattern({}, {}, None),
                          '%(anchor)s(?=\\x{2A})')
 
+    def test_window(self):
+        look_behind = LookBehindMatcher()
+        look_behind.add_child(StartMatcher())
+        look_behind.add_child(CharMatcher([0x002A, 0x002B]))
+        self.rule.add_child(look_behind)
+        self.rule.add_child(AnchorMatcher())
+        look_ahead = LookAheadMatcher()
+        look_ahead.add_child(ClassMatcher(Class(codepoints=[0x002C, 0x002D]), count='2'))
+        look_ahead.add_child(EndMatcher())
+        self.rule.add_child(look_ahead)
+        self.assertEqual(self.rule.get_window({}, 1), (2, 3))
+        self.assertEqual(self.rule.get_window({}, 2), (2, 4))
+
+    def test_window_unbounded(self):
+        self.rule.add_child(AnchorMatcher())
+        choice = ChoiceMatcher(count='1+')
+        choice.add_child(CharMatcher([0x002A]))
+        choice.add_child(AnyMatcher(count='1:3'))
+        self.rule.add_child(choice)
+        self.assertEqual(self.rule.get_window({}, 1), (0, None))
+
+        look_behind = LookBehindMatcher()
+        look_behind.add_child(RuleMatcher(self.rule))
+        rule = Rule('look-behind')
+        rule.add_child(look_behind)
+        # Count is bounded in look-behind
+        self.assertEqual(rule.get_window({}, 1), (1 + 3 * 63, 0))
+
+    def test_by_ref_window(self):
+        self.rule.add_child(CharMatcher([0x002A], count='2'))
+        rules_lookup = {
+            'test': self.rule
+        }
+        self.assertEqual(Rule(by_ref='test').get_window(rules_lookup, 1), (0, 2))
+
+    def test_precalculate_patterns_compile_regex(self):
+        unidb = UnicodeDatabaseMock()
+        self.rule.add_child(StartMatcher())
+        self.rule.add_child(CharMatcher([0x0061]))
+        self.rule.precalculate_patterns({}, {}, unidb)
+        self.assertIsNotNone(self.rule._compiled_regex)
+
+        misses = regex_cache_info(unidb).misses
+        self.assertTrue(self.rule.matches([0x0061, 0x0062], {}, {}, unidb))
+        self.assertFalse(self.rule.matches([0x0062, 0x0061], {}, {}, unidb))
+        self.assertEqual(regex_cache_info(unidb).misses, misses)
+
+    def test_anchor_regex_cache(self):
+        unidb = UnicodeDatabaseMock()
+        self.rule.add_child(AnchorMatcher())
+        self.rule.add_child(CharMatcher([0x0062]))
+        self.rule.precalculate_patterns({}, {}, unidb)
+        self.assertIsNone(self.rule._compiled_regex)
+
+        info = regex_cache_info(unidb)
+        self.assertTrue(self.rule.matches([0x0061, 0x0062], {}, {}, unidb, anchor=(0x0061,)))
+        self.assertTrue(self.rule.matches([0x0063, 0x0061, 0x0062], {}, {}, unidb, anchor=(0x0061,), index=1))
+        self.assertFalse(self.rule.matches([0x0063, 0x0063], {}, {}, unidb, anchor=(0x0063,)))
+        new_info = regex_cache_info(unidb)
+        self.assertEqual(new_info.misses, info.misses + 2)
+        self.assertEqual(new_info.hits, info.hits + 1)
+
+    def test_regex_cache_database(self):
+        unidb = UnicodeDatabaseMock()
+        other_unidb = UnicodeDatabaseMock()
+        (_, regex) = compile_rule_regex('\\x{61}', unidb)
+        self.assertIs(compile_rule_regex('\\x{61}', unidb)[1], regex)
+        self.assertIsNot(compile_rule_regex('\\x{61}', other_unidb)[1], regex)
+        self.assertEqual(regex_cache_info(unidb).currsize, 1)
+
+        clear_regex_cache()
+        self.assertEqual(regex_cache_info(unidb).currsize, 0)
+        self.assertEqual(regex_cache_info(other_unidb).currsize, 0)
+
+        # Cache is released with its Unicode database
+        key = id(unidb)
+        unidb_ref = weakref.ref(unidb)
+        del unidb
+        gc.collect()
+        self.assertIsNone(unidb_ref())
+        self.assertNotIn(key, _regex_caches)
+        self.assertIn(id(other_unidb), _regex_caches)
+
     def test_by_ref_rule(self):
         rules_lookup = {
             'test': self.rule
@@ -39,6 +136,64 @@ class TestRule(unittest.TestCase):
         self.assertEqual(by_ref_rule.get_pattern(rules_lookup, {}, None),
                          self.rule.get_pattern({}, {}, None))
 
+    def test_pattern_cache_revision(self):
+        self.rule.add_child(RuleMatcher(Rule(by_ref='other')))
+        other_rule = Rule('other')
+        other_rule.add_child(CharMatcher([0x0061]))
+        new_other_rule = Rule('other')
+        new_other_rule.add_child(CharMatcher([0x0062]))
+
+        self.assertEqual(self.rule.get_pattern({'other': other_rule}, {}, None, revision=1), '\\x{61}')
+        self.assertEqual(self.rule.get_pattern({'other': new_other_rule}, {}, None, revision=1), '\\x{61}')
+        # Not cached without revision, dropped on new revision
+        self.assertEqual(self.rule.get_pattern({'other': new_other_rule}, {}, None), '\\x{62}')
+        self.assertEqual(self.rule.get_pattern({'other': new_other_rule}, {}, None, revision=2), '\\x{62}')
+        self.assertEqual(pickle.loads(pickle.dumps(self.rule))._pattern_cache, (None, {}))
+
+    def test_pattern_cache_nested_rules(self):
+        self.rule.add_child(RuleMatcher(Rule(by_ref='other')))
+        look_behind = LookBehindMatcher()
+        nested_rule = Rule()
+        nested_rule.add_child(CharMatcher([0x0062]))
+        look_behind.add_child(RuleMatcher(nested_rule))
+        self.rule.add_child(look_behind)
+        choice = ChoiceMatcher()
+        choice.add_child(RuleMatcher(Rule(by_ref='other')))
+        choice.add_child(CharMatcher([0x0063]))
+        self.rule.add_child(choice)
+        other_rule = Rule('other')
+        other_rule.add_child(CharMatcher([0x0061]))
+
+        self.rule.get_pattern({'other': other_rule}, {}, None, revision=1)
+        # Revision is forwarded to the rules used by the rule
+        self.assertEqual(other_rule._pattern_cache, (1, {(None, False): '\\x{61}'}))
+        self.assertEqual(nested_rule._pattern_cache, (1, {(None, True): '\\x{62}'}))
+
+    def test_pattern_cache_parser(self):
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=UnicodeDatabaseMock())
+        self.assertTrue(lgr.rules_lookup)
+        for rule in lgr.rules_lookup.values():
+            (revision, cache) = rule._pattern_cache
+            self.assertEqual(revision, lgr.revision)
+            self.assertEqual(len(cache), 2)
+        patterns = {name: rule._pattern_cache[1].copy() for (name, rule) in lgr.rules_lookup.items()}
+        lgr.test_label_eligible([0x0061, 0x0062])
+        for (name, rule) in lgr.rules_lookup.items():
+            self.assertEqual(rule._pattern_cache, (lgr.revision, patterns[name]))
+
+    def test_pickle_compiled_regex(self):
+        unidb = UnpicklableUnicodeDatabaseMock()
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=unidb)
+        self.assertTrue(any(rule._compiled_regex is not None for rule in lgr.rules_lookup.values()))
+        self.assertRaises(TypeError, pickle.dumps, unidb)
+
+        expected = lgr.test_label_eligible([0x0061, 0x0062])
+        for new_lgr in (pickle.loads(pickle.dumps(lgr)), copy.deepcopy(lgr)):
+            for rule in new_lgr.rules_lookup.values():
+                self.assertIsNone(rule._compiled_regex)
+            new_lgr.unicode_database = unidb
+            self.assertEqual(new_lgr.test_label_eligible([0x0061, 0x0062]), expected)
+
     def test_no_name_by_ref_rule(self):
         with self.assertRaises(LGRFormatException) as exc_cm:
             Rule(name='this-will-fail', by_ref='test')
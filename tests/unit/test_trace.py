@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+test_trace.py - Unit testing of rule processing log collection.
+"""
+from __future__ import unicode_literals
+
+import logging
+import sys
+import unittest
+from unittest import mock
+
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.trace import QUIET_LEVEL, RuleTrace, rule_logger, _LOG_KWARGS
+from tests.unit.utils import load_lgr
+
+
+class TestRuleTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.level = rule_logger.level
+
+    def tearDown(self):
+        rule_logger.setLevel(self.level)
+
+    def test_collect(self):
+        rule_logger.setLevel(logging.DEBUG)
+        trace = RuleTrace(logging.INFO)
+        self.assertTrue(trace.debug_enabled)
+        trace.debug('debug %d', 1)
+        trace.info('info %d', 2)
+        trace.warning('warning')
+        self.assertEqual(trace.getvalue(), 'info 2\nwarning\n')
+
+    def test_collect_logger_level(self):
+        rule_logger.setLevel(logging.WARNING)
+        trace = RuleTrace(logging.DEBUG)
+        self.assertFalse(trace.debug_enabled)
+        self.assertFalse(trace.info_enabled)
+        with mock.patch.object(rule_logger, 'log') as log:
+            trace.info('info')
+            trace.error('error %s', 'message')
+        log.assert_called_once_with(logging.ERROR, 'error %s', 'message', **_LOG_KWARGS)
+        self.assertEqual(trace.getvalue(), 'error message\n')
+
+    def test_log_level(self):
+        rule_logger.setLevel(logging.DEBUG)
+        trace = RuleTrace(log_level=QUIET_LEVEL)
+        self.assertFalse(trace.debug_enabled)
+        self.assertFalse(trace.info_enabled)
+        with mock.patch.object(rule_logger, 'log') as log:
+            trace.debug('debug')
+            trace.info('info')
+            trace.warning('warning')
+        log.assert_called_once_with(logging.WARNING, 'warning', **_LOG_KWARGS)
+
+    def test_log_caller(self):
+        rule_logger.setLevel(logging.DEBUG)
+        trace = RuleTrace()
+        with self.assertLogs(rule_logger, logging.INFO) as logs:
+            trace.info('info')
+        self.assertEqual(logs.records[0].getMessage(), 'info')
+        if sys.version_info >= (3, 8):
+            self.assertEqual(_LOG_KWARGS, {'stacklevel': 3})
+            self.assertEqual(logs.records[0].funcName, 'test_log_caller')
+        else:
+            self.assertEqual(_LOG_KWARGS, {})
+
+    def test_no_collect(self):
+        rule_logger.setLevel(logging.DEBUG)
+        trace = RuleTrace()
+        trace.info('info')
+        self.assertEqual(trace.getvalue(), '')
+
+    def test_disabled_log_not_processed(self):
+        lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=UnicodeDatabaseMock())
+        labels = [(0x006F, 0x0065), (0x0063, 0x0064)]
+        # Whatever the logger level, debug and info messages are not processed without log collection
+        for level in (logging.WARNING, logging.DEBUG):
+            rule_logger.setLevel(level)
+            with mock.patch.object(rule_logger, 'log') as log, \
+                    mock.patch('lgr.core.format_cp') as core_format_cp, \
+                    mock.patch('lgr.rule.format_cp') as rule_format_cp, \
+                    mock.patch('lgr.action.format_cp') as action_format_cp:
+                for label in labels:
+                    self.assertTrue(lgr.test_label_eligible(label, collect_log=False)[0])
+                    for (_, _, _, _, _, variant_log) in lgr.compute_label_disposition(label, collect_log=False):
+                        self.assertEqual(variant_log, '')
+            # Only warnings of invalid variants reach the logger, each formatting its label
+            self.assertTrue(log.called)
+            self.assertTrue(all(call.args[0] >= logging.WARNING for call in log.call_args_list))
+            self.assertEqual(core_format_cp.call_count, log.call_count)
+            rule_format_cp.assert_not_called()
+            action_format_cp.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""
+test_annotate.py - Unit testing of annotation tools.
+"""
+from __future__ import unicode_literals
+
+import unittest
+
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.tools.annotate import lgr_set_annotate
+from tests.unit.utils import load_lgr
+
+
+class TestLGRSetAnnotate(unittest.TestCase):
+
+    def setUp(self):
+        self.lgr = load_lgr('idn_table_review', 'reference_lgr.xml', unidb=UnicodeDatabaseMock())
+
+    def test_set_labels_collisions(self):
+        output = ''.join(lgr_set_annotate(self.lgr, self.lgr, ['cd', 'œd', 'ee'],
+                                          ['oed', 'cd', 'dd', 'ee']))
+        self.assertIn('oed: not-match - Label collides with the LGR set labels\n', output)
+        self.assertIn('cd: not-match - Label is in the LGR set labels\n', output)
+        self.assertIn('dd: not-match\n', output)
+        self.assertIn('ee: not-match - Label is in the LGR set labels\n', output)
+
+    def test_colliding_set_labels(self):
+        output = ''.join(lgr_set_annotate(self.lgr, self.lgr, ['œd', 'oed'], ['cd', 'dd']))
+        self.assertIn('cd: not-match - Label collides with the LGR set labels\n', output)
+        self.assertIn('dd: not-match - Label collides with the LGR set labels\n', output)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+test_diff_collisions.py - Unit testing of collision tools.
+"""
+from __future__ import unicode_literals
+
+import itertools
+import unittest
+from unittest import mock
+
+from lgr.action import Action
+from lgr.core import LGR
+from lgr.exceptions import LGRApiInvalidParameter
+from lgr.rule import Rule
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.tools import diff_collisions
+from lgr.tools.diff_collisions import _generate_indexes, _sort_by_index, affected_code_points, basic_collision, diff
+
+LABELS = ['ab', 'bb', 'ca', 'cb', 'ea', 'cd', 'dc', 'aa', 'z', 'ba', 'cc']
+TLDS = {'ae', 'dd', 'ff'}
+
+
+def _make_lgr():
+    lgr = LGR(unicode_database=UnicodeDatabaseMock())
+    for cp in range(0x0061, 0x0067):
+        lgr.add_cp([cp])
+    for (cp, var) in itertools.permutations([0x0061, 0x0062, 0x0065], 2):
+        lgr.add_variant([cp], [var], variant_type='blocked')
+    lgr.add_variant([0x0063], [0x0064], variant_type='blocked')
+    lgr.add_variant([0x0064], [0x0063], variant_type='blocked')
+    return lgr
+
+
+class TestCollisions(unittest.TestCase):
+
+    def setUp(self):
+        self.lgr = _make_lgr()
+
+    def test_sort_by_index(self):
+        records = [((idx,), label) for label, idx in enumerate([3, 1, 2, 1, 3, 0, 2, 1, 3, 0])]
+        expected = sorted(records, key=lambda r: r[0])
+        for max_records in (1, 3, 10, 11):
+            self.assertListEqual(list(_sort_by_index(records, max_records)), expected)
+        self.assertRaises(LGRApiInvalidParameter, _sort_by_index, records, 0)
+
+    def test_sort_by_index_bounded_merge(self):
+        records = [((idx % 7,), label) for label, idx in enumerate(range(100, 0, -1))]
+        expected = sorted(records, key=lambda r: r[0])
+        spill_run = diff_collisions._spill_run
+        runs = []
+        open_runs = []
+
+        def count_open_runs(run_records):
+            runs.append(spill_run(run_records))
+            open_runs.append(len([r for r in runs if not r.closed]))
+            return runs[-1]
+
+        with mock.patch('lgr.tools.diff_collisions.MAX_MERGED_RUNS', 3), \
+                mock.patch('lgr.tools.diff_collisions._spill_run', side_effect=count_open_runs):
+            self.assertListEqual(list(_sort_by_index(records, 2)), expected)
+        # 50 runs of 2 records, merged by 3
+        self.assertGreater(len(runs), 50)
+        self.assertLessEqual(max(open_runs), 12)
+        self.assertTrue(all(r.closed for r in runs))
+
+    def test_generate_indexes_external_sort(self):
+        for keep, quiet in ((False, True), (False, False), (True, True)):
+            expected = _generate_indexes(self.lgr, LABELS, tlds=TLDS, keep=keep, quiet=quiet)
+            for max_labels in (1, 4, 100):
+                label_indexes, not_in_lgr = _generate_indexes(self.lgr, LABELS, tlds=TLDS, keep=keep, quiet=quiet,
+                                                              max_labels_in_memory=max_labels)
+                self.assertDictEqual(label_indexes, expected[0])
+                self.assertListEqual(list(label_indexes), sorted(label_indexes))
+                self.assertListEqual(not_in_lgr, expected[1])
+        self.assertEqual(set(expected[0]), {(0x0061, 0x0061), (0x0063, 0x0061), (0x0063, 0x0063), (0x0066, 0x0066)})
+        self.assertListEqual(expected[1], ['z'])
+
+    def test_basic_collision_workers(self):
+        expected = ''.join(basic_collision(self.lgr, LABELS, TLDS))
+        self.assertRegex(expected, '(cd: collides with label dc|dc: collides with label cd)\n')
+        output = ''.join(basic_collision(self.lgr, LABELS, TLDS, workers=2, max_labels_in_memory=3))
+        self.assertListEqual(sorted(output.splitlines()), sorted(expected.splitlines()))
+
+    def test_duplicate_primary_labels(self):
+        labels = ['ab', 'ba', 'ab', 'cd', 'cd']
+        for keep, quiet in ((False, True), (False, False), (True, False)):
+            expected = _generate_indexes(self.lgr, ['ab', 'ba', 'cd'], keep=keep, quiet=quiet)
+            for max_labels in (None, 1):
+                label_indexes, not_in_lgr = _generate_indexes(self.lgr, labels, keep=keep, quiet=quiet,
+                                                              max_labels_in_memory=max_labels)
+                self.assertDictEqual(label_indexes, expected[0])
+                self.assertListEqual(not_in_lgr, [])
+                # Each primary label is kept once
+                for index_labels in label_indexes.values():
+                    primaries = [l['label'] for l in index_labels if l['cat'] == 'Primary']
+                    self.assertEqual(len(primaries), len(set(primaries)))
+        output = ''.join(basic_collision(self.lgr, labels, set()))
+        self.assertRegex(output, '^# Collisions #\n\n(ab: collides with label ba|ba: collides with label ab)\n$')
+
+
+
+class TestAffectedLabels(unittest.TestCase):
+
+    def setUp(self):
+        self.lgr_1 = _make_lgr()
+        self.lgr_2 = _make_lgr()
+
+    def test_affected_code_points(self):
+        self.assertSetEqual(affected_code_points(self.lgr_1, self.lgr_2), set())
+
+        self.lgr_2.add_cp([0x0067])
+        self.lgr_2.add_cp([0x0066, 0x0061])
+        self.lgr_2.del_variant([0x0064], [0x0063])
+        # 0x0063 has a variant to the changed 0x0064
+        self.assertSetEqual(affected_code_points(self.lgr_1, self.lgr_2), {0x0063, 0x0064, 0x0066, 0x0067})
+
+        # Rules changes affect chars with context rules
+        self.lgr_1.add_rule(Rule(name='rule'))
+        self.lgr_1.add_cp([0x0068], when='rule')
+        self.lgr_2.add_rule(Rule(name='rule'))
+        self.lgr_2.add_cp([0x0068], when='rule')
+        self.assertSetEqual(affected_code_points(self.lgr_1, self.lgr_2), {0x0063, 0x0064, 0x0066, 0x0067, 0x0068})
+
+        self.lgr_2.add_action(Action(disp='invalid', comment='test', any_variant=['blocked']))
+        self.assertIsNone(affected_code_points(self.lgr_1, self.lgr_2))
+
+    def test_affected_code_points_variant_changed(self):
+        lgr_1 = LGR(unicode_database=UnicodeDatabaseMock())
+        lgr_2 = LGR(unicode_database=UnicodeDatabaseMock())
+        for lgr in (lgr_1, lgr_2):
+            lgr.add_cp([0x0061])
+            lgr.add_cp([0x0063])
+            lgr.add_cp([0x0063, 0x0064])
+            lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        lgr_1.add_cp([0x0062])
+        self.assertSetEqual(affected_code_points(lgr_1, lgr_2), {0x0061, 0x0062})
+
+        lgr_2.add_cp([0x0062])
+        lgr_2.add_cp([0x0064])
+        # Sequence containing a changed code point
+        self.assertSetEqual(affected_code_points(lgr_1, lgr_2), {0x0063, 0x0064})
+
+    def test_diff_only_affected_variant_changed(self):
+        lgr_1 = LGR(unicode_database=UnicodeDatabaseMock())
+        lgr_2 = LGR(unicode_database=UnicodeDatabaseMock())
+        for lgr in (lgr_1, lgr_2):
+            lgr.add_cp([0x0061])
+            lgr.add_cp([0x0063])
+            lgr.add_variant([0x0061], [0x0062], variant_type='blocked')
+        lgr_1.add_cp([0x0062])
+        labels = ['ac', 'ca']
+        full = ''.join(diff(lgr_1, lgr_2, labels, show_dump=True))
+        output = ''.join(diff(lgr_1, lgr_2, labels, show_dump=True, only_affected=True))
+        self.assertIn('2 labels out of 2 can be affected.', output)
+        for label in labels:
+            self.assertIn("## Comparison on label \u2066'{}'\u2069".format(label), full)
+            self.assertIn("## Comparison on label \u2066'{}'\u2069".format(label), output)
+
+    def test_diff_only_affected(self):
+        self.lgr_2.del_variant([0x0063], [0x0064])
+        self.lgr_2.del_variant([0x0064], [0x0063])
+        output = ''.join(diff(self.lgr_1, self.lgr_2, LABELS, show_dump=True, only_affected=True))
+        self.assertIn('5 labels out of 11 can be affected.', output)
+        self.assertCountEqual([line.split()[4] for line in output.splitlines()
+                               if line.startswith('## Comparison on label')],
+                              ["\u2066'ca'\u2069", "\u2066'cb'\u2069", "\u2066'cc'\u2069",
+                               "\u2066'cd'\u2069", "\u2066'dc'\u2069"])
+        collisions = output.split('# Collisions for LGR2 #')[1]
+        # Collisions with unaffected labels are still reported
+        self.assertIn("\u2066'ab'\u2069", collisions)
+        self.assertIn("\u2066'cd'\u2069", output.split('# Collisions for LGR1 #')[1].split('# Summary')[0])
+        self.assertNotIn("\u2066'cd'\u2069", collisions.split('# Summary')[0])
+        self.assertIn('Label z', output)
+
+    def test_diff_index_computed_once(self):
+        self.lgr_2.del_variant([0x0063], [0x0064])
+        self.lgr_2.del_variant([0x0064], [0x0063])
+        for only_affected, nb_labels_2 in ((False, len(LABELS)), (True, 5)):
+            with mock.patch.object(self.lgr_1, 'generate_index_label',
+                                   wraps=self.lgr_1.generate_index_label) as index_1, \
+                    mock.patch.object(self.lgr_2, 'generate_index_label',
+                                      wraps=self.lgr_2.generate_index_label) as index_2:
+                output = ''.join(diff(self.lgr_1, self.lgr_2, LABELS, only_affected=only_affected))
+            self.assertIn("## Comparison on label \u2066'cd'\u2069", output)
+            self.assertEqual(index_1.call_count, len(LABELS))
+            self.assertEqual(index_2.call_count, nb_labels_2)
+
+
+if __name__ == '__main__':
+    unittest.main()
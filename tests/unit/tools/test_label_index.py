@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+test_label_index.py - Unit testing of label inverted index.
+"""
+from __future__ import unicode_literals
+
+import unittest
+from array import array
+
+from lgr.core import LGR
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.tools.label_index import LabelIndex
+
+
+class TestLabelIndex(unittest.TestCase):
+
+    def test_get_labels(self):
+        index = LabelIndex([(0x0061, 0x0062), (0x0063,), (0x0062, 0x0062, 0x0064)])
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.add([0x0065, 0x0061]), 3)
+        self.assertListEqual(index.get_label_ids([0x0062]), [0, 2])
+        self.assertListEqual(index.get_labels([0x0061, 0x0064]), [(0x0061, 0x0062), (0x0062, 0x0062, 0x0064),
+                                                                   (0x0065, 0x0061)])
+        self.assertListEqual(index.get_labels([0x0066]), [])
+        self.assertIsInstance(index._postings[0x0062], array)
+
+    def test_get_sequence_label_ids(self):
+        index = LabelIndex([(0x0061, 0x0062), (0x0062, 0x0061), (0x0061, 0x0063, 0x0062), (0x0063, 0x0061, 0x0062)])
+        self.assertListEqual(index.get_sequence_label_ids([0x0061, 0x0062]), [0, 3])
+        self.assertListEqual(index.get_sequence_label_ids([0x0062]), [0, 1, 2, 3])
+        self.assertListEqual(index.get_sequence_label_ids([0x0061, 0x0064]), [])
+        self.assertListEqual(index.get_sequence_label_ids([]), [0, 1, 2, 3])
+        self.assertListEqual(LabelIndex().get_sequence_label_ids([]), [])
+
+    def test_get_variant_label_ids(self):
+        lgr = LGR(unicode_database=UnicodeDatabaseMock())
+        for cp in range(0x0061, 0x0066):
+            lgr.add_cp([cp])
+        lgr.add_cp([0x0063, 0x0064])
+        lgr.add_variant([0x0061], [0x0063, 0x0064])
+        lgr.add_variant([0x0061], [0x0065])
+        index = LabelIndex.from_labels_input(['ab', 'cd', 'dc', 'be', '# comment', 'bb'], lgr.unicode_database)
+        self.assertEqual(len(index), 5)
+        self.assertListEqual(index.get_variant_label_ids(lgr, 0x0061), [0, 1, 3])
+        self.assertListEqual(index.get_variant_label_ids(lgr, [0x0062]), [0, 3, 4])
+        self.assertListEqual(index.get_variant_label_ids(lgr, 0x0066), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+test_registry.py - Unit testing of label registry.
+"""
+from __future__ import unicode_literals
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from lgr.core import LGR
+from lgr.exceptions import NotInLGR
+from lgr.test_utils.unicode_database_mock import UnicodeDatabaseMock
+from lgr.tools.registry import LabelRegistry, MemoryLabelStore, SQLiteLabelStore, lgr_content_hash
+
+
+class TestLabelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.lgr = LGR(unicode_database=UnicodeDatabaseMock())
+        for cp in range(0x0061, 0x0066):
+            self.lgr.add_cp([cp])
+        self.lgr.add_variant([0x0061], [0x0062])
+        self.lgr.add_variant([0x0062], [0x0061])
+
+    def _check_registry(self, registry):
+        self.assertEqual(registry.add([0x0062, 0x0063]), (0x0061, 0x0063))
+        self.assertEqual(registry.add([0x0061, 0x0063]), (0x0061, 0x0063))
+        self.assertEqual(registry.add([0x0063, 0x0064]), (0x0063, 0x0064))
+        self.assertEqual(len(registry), 3)
+        self.assertIn([0x0061, 0x0063], registry)
+        self.assertEqual(registry.get_index([0x0062, 0x0063]), (0x0061, 0x0063))
+
+        self.assertEqual(registry.get_collisions([0x0061, 0x0063]), {(0x0062, 0x0063)})
+        self.assertEqual(registry.get_collisions([0x0063, 0x0064]), set())
+        # Label not registered
+        self.assertEqual(registry.get_collisions([0x0062, 0x0063]), {(0x0061, 0x0063)})
+        self.assertEqual(registry.get_collisions([0x0061, 0x0061]), set())
+        self.assertRaises(NotInLGR, registry.get_collisions, [0x0066])
+        self.assertRaises(NotInLGR, registry.add, [0x0066])
+
+        registry.remove([0x0062, 0x0063])
+        self.assertNotIn([0x0062, 0x0063], registry)
+        self.assertEqual(registry.get_collisions([0x0061, 0x0063]), set())
+        self.assertRaises(KeyError, registry.get_index, [0x0062, 0x0063])
+
+    def test_memory_store(self):
+        self._check_registry(LabelRegistry(self.lgr))
+
+    def test_sqlite_store(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'registry.sqlite')
+            store = SQLiteLabelStore(path)
+            self._check_registry(LabelRegistry(self.lgr, store=store))
+            store.close()
+
+            # Labels are persisted with the LGR hash
+            store = SQLiteLabelStore(path)
+            self.assertEqual(store.lgr_hash, lgr_content_hash(self.lgr))
+            registry = LabelRegistry(self.lgr, store=store)
+            self.assertEqual(len(registry), 2)
+            self.assertEqual(registry.get_collisions([0x0062, 0x0063]), {(0x0061, 0x0063)})
+            store.close()
+
+    def test_rebuild_on_lgr_change(self):
+        registry = LabelRegistry(self.lgr)
+        registry.add([0x0061, 0x0064])
+        registry.add([0x0062, 0x0065])
+        registry.add([0x0063])
+        self.assertEqual(registry.get_collisions([0x0061, 0x0064]), set())
+
+        self.lgr.add_variant([0x0064], [0x0065])
+        self.lgr.add_variant([0x0065], [0x0064])
+        self.lgr.del_cp([0x0063])
+        registry = LabelRegistry(self.lgr, store=registry.store)
+        self.assertEqual(registry.get_collisions([0x0061, 0x0064]), {(0x0062, 0x0065)})
+        self.assertIsNone(registry.get_index([0x0063]))
+        self.assertEqual(registry.rebuild(), [(0x0063,)])
+
+
+    def test_rebuild_on_lgr_modification(self):
+        registry = LabelRegistry(self.lgr)
+        registry.add([0x0061, 0x0064])
+        registry.add([0x0062, 0x0065])
+        lgr_hash = registry.lgr_hash
+
+        self.lgr.add_variant([0x0064], [0x0065])
+        self.lgr.add_variant([0x0065], [0x0064])
+        self.assertEqual(registry.get_collisions([0x0061, 0x0064]), {(0x0062, 0x0065)})
+        self.assertEqual(registry.get_index([0x0062, 0x0065]), (0x0061, 0x0064))
+        self.assertNotEqual(registry.lgr_hash, lgr_hash)
+        self.assertEqual(registry.store.lgr_hash, registry.lgr_hash)
+
+        # Hash is only computed again when the LGR is modified
+        with mock.patch('lgr.tools.registry.lgr_content_hash') as content_hash:
+            registry.add([0x0063])
+            registry.get_collisions([0x0063])
+        content_hash.assert_not_called()
+
+    def test_rebuild_single_transaction(self):
+        labels = [(0x0061, 0x0064), (0x0062, 0x0065), (0x0063,)]
+        for store in (MemoryLabelStore(), SQLiteLabelStore(':memory:')):
+            registry = LabelRegistry(self.lgr, store=store)
+            for label in labels:
+                registry.add(label)
+            self.lgr.add_variant([0x0064], [0x0065])
+            with mock.patch.object(store, 'add', wraps=store.add) as add, \
+                    mock.patch.object(store, 'add_many', wraps=store.add_many) as add_many:
+                registry.rebuild()
+            add_many.assert_called_once()
+            if isinstance(store, SQLiteLabelStore):
+                add.assert_not_called()
+                store.close()
+            self.lgr.del_variant([0x0064], [0x0065])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -23,6 +23,8 @@ def main():
                         help='File path to output the annotated labels',
                         required=True)
     parser.add_xml_set_args()
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=1,
+                        help='Number of processes used to annotate the labels (default: 1, 0 for all cores)')
     parser.add_argument('labels', metavar='LABELS', help='File path to the reference labels to annotate')
 
     args = parser.parse_args()
@@ -38,7 +40,8 @@ def main():
                 for out in lgr_set_annotate(parser.merged_lgr, parser.script_lgr, parser.set_labels, labels_input):
                     labels_output.write(out)
             else:
-                for out in annotate(parser.lgr, labels_input):
+                for out in annotate(parser.lgr, labels_input,
+                                    workers=args.jobs, unidb_factory=parser.get_unidb_factory()):
                     labels_output.write(out)
 
 
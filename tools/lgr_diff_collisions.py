@@ -33,8 +33,18 @@ def main():
     parser.add_argument('-n', '--no-rules', action='store_true',
                         help='Do not print rules as it may be very very '
                              'verbose (None will be printed instead)')
+    parser.add_argument('-a', '--only-affected', action='store_true',
+                        help='Only compare the labels that can be affected by the changes between the LGRs')
+    parser.add_argument('-j', '--jobs', metavar='JOBS', type=int, default=1,
+                        help='Number of processes used to compute the index labels '
+                             '(default: 1, 0 for all cores)')
+    parser.add_argument('-m', '--max-labels-in-memory', metavar='MAX_LABELS', type=int,
+                        help='Maximum number of labels grouped by index label in memory for collisions, '
+                             'labels are sorted on disk above (default: no limit)')
 
     args = parser.parse_args()
+    if args.max_labels_in_memory is not None and args.max_labels_in_memory < 1:
+        parser.error('argument -m/--max-labels-in-memory: must be at least 1')
     parser.setup_logger()
 
     unidb = parser.get_unidb()
@@ -60,10 +70,13 @@ def main():
     with io.open(args.set, 'r', encoding='utf-8') as label_input:
         if lgr2:
             for out in diff(lgr1, lgr2, label_input, True, args.generate,
-                            args.no_rules):
+                            args.no_rules, only_affected=args.only_affected,
+                            workers=args.jobs, unidb_factory=parser.get_unidb_factory()):
                 write_output(out)
         else:
-            for out in collision(lgr1, label_input, None, args.generate, args.no_rules):
+            for out in collision(lgr1, label_input, None, args.generate, args.no_rules,
+                                 workers=args.jobs, max_labels_in_memory=args.max_labels_in_memory,
+                                 unidb_factory=parser.get_unidb_factory()):
                 write_output(out)
 
 